@@ -9,7 +9,7 @@
 
 import sys
 import argparse
-from impdar.lib import load, process, plot, convert
+from impdar.lib import load, process, plot, convert, Streaming
 
 
 def _get_args():
@@ -26,11 +26,13 @@ def _get_args():
                              help='Receiver channel to load, \
                                      this is primarily for the St. Olaf HF data.')
     parser_load.add_argument('-o', type=str, help='Write to this filename')
+    parser_load.add_argument('-j', type=int, default=1, dest='n_jobs',
+                             help='Number of files to load at once (in separate processes)')
 
     # Options for processing data
     parser_proc = subparsers.add_parser('proc', help='Process data')
     parser_proc.set_defaults(func=process.process_and_exit)
-    parser_load.add_argument('--filetype', type=str,
+    parser_proc.add_argument('--filetype', type=str,
                              help='Type of file',
                              default='mat',
                              choices=load.FILETYPE_OPTIONS)
@@ -67,9 +69,42 @@ def _get_args():
                              help='Denoising filter (scipy wiener for now)')
     parser_proc.add_argument('-migrate', type=str,
                              help='Migrate the data with the indicated routine.')
+    parser_proc.add_argument('-j', type=int, default=1, dest='n_jobs',
+                             help='Number of files to process at once (in separate processes)')
+    parser_proc.add_argument('--cache', type=str, default=None,
+                             help='Cache the data after each step in this directory, \
+                                     so that reruns only redo the steps that changed')
+    parser_proc.add_argument('--cache_size', type=float, default=10.,
+                             help='Size limit of the cache, in GB')
+    parser_proc.add_argument('--dry_run', action='store_true',
+                             help='Print the processing steps and estimated peak memory, \
+                                     but do not process anything')
+    parser_proc.add_argument('--out_of_core', action='store_true',
+                             help='Process a block of traces at a time, for files too large for memory. \
+                                     Outputs are h5.')
     parser_proc.add_argument('fn', type=str, nargs='+', help='File(s) to process')
     parser_proc.add_argument('-o', type=str, help='Write to this filename')
 
+    # Processing files as they are acquired
+    parser_stream = subparsers.add_parser('stream', help='Process a file while it is being recorded')
+    parser_stream.set_defaults(func=Streaming.stream_and_save)
+    parser_stream.add_argument('fn', type=str, help='File to follow')
+    parser_stream.add_argument('--filetype', type=str, default='gssi', choices=['gssi', 'gecko'],
+                               help='Type of file')
+    parser_stream.add_argument('-dc', action='store_true', help='Subtract the mean of each trace')
+    parser_stream.add_argument('-vbp', nargs=2, type=float,
+                               help='Bandpass the data vertically at low (MHz) and high (MHz)')
+    parser_stream.add_argument('-restack', type=int, help='Restack to this (odd) number of traces')
+    parser_stream.add_argument('-rgain', type=float, help='Apply a linear range gain with this slope')
+    parser_stream.add_argument('-plot', action='store_true', help='Show the processed data as they arrive')
+    parser_stream.add_argument('-channel', type=int, default=1,
+                               help='Receiver channel to use, for St. Olaf data')
+    parser_stream.add_argument('--poll', type=float, default=1.,
+                               help='Seconds between checks for new traces')
+    parser_stream.add_argument('--timeout', type=float, default=10.,
+                               help='Stop after this many seconds without new traces')
+    parser_stream.add_argument('-o', type=str, help='Write to this filename (h5)')
+
     # plotting
     parser_plot = subparsers.add_parser('plot', help='Plot data')
     parser_plot.set_defaults(func=plot.plot)
@@ -92,7 +127,7 @@ def _get_args():
     parser_convert = subparsers.add_parser('convert', help='Convert filetype (potentially lossy)')
     parser_convert.set_defaults(func=convert.convert)
     parser_convert.add_argument('fns_in', type=str, nargs='+', help='File(s) to convert')
-    parser_convert.add_argument('out_fmt', type=str, choices=['shp', 'mat', 'segy'])
+    parser_convert.add_argument('out_fmt', type=str, choices=['shp', 'mat', 'segy', 'h5'])
     parser_convert.add_argument('-in_fmt', type=str, default=None,
                                 choices=load.FILETYPE_OPTIONS,
                                 help='Input format type. If none, guess from extension')
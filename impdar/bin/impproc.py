@@ -57,6 +57,8 @@ def _get_args():
     # Automatic range gain
     parser_agc = add_procparser(subparsers, 'agc', 'Add an automatic gain', agc, defname='agc')
     parser_agc.add_argument('-window', type=int, default=50, help='Number of samples to average')
+    parser_agc.add_argument('-per_trace', action='store_true', help='Gain each trace by its own windowed amplitude')
+    parser_agc.add_argument('-amp', choices=['max', 'rms'], default='max', help='Windowed amplitude used with -per_trace. Default max')
     add_def_args(parser_agc)
 
     # Vertical bandpass
@@ -115,11 +117,15 @@ def _get_args():
     parser_mig.add_argument('--vel', type=float, default=1.69e8, help='Speed of light in dielectric medium m/s (default is for ice, 1.69e8)')
     parser_mig.add_argument('--vel_fn', type=str, default=None, help='Filename for inupt velocity array. Column 1: velocities, Column 2: z locations, Column 3: x locations (optional)')
     parser_mig.add_argument('--nearfield', action='store_true', help='Boolean for nearfield operator in Kirchhoff migration.')
+    parser_mig.add_argument('--max_offset', type=float, default=None, help='Maximum lateral offset (aperture) for Kirchhoff migration, in units of dist. Default is the full profile')
     parser_mig.add_argument('--htaper', type=int, default=100, help='Number of samples for horizontal taper')
     parser_mig.add_argument('--vtaper', type=int, default=1000, help='Number of samples for vertical taper')
     parser_mig.add_argument('--nxpad', type=int, default=100, help='Number of traces to pad with zeros for FFT')
     parser_mig.add_argument('--tmig', type=int, default=0, help='Times for velocity profile')
     parser_mig.add_argument('--verbose', type=int, default=1, help='Print output from SeisUnix migration')
+    parser_mig.add_argument('--n_jobs', type=int, default=1, help='Number of threads for stolt and phsh migration')
+    parser_mig.add_argument('--pad', action='store_true', help='Zero pad to powers of two in x and t before the FFT in stolt migration')
+    parser_mig.add_argument('--refine', type=int, default=2, help='Factor by which to refine the finite-difference time step in tk migration')
     add_def_args(parser_mig)
 
     return parser
@@ -155,11 +161,12 @@ def main():
         parser.parse_args(['-h'])
 
     radar_data = load(args.ftype, args.fns)
+    ext = '.h5' if args.ftype == 'h5' else '.mat'
 
     if args.name == 'cat':
         radar_data = concat(radar_data)
         bn = os.path.splitext(args.fns[0])[0]
-        args.fns = [bn + '.mat']
+        args.fns = [bn + ext]
     elif args.name == 'interp':
         interp(radar_data, **vars(args))
     else:
@@ -172,7 +179,7 @@ def main():
                 bn = os.path.split(os.path.splitext(f)[0])[1]
                 if bn[-4:] == '_raw':
                     bn = bn[:-4]
-                out_fn = os.path.join(args.o, bn + '_{:s}.mat'.format(args.name))
+                out_fn = os.path.join(args.o, bn + '_{:s}'.format(args.name) + ext)
                 d.save(out_fn)
         else:
             out_fn = args.o
@@ -182,7 +189,7 @@ def main():
             bn = os.path.splitext(f)[0]
             if bn[-4:] == '_raw':
                 bn = bn[:-4]
-            out_fn = bn + '_{:s}.mat'.format(args.name)
+            out_fn = bn + '_{:s}'.format(args.name) + ext
             d.save(out_fn)
 
 
@@ -226,8 +233,8 @@ def rgain(dat, slope=0.1, **kwargs):
     dat.rangegain(slope)
 
 
-def agc(dat, window=50, scale_factor=50, **kwargs):
-    dat.agc(window=window, scaling_factor=scale_factor)
+def agc(dat, window=50, scale_factor=50, per_trace=False, amp='max', **kwargs):
+    dat.agc(window=window, scaling_factor=scale_factor, per_trace=per_trace, amp=amp)
 
 
 def interp(dats, spacing, gps_fn, offset=0.0, minmove=1.0e-2, extrapolate=False, **kwargs):
@@ -242,8 +249,8 @@ def denoise(dat, vert_win=1, hor_dim=10, noise=None, ftype='wiener', **kwargs):
     dat.denoise(vert_win=vert_win, hor_dim=hor_dim, noise=noise, ftype=ftype)
 
 
-def mig(dat, mtype='stolt', vel=1.69e8, vtaper=100, htaper=100, tmig=0, verbose=0, vel_fn=None, nxpad=1, nearfield=False, **kwargs):
-    dat.migrate(mtype, vel=vel, vtaper=vtaper, htaper=htaper, tmig=tmig, verbose=verbose, vel_fn=vel_fn, nxpad=nxpad, nearfield=nearfield)
+def mig(dat, mtype='stolt', vel=1.69e8, vtaper=100, htaper=100, tmig=0, verbose=0, vel_fn=None, nxpad=1, nearfield=False, max_offset=None, n_jobs=1, pad=False, refine=2, **kwargs):
+    dat.migrate(mtype, vel=vel, vtaper=vtaper, htaper=htaper, tmig=tmig, verbose=verbose, vel_fn=vel_fn, nxpad=nxpad, nearfield=nearfield, max_offset=max_offset, n_jobs=n_jobs, pad=pad, refine=refine)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,245 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+An array-like stand-in for RadarData.data that reads traces from disk only when they are used.
+"""
+
+import numpy as np
+from scipy.io import loadmat, whosmat
+
+
+class LazyData(np.lib.mixins.NDArrayOperatorsMixin):
+    """Radar data that are read on demand from a (memory-mapped) raw array.
+
+    Indexing reads only the traces (columns) that are asked for, applying any corrections
+    the loader needs (e.g. offsets or header samples) to just those traces. Anything that
+    needs the whole array (numpy functions, arithmetic, methods like mean or copy) gets
+    a fully-read ndarray. Writing into the data reads everything into memory once, after
+    which this behaves like the in-memory array.
+
+    Parameters
+    ----------
+    raw: array-like
+        (snum x tnum) raw data, usually a np.memmap. Slicing this should be cheap.
+    func: callable, optional
+        Applied to every (snum x n) block of raw traces that is read. Must not change the shape.
+    dtype: np.dtype, optional
+        The dtype returned by func. Default is the dtype of raw.
+    whole: bool, optional
+        raw can only be read all at once (e.g. a :class:`MatVariable`), so the first read
+        reads everything into memory. Default False.
+    """
+
+    def __init__(self, raw, func=None, dtype=None, whole=False):
+        self._raw = raw
+        self._func = func
+        self._dtype = np.dtype(dtype) if dtype is not None else raw.dtype
+        self._whole = whole
+        self._array = None
+
+    @property
+    def shape(self):
+        """The shape of the full data array"""
+        return self._raw.shape
+
+    @property
+    def dtype(self):
+        """The dtype of the (corrected) data"""
+        if self._array is not None:
+            return self._array.dtype
+        return self._dtype
+
+    @property
+    def ndim(self):
+        return len(self.shape)
+
+    @property
+    def size(self):
+        return int(np.prod(self.shape))
+
+    @property
+    def materialized(self):
+        """True if the data have been read fully into memory"""
+        return self._array is not None
+
+    def __len__(self):
+        return self.shape[0]
+
+    def _read(self, cols):
+        """Read and correct the traces given by the slice or index array cols"""
+        block = np.array(self._raw[:, cols])
+        if self._func is not None:
+            block = self._func(block)
+        return block.astype(self._dtype, copy=False)
+
+    def materialize(self):
+        """Read all the data into memory, and use that copy from here on out
+
+        Returns
+        -------
+        np.ndarray
+            The full data array
+        """
+        if self._array is None:
+            self._array = self._read(slice(None))
+        return self._array
+
+    def __getitem__(self, key):
+        if self._array is not None or self._whole:
+            return self.materialize()[key]
+        if not isinstance(key, tuple):
+            key = (key, )
+        if len(key) > 2 or any(k is Ellipsis or k is None for k in key):
+            return np.asarray(self)[key]
+        rows = key[0]
+        cols = key[1] if len(key) == 2 else slice(None)
+        if isinstance(cols, (int, np.integer)):
+            cols = range(self.shape[1])[cols]
+            return self._read(slice(cols, cols + 1))[:, 0][rows]
+        return self._read(cols)[rows, :]
+
+    def __setitem__(self, key, value):
+        self.materialize()[key] = value
+
+    def __array__(self, dtype=None, copy=None):
+        if self._whole:
+            self.materialize()
+        arr = self._array if self._array is not None else self._read(slice(None))
+        if dtype is not None:
+            return arr.astype(dtype, copy=False)
+        return arr
+
+    def __array_ufunc__(self, ufunc, method, *inputs, **kwargs):
+        inputs = [np.asarray(inp) if isinstance(inp, LazyData) else inp for inp in inputs]
+        out = kwargs.get('out', ())
+        if out:
+            kwargs['out'] = tuple(o.materialize() if isinstance(o, LazyData) else o for o in out)
+        result = getattr(ufunc, method)(*inputs, **kwargs)
+        if out and isinstance(out[0], LazyData):
+            return out[0]
+        return result
+
+    def __getattr__(self, name):
+        # Everything else that an ndarray can do needs the whole thing
+        if name.startswith('_'):
+            raise AttributeError(name)
+        return getattr(np.asarray(self), name)
+
+    def __repr__(self):
+        return 'LazyData(shape={:s}, dtype={:s}, materialized={:s})'.format(str(self.shape), str(self.dtype), str(self.materialized))
+
+
+class FileWindow:
+    """A window onto a 2D variable in a file, sliced like an array of the window's shape
+
+    This is used as the raw array of a :class:`LazyData` for formats (netCDF, HDF5) that
+    can read parts of a variable. Only the rows and columns that are asked for are read.
+    It pickles by filename, so it can be sent to other processes. The file is held open
+    until :meth:`close` is called or the window is garbage collected.
+
+    Parameters
+    ----------
+    fn: str
+        The file
+    varname: str
+        The name of the variable in the file
+    rows: slice
+        The rows (samples) of the variable in the window
+    cols: slice
+        The columns (traces) of the variable in the window
+    opener: callable
+        opener(fn, varname) returns the open file, which must have a close method, and the
+        variable, which must have shape and dtype and accept slices or increasing integer
+        arrays as indices. Must be picklable.
+    """
+
+    def __init__(self, fn, varname, rows, cols, opener):
+        self.fn = fn
+        self.varname = varname
+        self.rows = rows
+        self.cols = cols
+        self.opener = opener
+        self._file = None
+        self._open()
+
+    def _open(self):
+        self._file, self._var = self.opener(self.fn, self.varname)
+        self.shape = (len(range(*self.rows.indices(self._var.shape[0]))),
+                      len(range(*self.cols.indices(self._var.shape[1]))))
+        self.dtype = self._var.dtype
+
+    def __getstate__(self):
+        return {attr: getattr(self, attr) for attr in ['fn', 'varname', 'rows', 'cols', 'opener']}
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._file = None
+        self._open()
+
+    def __del__(self):
+        self.close()
+
+    def close(self):
+        """Close the file. The window cannot be read after this."""
+        if getattr(self, '_file', None) is not None:
+            self._file.close()
+            self._file = None
+            self._var = None
+
+    def __getitem__(self, key):
+        rows, cols = key
+        rows = _compose(self.rows, rows, self._var.shape[0])
+        cols = _compose(self.cols, cols, self._var.shape[1])
+        if isinstance(cols, slice):
+            return self._var[rows, cols]
+        # Files want sorted, unique indices
+        uniq, inverse = np.unique(cols, return_inverse=True)
+        return np.asarray(self._var[rows, uniq])[:, inverse]
+
+
+#: The numpy dtypes of matlab classes, where the names differ
+MAT_DTYPES = {'double': np.float64, 'single': np.float32, 'logical': bool}
+
+
+class MatVariable:
+    """A variable in a .mat file, which is only read when it is indexed
+
+    The shape and dtype come from the file header. Matlab files can only give us whole
+    variables, so use this with a :class:`LazyData` with whole=True.
+
+    Parameters
+    ----------
+    fn: str
+        The .mat file
+    varname: str
+        The name of the variable
+    """
+
+    def __init__(self, fn, varname):
+        self.fn = fn
+        self.varname = varname
+        info = {name: (shape, mclass) for name, shape, mclass in whosmat(fn)}
+        if varname not in info:
+            raise KeyError('{:s} is not in {:s}'.format(varname, fn))
+        self.shape = tuple(info[varname][0])
+        self.dtype = np.dtype(MAT_DTYPES.get(info[varname][1], info[varname][1]))
+
+    def __getitem__(self, key):
+        return loadmat(self.fn, variable_names=[self.varname])[self.varname][key]
+
+
+def _compose(outer, inner, length):
+    """Turn an index into a window (the slice outer) into an index of the full axis"""
+    full = range(length)[outer]
+    if isinstance(inner, slice):
+        sub = full[inner]
+        if sub.step > 0:
+            return slice(sub.start, sub.start + len(sub) * sub.step, sub.step)
+        return np.array(sub, dtype=int)
+    return np.array(full)[inner]
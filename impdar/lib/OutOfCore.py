@@ -0,0 +1,354 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+Run processing pipelines a block of traces at a time, for profiles that do not fit in memory.
+
+Every stage is a pass over the data: blocks of traces are read from the output of the
+last pass (or the input), processed with the usual RadarData methods, and written to a
+chunked HDF5 file. Filters that average over several traces read extra traces (a halo)
+on each side of every block, and steps that need statistics of the whole profile (hfilt,
+and the noise level of the wiener filter) get them in an extra read-only pass. The results
+are the same as processing in memory, up to rounding.
+"""
+import io
+import os
+import copy
+import tempfile
+from contextlib import redirect_stdout
+import numpy as np
+from scipy.signal import correlate
+
+from .Pipeline import STEPS, fusable, elementwise_coefficients, run_stage
+from .RadarData._RadarDataSaving import H5, create_h5_data, write_h5_metadata
+
+if H5:
+    import h5py
+
+#: Number of traces in each block. Memory use is a few times the size of a block.
+BLOCK_TRACES = 4096
+
+#: Attributes with one value per trace, which are split into blocks with the data
+TRACE_ATTRS = ['decday', 'lat', 'long', 'pressure', 'trace_int', 'trace_num', 'trig', 'trig_level',
+               'dist', 'elev', 'x_coord', 'y_coord']
+
+#: Steps that only ever look at one trace
+LOCAL_STEPS = ['vbp', 'rgain', 'nmo', 'crop']
+
+#: Steps that only pick out or reorder traces
+SELECT_STEPS = ['hcrop', 'rev']
+
+#: Steps that filter over windows of traces
+WINDOW_STEPS = ['ahfilt', 'winavg', 'denoise']
+
+
+def run_out_of_core(pipeline, dat, fn_out, block_traces=BLOCK_TRACES):
+    """Run a pipeline on data too large for memory, writing the result to an h5 file
+
+    Parameters
+    ----------
+    pipeline: `~impdar.lib.Pipeline.Pipeline`
+        The steps to run. Migration and GPS interpolation need the whole profile at once,
+        so they cannot be run like this.
+    dat: `~impdar.lib.RadarData.RadarData`
+        The input. The data should be lazily loaded (e.g. load with memmap=True) or an
+        h5py dataset, so that blocks of traces can be read on their own.
+    fn_out: str
+        The output, which will be in ImpDAR's h5 format. Scratch files for the intermediate
+        results are written (then deleted) in the same directory.
+    block_traces: int, optional
+        Number of traces in each block. Default is BLOCK_TRACES.
+
+    Returns
+    -------
+    `~impdar.lib.RadarData.RadarData`
+        The processed data, lazily loaded from fn_out
+    """
+    if not H5:
+        raise ImportError('You need h5py to process out of core')
+    stages = pipeline.plan()
+    for stage in stages:
+        name, args, _ = stage[0]
+        if name not in LOCAL_STEPS + SELECT_STEPS + WINDOW_STEPS + ['hfilt', 'restack']:
+            raise ValueError('{:s} needs the whole profile, so cannot run out of core'.format(name))
+        if name == 'crop' and len(args) > 2 and args[2] == 'pretrig':
+            raise ValueError('pretrig crops can shift traces differently, so cannot run out of core')
+
+    runner = _BlockRunner(os.path.dirname(os.path.abspath(fn_out)), block_traces)
+    try:
+        src, meta = dat.data, _without_data(dat)
+        i = 0
+        while i < len(stages) or i == 0:
+            if not stages:
+                # Nothing to do but copy
+                src, meta = runner.map_blocks(src, meta, None)
+                break
+            stage = stages[i]
+            name = stage[0][0]
+            if _is_local(stage):
+                group = [stage]
+                while i + 1 < len(stages) and _is_local(stages[i + 1]):
+                    i += 1
+                    group.append(stages[i])
+                src, meta = runner.map_blocks(src, meta, _run_stages(group))
+            elif name in SELECT_STEPS:
+                src, meta = runner.select(src, meta, stage)
+            elif name == 'restack':
+                src, meta = runner.restack(src, meta, stage)
+            elif name in WINDOW_STEPS:
+                src, meta = runner.window(src, meta, stage)
+            elif fusable(stage, src.dtype, meta.trig):
+                src, meta = runner.elementwise(src, meta, stage)
+            else:
+                for step in stage:
+                    if step[0] == 'rgain':
+                        src, meta = runner.map_blocks(src, meta, _run_stages([[step]]))
+                    else:
+                        src, meta = runner.elementwise(src, meta, [step], cast=True)
+            i += 1
+        runner.finish(meta, fn_out)
+    finally:
+        runner.cleanup()
+
+    from .load.load_h5 import load_h5
+    return load_h5(fn_out, lazy=True)
+
+
+class _BlockRunner:
+    """Passes over the data, each writing a scratch h5 file that is the input of the next"""
+
+    def __init__(self, directory, block_traces):
+        self.directory = directory
+        self.block_traces = max(1, int(block_traces))
+        self.files = []
+
+    def _new_file(self):
+        """A scratch file for the next pass. The file before last is no longer needed."""
+        if len(self.files) > 1:
+            self._remove(self.files.pop(0))
+        fid, fn = tempfile.mkstemp(suffix='.h5', prefix='impdar_ooc_', dir=self.directory)
+        os.close(fid)
+        self.files.append((fn, h5py.File(fn, 'w')))
+        return self.files[-1][1]
+
+    def _remove(self, entry):
+        fn, fin = entry
+        fin.close()
+        os.remove(fn)
+
+    def cleanup(self):
+        while self.files:
+            self._remove(self.files.pop(0))
+
+    def finish(self, meta, fn_out):
+        """Add the metadata to the last scratch file and move it to fn_out"""
+        fn, fout = self.files.pop()
+        write_h5_metadata(meta, fout)
+        fout.close()
+        os.replace(fn, fn_out)
+
+    def column_mean(self, src, first, last):
+        """Mean of the traces first:last of src, read a block at a time"""
+        total = 0.
+        for i in range(first, last, self.block_traces):
+            total = total + np.sum(np.asarray(src[:, i:min(i + self.block_traces, last)]), axis=1, dtype=float)
+        return total / (last - first)
+
+    def map_blocks(self, src, meta, func, halo=0, align=1, tnum_out=None, min_traces=0):
+        """Apply func to every block of traces, and write the results
+
+        Parameters
+        ----------
+        src: array-like
+            The data, (snum x tnum). Only slices of whole traces are read.
+        meta: `~impdar.lib.RadarData.RadarData`
+            Everything but the data
+        func: callable
+            Modifies a RadarData holding one block (plus any halo) in place. If halo is
+            nonzero, func must not change the number of traces.
+        halo: int, optional
+            Extra traces to read on each side of a block
+        align: int, optional
+            Blocks start at multiples of this many traces
+        tnum_out: int, optional
+            Number of traces in the output. Default is the same as the input.
+        min_traces: int, optional
+            Read at least this many traces (if there are that many) for each block
+
+        Returns
+        -------
+        src: h5py.Dataset
+            The processed data
+        meta: `~impdar.lib.RadarData.RadarData`
+            The new metadata, from the first block with the per-trace attributes of all of them
+        """
+        tnum = int(meta.tnum)
+        tnum_out = tnum if tnum_out is None else tnum_out
+        step = max(align, (self.block_traces // align) * align)
+        fout = self._new_file()
+        dset = None
+        first = None
+        col = 0
+        gathered = {attr: [] for attr in TRACE_ATTRS}
+        for start in range(0, max(tnum, 1), step):
+            stop = min(start + step, tnum)
+            lo, hi = max(0, start - halo), min(tnum, stop + halo)
+            if hi - lo < min_traces:
+                lo, hi = max(0, min(lo, hi - min_traces)), min(tnum, max(hi, lo + min_traces))
+            block = _block(meta, np.asarray(src[:, lo:hi]), lo, hi)
+            if func is not None:
+                # Only say what we are doing once
+                if first is None:
+                    func(block)
+                else:
+                    with redirect_stdout(io.StringIO()):
+                        func(block)
+            core = slice(start - lo, stop - lo) if (halo or min_traces) else slice(None)
+            out = np.asarray(block.data)[:, core]
+            if dset is None:
+                dset = create_h5_data(fout, (out.shape[0], tnum_out), out.dtype)
+            dset[:, col:col + out.shape[1]] = out
+            col += out.shape[1]
+            for attr in TRACE_ATTRS:
+                val = getattr(block, attr, None)
+                if val is not None and np.ndim(val) > 0 and np.shape(val)[0] == block.tnum:
+                    gathered[attr].append(np.asarray(val)[core])
+            if first is None:
+                first = block
+        return dset, _metadata(first, gathered, col)
+
+    def select(self, src, meta, stage):
+        """hcrop or reverse, found by running them on an array of trace indices"""
+        clone = copy.copy(meta)
+        clone.flags = copy.deepcopy(meta.flags)
+        # A read-only view, so this takes no memory
+        clone.data = np.broadcast_to(np.arange(int(meta.tnum)), (int(meta.snum), int(meta.tnum)))
+        run_stage(clone, stage)
+        cols = np.asarray(clone.data[0, :])
+
+        fout = self._new_file()
+        dset = None
+        for start in range(0, len(cols), self.block_traces):
+            block_cols = cols[start:start + self.block_traces]
+            lo, hi = np.min(block_cols), np.max(block_cols) + 1
+            out = np.asarray(src[:, lo:hi])[:, block_cols - lo]
+            if dset is None:
+                dset = create_h5_data(fout, (out.shape[0], len(cols)), out.dtype)
+            dset[:, start:start + out.shape[1]] = out
+        clone.data = None
+        clone.tnum = len(cols)
+        return dset, clone
+
+    def restack(self, src, meta, stage):
+        """Restack blocks that are whole numbers of stacks"""
+        traces = int(stage[0][1][0])
+        if traces % 2 == 0:
+            traces = traces + 1
+        dset, meta = self.map_blocks(src, meta, _run_stages([stage]), align=traces,
+                                     tnum_out=int(meta.tnum) // traces)
+        meta.trace_num = np.arange(meta.tnum).astype(int) + 1
+        return dset, meta
+
+    def window(self, src, meta, stage):
+        """Filters over windows of traces, with enough of a halo that every window is complete"""
+        name, args, kwargs = stage[0]
+        if name == 'ahfilt':
+            # windows are 100 traces, and the first and last 50 traces are handled differently
+            return self.map_blocks(src, meta, _run_stages([stage]), halo=100, min_traces=100)
+        elif name == 'winavg':
+            params = _params(['avg_win', 'taper', 'filtdepth'], args, kwargs)
+            avg_win = min(int(params['avg_win']), int(meta.tnum))
+            params['avg_win'] = avg_win + 1 if avg_win % 2 == 0 else avg_win
+            return self.map_blocks(src, meta, lambda block: block.winavg_hfilt(**params),
+                                   halo=params['avg_win'], min_traces=params['avg_win'])
+        else:
+            params = _params(['vert_win', 'hor_win', 'noise', 'ftype'], args, kwargs)
+            params.setdefault('vert_win', 1)
+            params.setdefault('hor_win', 10)
+            if params.get('noise') is None:
+                params['noise'] = self._wiener_noise(src, meta, (params['vert_win'], params['hor_win']))
+            return self.map_blocks(src, meta, lambda block: block.denoise(**params),
+                                   halo=params['hor_win'], min_traces=params['hor_win'])
+
+    def _wiener_noise(self, src, meta, mysize):
+        """The default noise of scipy's wiener filter: the mean local variance of the data"""
+        total = 0.
+        tnum = int(meta.tnum)
+        halo = mysize[1]
+        for start in range(0, tnum, self.block_traces):
+            stop = min(start + self.block_traces, tnum)
+            lo, hi = max(0, start - halo), min(tnum, stop + halo)
+            block = np.asarray(src[:, lo:hi])
+            local_mean = correlate(block, np.ones(mysize), 'same') / np.prod(mysize, axis=0)
+            local_var = correlate(block ** 2, np.ones(mysize), 'same') / np.prod(mysize, axis=0) - local_mean ** 2
+            total += np.sum(local_var[:, start - lo:stop - lo])
+        return total / (int(meta.snum) * tnum)
+
+    def elementwise(self, src, meta, stage, cast=False):
+        """Fused hfilt and rgain, or an hfilt of integer data if cast"""
+        meta = copy.copy(meta)
+        meta.flags = copy.deepcopy(meta.flags)
+        scale, offset = elementwise_coefficients(meta, stage, lambda first, last: self.column_mean(src, first, last))
+        scale, offset = np.atleast_2d(scale).transpose(), np.atleast_2d(offset).transpose()
+
+        def apply(block):
+            if cast:
+                # as in horizontalfilt, the average trace is cast to the type of the data
+                block.data = block.data - (-offset).astype(block.data.dtype)
+            else:
+                block.data = block.data * scale + offset
+        return self.map_blocks(src, meta, apply)
+
+
+def _is_local(stage):
+    return len(stage) == 1 and stage[0][0] in LOCAL_STEPS
+
+
+def _run_stages(stages):
+    def func(block):
+        for stage in stages:
+            run_stage(block, stage)
+    return func
+
+
+def _params(names, args, kwargs):
+    """Arguments of a step, by name"""
+    params = dict(zip(names, args))
+    params.update(kwargs)
+    return params
+
+
+def _without_data(dat):
+    meta = copy.copy(dat)
+    meta.data = None
+    return meta
+
+
+def _block(meta, data, lo, hi):
+    """A RadarData with the traces lo:hi of the data and per-trace attributes"""
+    block = copy.copy(meta)
+    # methods change the flags in place
+    block.flags = copy.deepcopy(meta.flags)
+    block.data = data
+    for attr in TRACE_ATTRS:
+        val = getattr(meta, attr, None)
+        if val is not None and np.ndim(val) > 0 and np.shape(val)[0] == meta.tnum:
+            setattr(block, attr, np.asarray(val)[lo:hi])
+    block.tnum = data.shape[1]
+    return block
+
+
+def _metadata(first, gathered, tnum):
+    """Metadata from the first block, with the per-trace attributes of all of them"""
+    meta = copy.copy(first)
+    meta.data = None
+    meta.tnum = tnum
+    for attr, parts in gathered.items():
+        if parts:
+            setattr(meta, attr, np.concatenate(parts))
+    return meta
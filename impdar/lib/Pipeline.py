@@ -0,0 +1,414 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+A processing pipeline: record the steps first, then run them in an efficient order.
+"""
+import numpy as np
+
+from .LazyData import LazyData
+from .gpslib import interp as interpdeep
+from .RadarData._RadarDataFiltering import FILTER_TRACE_CHUNK
+
+
+def _run_hcrop(dat, lim, left_or_right='left', dimension='tnum'):
+    dat.hcrop(lim, left_or_right, dimension)
+
+
+def _run_crop(dat, lim, top_or_bottom='top', dimension='snum', *args):
+    dat.crop(lim, top_or_bottom, dimension, *args)
+
+
+def _run_hfilt(dat, ntr1, ntr2):
+    dat.hfilt(ftype='hfilt', bounds=(ntr1, ntr2))
+
+
+def _run_interp(dat, spacing, fn=None):
+    interpdeep([dat], float(spacing), fn)
+
+
+#: The steps that a pipeline knows about. For each, we have the function that runs it and
+#: a rough count of the full-size float arrays that the step needs as scratch space
+STEPS = {'hcrop': (_run_hcrop, 0),
+         'crop': (_run_crop, 0),
+         'restack': (lambda dat, traces: dat.restack(traces), 1),
+         'rev': (lambda dat: dat.reverse(), 0),
+         'vbp': (lambda dat, *args, **kwargs: dat.vertical_band_pass(*args, **kwargs), 0),
+         'hfilt': (_run_hfilt, 0),
+         'rgain': (lambda dat, slope: dat.rangegain(slope), 0),
+         'ahfilt': (lambda dat: dat.hfilt(ftype='adaptive'), 5),
+         'winavg': (lambda dat, *args, **kwargs: dat.winavg_hfilt(*args, **kwargs), 3),
+         'nmo': (lambda dat, *args, **kwargs: dat.nmo(*args, **kwargs), 3),
+         'denoise': (lambda dat, *args, **kwargs: dat.denoise(*args, **kwargs), 3),
+         'interp': (_run_interp, 2),
+         'migrate': (lambda dat, *args, **kwargs: dat.migrate(*args, **kwargs), 6),
+         }
+
+#: Steps that act on each sample with only a per-sample scale and offset, which we fuse
+ELEMENTWISE_STEPS = ['hfilt', 'rgain']
+
+#: Steps that just take a view of the data
+VIEW_STEPS = ['hcrop', 'crop', 'rev']
+
+#: The steps that each size-reducing step can safely be moved in front of. Cropping the
+#: bottom can also go in front of element-wise steps, but cropping the top shifts the
+#: travel times that they use.
+COMMUTES = {'hcrop': ['vbp', 'rgain', 'crop'],
+            'crop': ['rev', 'restack', 'hcrop'],
+            'restack': ['crop'],
+            }
+
+
+class Pipeline:
+    """An ordered list of processing steps for RadarData.
+
+    Steps are only recorded when they are added. When the pipeline is run, cheap steps that
+    reduce the size of the data (crops and restacks) are moved ahead of earlier steps that
+    give the same result either way, and consecutive element-wise steps (horizontal
+    filtering and range gain) are fused into a single pass that modifies the data in place.
+    With the bandpass also filtering in place, only the remaining steps (e.g. restack, nmo,
+    migration) allocate a new copy of the data.
+
+    Parameters
+    ----------
+    steps: list, optional
+        (name, args, kwargs) tuples for the initial steps. Names are the keys of STEPS.
+    """
+
+    def __init__(self, steps=None):
+        self.steps = []
+        for name, args, kwargs in (steps or []):
+            self.add(name, *args, **kwargs)
+
+    def __len__(self):
+        return len(self.steps)
+
+    def add(self, name, *args, **kwargs):
+        """Add a processing step to the end of the pipeline
+
+        Parameters
+        ----------
+        name: str
+            The step. One of the keys of STEPS.
+        args, kwargs:
+            Passed to the RadarData method that does the step
+
+        Returns
+        -------
+        Pipeline
+            This pipeline, so that calls can be chained
+        """
+        if name not in STEPS:
+            raise ValueError('Unrecognized processing step {:s}'.format(str(name)))
+        self.steps.append((name, args, kwargs))
+        return self
+
+    @classmethod
+    def from_kwargs(cls, interp=None, rev=False, vbp=None, hfilt=None, ahfilt=False, nmo=None, crop=None,
+                    hcrop=None, restack=None, denoise=None, migrate=None, **kwargs):
+        """Build the pipeline for the arguments of :func:`~impdar.lib.process.process`
+
+        The steps are added in the order that process has always used.
+
+        Returns
+        -------
+        Pipeline
+            The steps requested.
+        """
+        # first some argument checking so we don't crash later
+        if crop is not None:
+            try:
+                if crop[1] not in ['top', 'bottom']:
+                    raise ValueError('First element of crop must be in ["top", "bottom"]')
+                if crop[2] not in ['snum', 'twtt', 'depth']:
+                    raise ValueError('Second element of crop must be in ["snum", "twtt", "depth"]')
+                try:
+                    crop = (float(crop[0]), crop[1], crop[2])
+                except ValueError:
+                    raise ValueError('Third element of crop must be convertible to a float')
+            except TypeError:
+                raise TypeError('Crop must be subscriptible')
+
+        if hcrop is not None:
+            try:
+                if hcrop[1] not in ['left', 'right']:
+                    raise ValueError('First element of hcrop must be in ["left", "right"]')
+                if hcrop[2] not in ['tnum', 'dist']:
+                    raise ValueError('Second element of hcrop must be in ["tnum", "dist"]')
+                try:
+                    hcrop = (float(hcrop[0]), hcrop[1], hcrop[2])
+                except ValueError:
+                    raise ValueError('Third element of hcrop must be convertible to a float')
+            except TypeError:
+                raise TypeError('hcrop must be subscriptible')
+
+        pipeline = cls()
+        if hcrop is not None:
+            pipeline.add('hcrop', *hcrop)
+        if restack is not None:
+            if type(restack) in [list, tuple]:
+                restack = int(restack[0])
+            pipeline.add('restack', restack)
+        if rev:
+            pipeline.add('rev')
+        if vbp is not None:
+            pipeline.add('vbp', *vbp)
+        if hfilt is not None:
+            pipeline.add('hfilt', *hfilt)
+        if ahfilt:
+            pipeline.add('ahfilt')
+        if nmo is not None:
+            if type(nmo) == float:
+                print('One nmo value given. Assuming that this is the separation. Uice=1.6')
+                nmo = (nmo, 1.6)
+            pipeline.add('nmo', *nmo)
+        if denoise is not None:
+            pipeline.add('denoise', *denoise)
+        if interp is not None:
+            pipeline.add('interp', *interp)
+        # Crop after nmo so that we have nmo_depth available for cropping if desired
+        if crop is not None:
+            pipeline.add('crop', *crop)
+        if migrate is not None:
+            pipeline.add('migrate', mtype='stolt')
+        return pipeline
+
+    def plan(self):
+        """The order in which the steps will actually be run
+
+        Each size-reducing step is moved as early as it can go without changing the result,
+        then runs of element-wise steps are grouped together.
+
+        Returns
+        -------
+        list
+            Stages to run. Each is a list of (name, args, kwargs) steps; stages with more
+            than one step are fused element-wise passes.
+        """
+        ordered = []
+        for step in self.steps:
+            pos = len(ordered)
+            while pos > 0 and _commutes(step, ordered[pos - 1]):
+                pos -= 1
+            ordered.insert(pos, step)
+
+        stages = []
+        for step in ordered:
+            if stages and step[0] in ELEMENTWISE_STEPS and stages[-1][-1][0] in ELEMENTWISE_STEPS:
+                stages[-1].append(step)
+            else:
+                stages.append([step])
+        return stages
+
+    def run(self, dat):
+        """Apply the steps to a RadarData object, in place
+
+        Parameters
+        ----------
+        dat: `~impdar.lib.RadarData.RadarData`
+            The data to process. Lazily loaded data are only read when a step needs more
+            than a subset of them, so leading crops only read what they keep.
+        """
+        for stage in self.plan():
+            run_stage(dat, stage)
+
+    def estimate_memory(self, dat):
+        """Estimate the memory needed to run the pipeline on some data
+
+        Only the metadata are used, so dat can be lazily loaded. Estimates are rough:
+        shapes are found from the starting metadata, and the scratch space for the
+        heavier steps is a guess.
+
+        Parameters
+        ----------
+        dat: `~impdar.lib.RadarData.RadarData`
+            The data that would be processed
+
+        Returns
+        -------
+        stages: list
+            (description, (snum, tnum), peak bytes) for each stage, in order
+        peak: int
+            The estimated peak memory, in bytes, for the data and scratch space
+        """
+        shape = (int(dat.snum), int(dat.tnum))
+        itemsize = np.dtype(getattr(dat.data, 'dtype', float)).itemsize
+        # Lazily loaded data are read by the first step that is not a crop
+        held = 0 if isinstance(dat.data, LazyData) else _nbytes(shape, itemsize)
+        stages = []
+        for stage in self.plan():
+            name = stage[0][0]
+            new_shape = shape
+            for step_name, args, kwargs in stage:
+                new_shape = _new_shape(dat, new_shape, step_name, args)
+            float_bytes = _nbytes(shape, 8)
+            if name in VIEW_STEPS:
+                # The original stays around until something copies it
+                if held == 0:
+                    held = _nbytes(new_shape, itemsize)
+                peak = held
+            elif name in ELEMENTWISE_STEPS:
+                held = max(held, _nbytes(shape, itemsize))
+                peak = held + 2 * shape[0] * 8
+            elif name == 'vbp':
+                held = max(held, _nbytes(shape, itemsize))
+                peak = held + 4 * _nbytes((shape[0], min(shape[1], FILTER_TRACE_CHUNK)), 8)
+            else:
+                held = max(held, _nbytes(shape, itemsize))
+                out_bytes = _nbytes(new_shape, 8)
+                peak = held + out_bytes + STEPS[name][1] * float_bytes
+                held, itemsize = out_bytes, 8
+            desc = ' + '.join(step[0] for step in stage)
+            stages.append((desc, new_shape, peak))
+            shape = new_shape
+        peak = max([held] + [stage[2] for stage in stages])
+        return stages, peak
+
+
+def run_stage(dat, stage):
+    """Run one stage from :meth:`Pipeline.plan` on a RadarData object, in place"""
+    if isinstance(dat.data, LazyData) and stage[0][0] not in VIEW_STEPS:
+        dat.data = np.asarray(dat.data)
+    if stage[0][0] in ELEMENTWISE_STEPS:
+        _run_elementwise(dat, stage)
+    else:
+        name, args, kwargs = stage[0]
+        STEPS[name][0](dat, *args, **kwargs)
+
+
+def _commutes(step, previous):
+    """True if step (a size-reducing step) can be moved in front of previous"""
+    name, args, _ = step
+    if name == 'crop' and (len(args) < 3 or args[2] not in ['snum', 'twtt']):
+        # Depth depends on nmo, and pretrig crops can shift traces
+        return False
+    if name == 'crop' and args[1] == 'bottom' and previous[0] in ELEMENTWISE_STEPS:
+        return True
+    if name not in COMMUTES or previous[0] not in COMMUTES[name]:
+        return False
+    if previous[0] == 'crop' and (len(previous[1]) < 3 or previous[1][2] not in ['snum', 'twtt']):
+        return False
+    return True
+
+
+def fusable(stage, dtype, trig):
+    """True if the hfilt and rgain steps of an element-wise stage can be run as one pass
+
+    Integer data are rounded at each step, and per-trace triggers scale traces
+    differently, so we cannot fuse these. rgain alone is in place already.
+    """
+    if len(stage) == 1 and stage[0][0] == 'rgain':
+        return False
+    if not np.issubdtype(dtype, np.floating):
+        return False
+    return not (any(step[0] == 'rgain' for step in stage) and not isinstance(trig, (float, int)))
+
+
+def elementwise_coefficients(dat, stage, column_mean):
+    """Find the scale and offset of each row that an element-wise stage amounts to
+
+    Each step maps every sample in a row (travel time) to a * sample + b, so the whole stage
+    is also such a map. Horizontal filters need averages of the data as they are when the
+    filter is reached, but those are the same map applied to averages of the input.
+    The flags of dat are set for each step.
+
+    Parameters
+    ----------
+    dat: `~impdar.lib.RadarData.RadarData`
+        The data before the stage. Only the metadata are used.
+    stage: list
+        The (name, args, kwargs) steps
+    column_mean: callable
+        column_mean(first, last) is the mean of the input traces first:last
+
+    Returns
+    -------
+    scale, offset: np.ndarray
+        The stage maps the data to data * scale + offset, row by row
+    """
+    scale = np.ones((dat.snum, ))
+    offset = np.zeros((dat.snum, ))
+    travel_time = np.ravel(dat.travel_time)
+    for name, args, kwargs in stage:
+        if name == 'hfilt':
+            htr1 = int(max(0, min(args[0], dat.tnum - 1)))
+            htrn = int(max(htr1 + 1, min(args[1], dat.tnum)))
+            print('Subtracting mean trace found between {:d} and {:d}'.format(htr1, htrn))
+            avg_trace = scale * column_mean(htr1, htrn) + offset
+            offset -= avg_trace * (np.exp(-travel_time * 0.05) / np.exp(-travel_time[0] * 0.05))
+            dat.flags.hfilt = np.ones((2,))
+        else:
+            gain = travel_time[int(dat.trig) + 1:] * args[0]
+            scale[int(dat.trig + 1):] *= gain
+            offset[int(dat.trig + 1):] *= gain
+            dat.flags.rgain = True
+    return scale, offset
+
+
+def _run_elementwise(dat, stage):
+    """Run consecutive hfilt and rgain steps as one in-place scaling and offset of each sample"""
+    data = dat.data
+    if not data.flags.writeable:
+        data = data.copy()
+        dat.data = data
+    if not fusable(stage, data.dtype, dat.trig):
+        for name, args, kwargs in stage:
+            STEPS[name][0](dat, *args, **kwargs)
+        return
+
+    scale, offset = elementwise_coefficients(dat, stage, lambda first, last: np.mean(data[:, first:last], axis=-1))
+    if not np.all(scale == 1.):
+        data *= np.atleast_2d(scale).transpose()
+    data += np.atleast_2d(offset).transpose()
+    print('Fused {:s} complete.'.format(' + '.join(step[0] for step in stage)))
+
+
+def _new_shape(dat, shape, name, args):
+    """Estimate the shape of the data after a step, using the starting metadata"""
+    snum, tnum = shape
+    if name == 'hcrop':
+        lim, left_or_right = args[0], (args[1] if len(args) > 1 else 'left')
+        dimension = args[2] if len(args) > 2 else 'tnum'
+        if dimension == 'dist':
+            ind = int(np.min(np.argwhere(np.ravel(dat.dist) >= float(lim))))
+        else:
+            ind = int(float(lim)) - 1
+        lims = slice(ind, None) if left_or_right == 'left' else slice(0, ind)
+        return snum, len(range(tnum)[lims])
+    elif name == 'crop':
+        lim, top_or_bottom = args[0], (args[1] if len(args) > 1 else 'top')
+        dimension = args[2] if len(args) > 2 else 'snum'
+        if dimension == 'twtt':
+            ind = int(np.min(np.argwhere(np.ravel(dat.travel_time) >= float(lim))))
+        elif dimension == 'depth':
+            depth = dat.nmo_depth if dat.nmo_depth is not None else dat.travel_time / 2. * 1.69e8 * 1.0e-6
+            ind = int(np.min(np.argwhere(np.ravel(depth) >= float(lim))))
+        elif dimension == 'pretrig':
+            return snum - int(np.min(dat.trig)), tnum
+        else:
+            ind = int(float(lim))
+        lims = slice(ind, None) if top_or_bottom == 'top' else slice(0, ind)
+        return len(range(snum)[lims]), tnum
+    elif name == 'restack':
+        traces = int(args[0])
+        traces = traces + 1 if traces % 2 == 0 else traces
+        return snum, tnum // traces
+    return shape
+
+
+def _nbytes(shape, itemsize):
+    return int(shape[0]) * int(shape[1]) * int(itemsize)
+
+
+def format_bytes(nbytes):
+    """Format a number of bytes for humans, e.g. 1.5 GB"""
+    for unit in ['B', 'kB', 'MB', 'GB']:
+        if abs(nbytes) < 1000.:
+            return '{:.1f} {:s}'.format(nbytes, unit)
+        nbytes /= 1000.
+    return '{:.1f} TB'.format(nbytes)
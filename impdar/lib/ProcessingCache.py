@@ -0,0 +1,211 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+An on-disk cache of partly processed data, so that reruns can skip the steps that did not change.
+"""
+import os
+import glob
+import json
+import hashlib
+import numpy as np
+
+from .Pipeline import run_stage
+from .RadarData import RadarData
+from .RadarData._RadarDataSaving import H5
+
+#: Part of every key. Bump this if processing changes, so that old results are not reused.
+CACHE_VERSION = 1
+
+#: Default limit on the size of the cache, in bytes
+DEFAULT_MAX_BYTES = 1.0e10
+
+#: Read this many bytes at a time when hashing input files
+HASH_CHUNK = 2 ** 20
+
+
+class ProcessingCache:
+    """Intermediate results of processing, saved after each stage of a pipeline.
+
+    Results are keyed by a hash of the input file(s) and of the stages run on them so far,
+    so a rerun that only changes later steps starts from the last result that still
+    applies. Entries are RadarData files (h5 if h5py is available, otherwise mat) in one
+    directory. Once that directory exceeds its size limit, the least recently used entries
+    are deleted. File modification times track use, so several processes can share a cache.
+
+    Parameters
+    ----------
+    directory: str
+        Where to keep the cache. Created if needed.
+    max_bytes: float, optional
+        Approximate size limit of the cache. Default is 10 GB.
+    """
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ext = '.h5' if H5 else '.mat'
+        if not os.path.exists(directory):
+            try:
+                os.makedirs(directory)
+            except OSError:
+                # another process may have made it in the meantime
+                if not os.path.isdir(directory):
+                    raise
+        # in case the limit has shrunk
+        self.evict()
+
+    def input_key(self, filetype, fns):
+        """Hash the contents of some input files
+
+        Other files with the same name but a different extension (e.g. GSSI .DZG files)
+        are hashed too, since loaders may read them.
+
+        Parameters
+        ----------
+        filetype: str
+            The type of the files, as given to :func:`~impdar.lib.load.load`
+        fns: list of str
+            The files. More than one are concatenated.
+
+        Returns
+        -------
+        str
+            The key for the unprocessed data
+        """
+        sha = hashlib.sha256('{:d} {:s}'.format(CACHE_VERSION, filetype).encode())
+        for fn in fns:
+            for fn_i in [fn] + sorted(set(glob.glob(glob.escape(os.path.splitext(fn)[0]) + '.*')) - {fn}):
+                sha.update(os.path.split(fn_i)[1].encode())
+                with open(fn_i, 'rb') as fin:
+                    for chunk in iter(lambda: fin.read(HASH_CHUNK), b''):
+                        sha.update(chunk)
+        return sha.hexdigest()
+
+    def stage_keys(self, input_key, stages):
+        """The key for the result of each stage, given the key of the input
+
+        Parameters
+        ----------
+        input_key: str
+            From :meth:`input_key`
+        stages: list
+            Output of :meth:`~impdar.lib.Pipeline.Pipeline.plan`
+
+        Returns
+        -------
+        list of str
+            Keys after each stage. Each depends on all the stages up to it.
+        """
+        keys = []
+        key = input_key
+        for stage in stages:
+            canonical = json.dumps([[name, _canonical(args), _canonical(sorted(kwargs.items()))]
+                                    for name, args, kwargs in stage])
+            key = hashlib.sha256((key + canonical).encode()).hexdigest()
+            keys.append(key)
+        return keys
+
+    def get(self, key):
+        """Load a cached result, or return None if there is not one"""
+        fn = os.path.join(self.directory, key + self.ext)
+        if not os.path.exists(fn):
+            return None
+        try:
+            # mark it as recently used
+            os.utime(fn)
+            if self.ext == '.h5':
+                from .load.load_h5 import load_h5
+                return load_h5(fn)
+            return RadarData(fn)
+        except (OSError, KeyError, ValueError):
+            # Another process may have evicted it while we were reading
+            return None
+
+    def put(self, key, dat):
+        """Save a result to the cache, then evict old results if we are over the size limit"""
+        fn = os.path.join(self.directory, key + self.ext)
+        fn_tmp = os.path.join(self.directory, '{:s}.{:d}.tmp{:s}'.format(key, os.getpid(), self.ext))
+        dat.save(fn_tmp)
+        # Move the finished file in, so that other processes never read half of one
+        os.replace(fn_tmp, fn)
+        self.evict()
+
+    def evict(self):
+        """Delete the least recently used results until the cache fits in max_bytes"""
+        entries = []
+        for fn in glob.glob(os.path.join(self.directory, '*' + self.ext)):
+            if '.tmp' in os.path.split(fn)[1]:
+                continue
+            try:
+                stat = os.stat(fn)
+            except OSError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, fn))
+        total = sum(entry[1] for entry in entries)
+        for _, size, fn in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(fn)
+            except OSError:
+                pass
+            total -= size
+
+    def run(self, pipeline, input_key, load_input):
+        """Run a pipeline, starting from the last stage that is already in the cache
+
+        The result of every stage that is run gets cached.
+
+        Parameters
+        ----------
+        pipeline: `~impdar.lib.Pipeline.Pipeline`
+            The steps to run
+        input_key: str
+            Key for the input data, from :meth:`input_key`
+        load_input: callable
+            Takes no arguments and returns the unprocessed RadarData.
+            Only called if nothing is cached.
+
+        Returns
+        -------
+        `~impdar.lib.RadarData.RadarData`
+            The processed data
+        """
+        stages = pipeline.plan()
+        keys = self.stage_keys(input_key, stages)
+        dat = None
+        first = len(stages)
+        while dat is None and first > 0:
+            dat = self.get(keys[first - 1])
+            if dat is None:
+                first -= 1
+        if dat is None:
+            dat = load_input()
+        else:
+            print('Using cached result of the first {:d} of {:d} processing stages'.format(first, len(stages)))
+
+        for stage, key in zip(stages[first:], keys[first:]):
+            run_stage(dat, stage)
+            self.put(key, dat)
+        return dat
+
+
+def _canonical(val):
+    """Make processing arguments hashable in a way that does not depend on how they were typed"""
+    if isinstance(val, (list, tuple)):
+        return [_canonical(item) for item in val]
+    if isinstance(val, np.ndarray):
+        return [_canonical(item) for item in val.tolist()]
+    if val is None:
+        return val
+    if isinstance(val, (bool, np.bool_)):
+        return bool(val)
+    if isinstance(val, (int, float, np.number)):
+        return float(val)
+    return str(val)
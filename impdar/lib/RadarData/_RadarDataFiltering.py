@@ -63,29 +63,24 @@ def adaptivehfilt(self, *args, **kwargs):
     avg_trace_scale[mask] = -1.0 * (self.travel_time[mask] - transition) * (self.travel_time[mask] - transition) / mtt ** 2. + 1
     avg_trace_scale[~mask] = 0.96 * np.exp(-30. * (((self.travel_time[~mask] - transition) - 0.2 * mtt) * ((self.travel_time[~mask] - transition) - 0.2 * mtt)) / mtt ** 2.)
 
-    # preallocate array
-    hfiltdata_scan_low = np.zeros_like(hfiltdata_mass, dtype=self.data.dtype)
-
-    # begin looping through data
-    for i in range(int(self.tnum)):
-        # build a packet of 100 traces around the trace in question
-        if i <= 50:
-            scpacket = hfiltdata_mass[:, 0:100 - i]
-        elif i >= self.tnum - 50:
-            scpacket = hfiltdata_mass[:, int(self.tnum) - 100:int(self.tnum)]
-        else:
-            scpacket = hfiltdata_mass[:, i - 49:i + 50]
-
-        # average the packet horizontally and double filter it (allows the
-        # program to maintain small horizontal artifacts that are likely real)
-        avg_trace_scan_low = filtfilt([.25, .25, .25, .25],
-                                      1,
-                                      np.mean(scpacket, axis=-1)
-                                      ).flatten() * avg_trace_scale.flatten()
-
-        # subtract the average trace off the data trace
-        # hfiltdata_scan_low[:, i] = hfiltdata_mass[:, i] - avg_trace_scan_low
-        hfiltdata_scan_low[:, i] = self.data[:, i] - avg_trace_scan_low
+    # build a packet of 100 traces around each trace. Python slicing semantics
+    # are kept for the edges (and for short lines, where the indices can go negative)
+    tnum = int(self.tnum)
+    inds = np.arange(tnum)
+    starts = np.where(inds <= 50, 0, np.where(inds >= tnum - 50, tnum - 100, inds - 49))
+    ends = np.where(inds <= 50, 100 - inds, np.where(inds >= tnum - 50, tnum, inds + 50))
+    starts = np.clip(np.where(starts < 0, starts + tnum, starts), 0, tnum)
+    ends = np.clip(np.where(ends < 0, ends + tnum, ends), 0, tnum)
+
+    # average the packets horizontally and double filter them (allows the
+    # program to maintain small horizontal artifacts that are likely real)
+    avg_trace_scan_low = filtfilt([.25, .25, .25, .25],
+                                  1,
+                                  _window_means(hfiltdata_mass, starts, ends),
+                                  axis=0) * np.atleast_2d(avg_trace_scale.flatten()).transpose()
+
+    # subtract the average traces off the data traces
+    hfiltdata_scan_low = self.data - avg_trace_scan_low
 
     self.data = hfiltdata_scan_low.astype(self.data.dtype)
     print('Adaptive filtering complete')
@@ -276,31 +271,38 @@ def winavg_hfilt(self, avg_win, taper='full', filtdepth=100):
     else:
         raise ValueError('Unrecognized taper. Options are full, pexp, or tukey')
 
-    hfiltdata = np.zeros_like(self.data, dtype=self.data.dtype)
     # set up ranges, create average, taper average, subtract average
-
-    for i in range(int(self.tnum)):
-        range_start = i - ((avg_win - 1) // 2)
-        range_end = i + ((avg_win - 1) // 2)
-
-        # As opposed to StoDeep, don't wrap just cutoff for simplicity
-        if range_start < 0:
-            range_start = 0
-        if range_end > self.tnum:
-            range_end = self.tnum
-        # Create an average trace
-        avg_trace = np.mean(self.data[:, range_start:range_end], axis=-1) * exptaper
-
-        # Subtract avg_trace from each trace
-        hfiltdata[:, i] = self.data[:, i] - avg_trace
-
-    self.data = hfiltdata.copy()
+    # As opposed to StoDeep, don't wrap just cutoff for simplicity
+    inds = np.arange(int(self.tnum))
+    range_start = np.maximum(inds - ((avg_win - 1) // 2), 0)
+    range_end = np.minimum(inds + ((avg_win - 1) // 2), self.tnum)
+    avg_traces = _window_means(self.data, range_start, range_end) * np.atleast_2d(exptaper).transpose()
+
+    # Subtract avg_trace from each trace
+    hfiltdata = (self.data - avg_traces).astype(self.data.dtype)
+    self.data = hfiltdata
     self.flags.hfilt = np.zeros((2,))
     self.flags.hfilt[1] = 2
 
     print('Horizontal filter complete.')
 
 
+def _window_means(data, starts, ends):
+    """Average data over the columns starts[i]:ends[i] for every i, using a running sum.
+
+    Each average costs O(snum) regardless of the window size. Empty windows give nan,
+    as np.mean would. A nan or inf would spoil every later running sum, so data that are
+    not all finite are averaged a window at a time instead.
+    """
+    if not np.all(np.isfinite(data)):
+        return np.column_stack([np.mean(data[:, start:end], axis=1) for start, end in zip(starts, ends)])
+    csum = np.zeros((data.shape[0], data.shape[1] + 1))
+    np.cumsum(data, axis=1, out=csum[:, 1:])
+    counts = np.maximum(ends - starts, 0)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return (csum[:, np.maximum(ends, starts)] - csum[:, starts]) / counts
+
+
 def hfilt(self, ftype='hfilt', bounds=None):
     """Horizontally filter the data.
 
@@ -325,6 +327,31 @@ def hfilt(self, ftype='hfilt', bounds=None):
         raise ValueError('Unrecognized filter type')
 
 
+#: Filter this many traces at a time, so the filter's scratch arrays stay small
+FILTER_TRACE_CHUNK = 1024
+
+
+def _filter_traces(data, func, rows=slice(None)):
+    """Overwrite data[rows, :] with func applied to blocks of traces
+
+    func acts on each (snum x n) block along the first axis, and its output is cast back to
+    the dtype of the data. Since traces are filtered independently, this is identical to
+    filtering everything at once, but only one block of scratch space is ever needed.
+
+    Returns
+    -------
+    np.ndarray
+        The filtered data (the input array, unless it could not be written to)
+    """
+    data = np.asarray(data)
+    if not data.flags.writeable:
+        data = data.copy()
+    for i in range(0, data.shape[1], FILTER_TRACE_CHUNK):
+        block = data[:, i:i + FILTER_TRACE_CHUNK]
+        block[rows, :] = func(block)
+    return data
+
+
 def vertical_band_pass(self,
                        low,
                        high,
@@ -385,18 +412,18 @@ def vertical_band_pass(self,
     # so we need to do each case separately
     if filttype.lower() in ['butter', 'butterworth']:
         b, a = butter(order, corner_freq, 'bandpass')
-        self.data = filtfilt(b, a, self.data, axis=0).astype(self.data.dtype)
+        self.data = _filter_traces(self.data, lambda block: filtfilt(b, a, block, axis=0))
     elif filttype.lower() in ['cheb', 'chebyshev']:
         b, a = cheby1(order, cheb_rp, corner_freq, 'bandpass')
-        self.data = filtfilt(b, a, self.data, axis=0).astype(self.data.dtype)
+        self.data = _filter_traces(self.data, lambda block: filtfilt(b, a, block, axis=0))
     elif filttype.lower() == 'bessel':
         b, a = bessel(order, corner_freq, 'bandpass')
-        self.data = filtfilt(b, a, self.data, axis=0).astype(self.data.dtype)
+        self.data = _filter_traces(self.data, lambda block: filtfilt(b, a, block, axis=0))
     elif filttype.lower() == 'fir':
         taps = firwin(order + 1, corner_freq, pass_zero=False)
         # I'm leaving the data past the filter--this is not filtfilt so we have a delay
-        self.data[:-order, :] = lfilter(taps, 1.0, self.data, axis=0
-                                        ).astype(self.data.dtype)[order:, :]
+        self.data = _filter_traces(self.data, lambda block: lfilter(taps, 1.0, block, axis=0)[order:, :],
+                                   rows=slice(None, -order))
     else:
         raise ValueError('Filter type {:s} is not recognized'.format(filttype))
 
@@ -436,7 +463,8 @@ def denoise(self, vert_win=1, hor_win=10, noise=None, ftype='wiener'):
         raise TypeError('Only the wiener filter has been implemented for denoising.')
 
 
-def migrate(self, mtype='stolt', vtaper=10, htaper=10, tmig=0, vel_fn=None, vel=1.68e8, nxpad=10, nearfield=False, verbose=0):
+def migrate(self, mtype='stolt', vtaper=10, htaper=10, tmig=0, vel_fn=None, vel=1.68e8, nxpad=10, nearfield=False, verbose=0,
+            max_offset=None, mem_limit=1.0e8, n_jobs=1, pad=False, refine=2):
     """Migrate the data.
 
     This is a wrapper around all the migration routines in migration_routines.py.
@@ -444,17 +472,32 @@ def migrate(self, mtype='stolt', vtaper=10, htaper=10, tmig=0, vel_fn=None, vel=
     Parameters
     ----------
     mtype: str, optional
-        The chosen migration routine. Options are: kirch, stolt, phsh.
+        The chosen migration routine. Options are: kirch, stolt, phsh, tk, or a SeisUnix routine (su...).
         Default: stolt
+    max_offset: float, optional
+        Maximum lateral offset (aperture) for Kirchhoff migration, in the units of dist.
+        Default is None (full aperture).
+    mem_limit: float, optional
+        Approximate memory budget, in bytes, for the blocked Kirchhoff and constant-velocity
+        phase-shift summations. Default 1e8.
+    n_jobs: int, optional
+        Number of threads used to migrate slabs of the frequency-wavenumber plane
+        (stolt and phsh). Default 1.
+    pad: bool, optional
+        Zero pad to power-of-two sizes in x and t before the Fourier transform (stolt).
+        Default False.
+    refine: int, optional
+        Factor by which the finite-difference time step is refined relative to the sample
+        interval (tk). Default 2.
     """
     if mtype == 'kirch':
-        migrationlib.migrationKirchhoff(self, vel=vel, nearfield=nearfield)
+        migrationlib.migrationKirchhoff(self, vel=vel, nearfield=nearfield, max_offset=max_offset, mem_limit=mem_limit)
     elif mtype == 'stolt':
-        migrationlib.migrationStolt(self, vel=vel, htaper=htaper, vtaper=vtaper)
+        migrationlib.migrationStolt(self, vel=vel, htaper=htaper, vtaper=vtaper, pad=pad, n_jobs=n_jobs)
     elif mtype == 'phsh':
-        migrationlib.migrationPhaseShift(self, vel=vel, vel_fn=vel_fn, htaper=htaper, vtaper=vtaper)
+        migrationlib.migrationPhaseShift(self, vel=vel, vel_fn=vel_fn, htaper=htaper, vtaper=vtaper, mem_limit=mem_limit, n_jobs=n_jobs)
     elif mtype == 'tk':
-        migrationlib.migrationTimeWavenumber(self, vel=vel, vel_fn=vel_fn, htaper=htaper, vtaper=vtaper)
+        migrationlib.migrationTimeWavenumber(self, vel=vel, vel_fn=vel_fn, htaper=htaper, vtaper=vtaper, refine=refine)
     elif mtype[:2] == 'su':
         migrationlib.migrationSeisUnix(self, mtype=mtype, vel=vel, vel_fn=vel_fn, tmig=tmig, verbose=verbose, nxpad=nxpad, htaper=htaper, vtaper=vtaper)
     else:
@@ -7,11 +7,13 @@
 # Distributed under terms of the GNU-GPL3.0 license.
 
 """
-Define processing steps for Radar Data. These are all instance methods.
+Define processing steps for Radar Data. These are all instance methods,
+except for restack_stream, which works on blocks of traces rather than on a RadarData object.
 """
 
 import numpy as np
 from scipy.interpolate import interp1d
+from scipy.ndimage import maximum_filter1d
 from scipy.optimize import minimize
 from ..permittivity_models import firn_permittivity
 
@@ -364,12 +366,33 @@ def hcrop(self, lim, left_or_right='left', dimension='tnum'):
 
     # More complex modifications for these two
     self.dist = self.dist[lims[0]:lims[1]] - self.dist[lims[0]]
-    self.travel_time = self.trace_num[lims[0]:lims[1]] - lims[0] + 1
+    self.trace_num = self.trace_num[lims[0]:lims[1]] - self.trace_num[lims[0]] + 1
 
     # Finally tnum
     self.tnum = self.data.shape[1]
 
 
+#: Per-trace attributes that are averaged when restacking
+ONED_RESTACK_VARS = ['dist',
+                     'pressure',
+                     'trig_level',
+                     'lat',
+                     'long',
+                     'x_coord',
+                     'y_coord',
+                     'elev',
+                     'decday']
+
+
+def _block_means(arr, traces):
+    """Average the last axis of arr in consecutive blocks of the given number of traces.
+
+    Traces beyond the last full block are dropped.
+    """
+    tnum = arr.shape[-1] // traces
+    return np.mean(np.reshape(arr[..., :tnum * traces], arr.shape[:-1] + (tnum, traces)), axis=-1, dtype=float)
+
+
 def restack(self, traces):
     """Restack all relevant data to the given number of traces.
 
@@ -388,26 +411,15 @@ def restack(self, traces):
         print('Only will stack odd numbers of traces. Using {:d}'.format(int(traces + 1)))
         traces = traces + 1
     tnum = int(np.floor(self.tnum / traces))
-    stack = np.zeros((self.snum, tnum))
-    trace_int = np.zeros((tnum, ))
-    oned_restack_vars = ['dist',
-                         'pressure',
-                         'trig_level',
-                         'lat',
-                         'long',
-                         'x_coord',
-                         'y_coord',
-                         'elev',
-                         'decday']
-    oned_newdata = {key: np.zeros((tnum, )) if getattr(self, key) is not None else None for key in oned_restack_vars}
-    for j in range(tnum):
-        stack[:, j] = np.mean(self.data[:, j * traces:min((j + 1) * traces, self.data.shape[1])],
-                              axis=1)
-        trace_int[j] = np.sum(self.trace_int[j * traces:min((j + 1) * traces, self.data.shape[1])])
-        for var, val in oned_newdata.items():
-            if val is not None:
-                val[j] = np.mean(getattr(self, var)[j * traces:
-                                                    min((j + 1) * traces, self.data.shape[1])])
+    # Every output trace is a full block of input traces; anything left over at the end is dropped
+    stack = _block_means(self.data, traces)
+    if np.ndim(self.trace_int) == 0:
+        trace_int = self.trace_int * traces * np.ones((tnum, ))
+    else:
+        trace_int = _block_means(self.trace_int, traces) * traces
+    oned_newdata = {key: _block_means(getattr(self, key), traces)
+                    if getattr(self, key) is not None and np.ndim(getattr(self, key)) > 0
+                    else getattr(self, key) for key in ONED_RESTACK_VARS}
     self.tnum = tnum
     self.data = stack
     self.trace_num = np.arange(self.tnum).astype(int) + 1
@@ -417,6 +429,49 @@ def restack(self, traces):
     self.flags.restack = True
 
 
+def restack_stream(chunks, traces):
+    """Restack traces as they arrive, rather than all at once.
+
+    This allows restacking while reading, so that high-PRF data never need to be held in
+    memory at full resolution. Traces that do not fill a block are carried over to the next
+    chunk, and any that are left after the last chunk are dropped, as in :func:`restack`.
+
+    Parameters
+    ----------
+    chunks: iterable
+        Yields tuples of (data, attrs), where data is a (snum x n) array of the next n traces
+        and attrs is a dictionary of per-trace arrays of length n (e.g. lat, long, decday).
+        A trace_int entry, if given, is summed rather than averaged.
+    traces: int
+        The (odd) number of traces to stack
+
+    Yields
+    ------
+    data: np.ndarray
+        The restacked traces completed by this chunk (possibly zero of them)
+    attrs: dict
+        The restacked per-trace attributes for those traces
+    """
+    traces = int(traces)
+    if traces % 2 == 0:
+        print('Only will stack odd numbers of traces. Using {:d}'.format(int(traces + 1)))
+        traces = traces + 1
+    leftover_data = None
+    leftover_attrs = {}
+    for data, attrs in chunks:
+        if leftover_data is not None:
+            data = np.hstack((leftover_data, data))
+            attrs = {key: np.hstack((leftover_attrs[key], val)) for key, val in attrs.items()}
+        nfull = (data.shape[1] // traces) * traces
+        leftover_data = data[:, nfull:]
+        leftover_attrs = {key: val[nfull:] for key, val in attrs.items()}
+
+        out_attrs = {key: _block_means(val, traces) for key, val in attrs.items()}
+        if 'trace_int' in out_attrs:
+            out_attrs['trace_int'] = out_attrs['trace_int'] * traces
+        yield _block_means(data, traces), out_attrs
+
+
 def rangegain(self, slope):
     """Apply a range gain.
 
@@ -429,19 +484,23 @@ def rangegain(self, slope):
         gain = self.travel_time[int(self.trig) + 1:] * slope
         self.data[int(self.trig + 1):, :] *= np.atleast_2d(gain).transpose()
     else:
-        for i, trig in enumerate(self.trig):
-            gain = self.travel_time[int(trig) + 1:] * slope
-            self.data[int(trig) + 1:, i] *= gain
+        # Only gain the samples after each trace's trigger
+        after_trig = np.atleast_2d(np.arange(self.snum)).transpose() > np.atleast_2d(self.trig.astype(int))
+        self.data *= np.where(after_trig, np.atleast_2d(self.travel_time * slope).transpose(), 1.)
     self.flags.rgain = True
 
 
-def agc(self, window=50, scaling_factor=50):
+def agc(self, window=50, scaling_factor=50, per_trace=False, amp='max'):
     """Try to do some automatic gain control
 
     This is from StoDeep--I'm not sure it is useful but it was easy to roll over so
     I'm going to keep it. I think you should have most of this gone with a bandpass,
     but whatever.
 
+    By default, every sample is scaled by the maximum amplitude across all traces within
+    a vertical window around it. With per_trace, each trace is instead scaled by its own
+    windowed amplitude.
+
     Parameters
     ----------
     window: int, optional
@@ -449,15 +508,34 @@ def agc(self, window=50, scaling_factor=50):
     scaling_factor: int, optional
         The scaling factor. This gets divided by the max amplitude when we rescale the input.
         Default 50.
+    per_trace: bool, optional
+        Gain each trace using only its own amplitudes. Default False.
+    amp: str, optional
+        The windowed amplitude used with per_trace. Either 'max' (maximum absolute value)
+        or 'rms' (root-mean-square). The profile-wide gain always uses max. Default 'max'.
     """
-    maxamp = np.zeros((self.snum,))
+    if window // 2 < 1:
+        raise ValueError('The window must be at least 2 samples')
+    if amp not in ['max', 'rms']:
+        raise ValueError('amp must be max or rms')
+    # The window around sample i is [i - window // 2, i + window // 2), cut off at the edges.
     # In the for loop, old code indexed used range(window // 2). This did not make sense to me.
-    for i in range(self.snum):
-        print(i, max(0, i - window // 2), min(i + window // 2, self.snum))
-        maxamp[i] = np.max(np.abs(self.data[max(0, i - window // 2):
-                                            min(i + window // 2, self.snum), :]))
+    size = 2 * (window // 2)
+    if not per_trace:
+        maxamp = maximum_filter1d(np.max(np.abs(self.data), axis=1), size, mode='nearest')
+        maxamp = np.atleast_2d(maxamp).transpose()
+    elif amp == 'max':
+        maxamp = maximum_filter1d(np.abs(self.data), size, axis=0, mode='nearest')
+    else:
+        # running sum of the power so that windows are cut off at the edges
+        csum = np.zeros((self.snum + 1, self.tnum))
+        np.cumsum(np.abs(self.data.astype(float)) ** 2., axis=0, out=csum[1:, :])
+        inds = np.arange(self.snum)
+        tops = np.maximum(inds - window // 2, 0)
+        bottoms = np.minimum(inds + window // 2, self.snum)
+        maxamp = np.sqrt(np.maximum(csum[bottoms, :] - csum[tops, :], 0.) / np.atleast_2d(bottoms - tops).transpose())
     maxamp[maxamp == 0] = 1.0e-6
-    self.data *= (scaling_factor / np.atleast_2d(maxamp).transpose()).astype(self.data.dtype)
+    self.data *= (scaling_factor / maxamp).astype(self.data.dtype)
     self.flags.agc = True
 
 
@@ -11,6 +11,7 @@
 """
 
 
+import os.path
 import numpy as np
 from scipy.io import savemat
 from ..RadarFlags import RadarFlags
@@ -29,6 +30,18 @@ try:
 except ImportError:
     SEGY = False
 
+# Try to enable saving to hdf5
+try:
+    import h5py
+    H5 = True
+except ImportError:
+    H5 = False
+
+#: Extensions that we save as HDF5 rather than .mat
+H5_EXTENSIONS = ['.h5', '.hdf5']
+#: Mark the root of HDF5 files that we write so we can recognize them
+H5_FORMAT = 'ImpDAR RadarData'
+
 
 def save(self, fn):
     """Save the radar data
@@ -36,8 +49,10 @@ def save(self, fn):
     Parameters
     ----------
     fn: str
-        Filename. Should have a .mat extension
+        Filename. Should have a .mat extension, or .h5 to use :func:`save_as_h5`
     """
+    if os.path.splitext(fn)[1] in H5_EXTENSIONS:
+        return self.save_as_h5(fn)
     mat = {}
 
     for attr in self.attrs_guaranteed:
@@ -74,11 +89,148 @@ def save(self, fn):
     savemat(fn, mat)
 
 
+def save_as_h5(self, fn, compression=None, chunk_traces=256):
+    """Save the radar data as HDF5
+
+    Unlike .mat files, this has no size limit, can be compressed, and can be read in part
+    (see :func:`~impdar.lib.load.load_h5.load_h5`). The data are chunked by blocks of traces
+    and written one chunk at a time. The other attributes, the flags, and the picks are
+    stored alongside the data.
+
+    Parameters
+    ----------
+    fn: str
+        The filename of the output
+    compression: str, optional
+        HDF5 compression filter for the data, e.g. 'gzip' or 'lzf'. Default None.
+    chunk_traces: int, optional
+        Number of traces per chunk of data. Default 256.
+    """
+    if not H5:
+        raise ImportError('h5py failed to import, cannot save as h5')
+
+    with h5py.File(fn, 'w') as fout:
+        dset = create_h5_data(fout, (self.snum, self.tnum), self.data.dtype,
+                              compression=compression, chunk_traces=chunk_traces)
+        for i in range(0, self.tnum, dset.chunks[1]):
+            dset[:, i:i + dset.chunks[1]] = np.asarray(self.data[:, i:i + dset.chunks[1]])
+        write_h5_metadata(self, fout)
+
+
+def create_h5_data(fout, shape, dtype, compression=None, chunk_traces=256, resizable=False):
+    """Mark an open HDF5 file as ours and make the (empty) dataset for the data
+
+    The data are chunked by blocks of traces, so that they can be written and read a block
+    at a time. If resizable, traces can be appended later.
+
+    Returns
+    -------
+    h5py.Dataset
+        The dataset to write the data into
+    """
+    fout.attrs['format'] = H5_FORMAT
+    if not resizable:
+        chunk_traces = min(chunk_traces, shape[1])
+    return fout.create_dataset('data', shape=shape, dtype=dtype,
+                               chunks=(shape[0], max(1, chunk_traces)), compression=compression,
+                               shuffle=compression is not None,
+                               maxshape=(shape[0], None) if resizable else None)
+
+
+def write_h5_metadata(self, fout):
+    """Write everything but the data (attributes, flags, and picks) into an open HDF5 file"""
+    attrs = {attr: getattr(self, attr, None) for attr in self.attrs_guaranteed + self.attrs_optional
+             if attr != 'data'}
+    _write_h5_dict(fout, {attr: val for attr, val in attrs.items() if val is not None})
+    _write_h5_dict(fout.create_group('flags'), (self.flags or RadarFlags()).to_matlab())
+    if self.picks is not None:
+        _write_h5_dict(fout.create_group('picks'), self.picks.to_struct())
+
+
+def _write_h5_dict(group, dict_in):
+    """Write a (nested) dictionary into an HDF5 group: dicts become groups, strings attributes"""
+    for key, val in dict_in.items():
+        if isinstance(val, dict):
+            _write_h5_dict(group.create_group(key), val)
+        elif isinstance(val, str):
+            group.attrs[key] = val
+        else:
+            val = np.asarray(val)
+            # structs from .mat files can leave values wrapped in singleton object arrays
+            while val.dtype == object and val.size == 1:
+                val = np.asarray(val.flat[0])
+            group.create_dataset(key, data=val)
+
+
+#: Write this many traces at a time
+SEGY_TRACE_CHUNK = 4096
+#: Coordinates and elevations are written in hundredths (a scalar of -100)
+SEGY_COORD_SCALAR = -100
+
+
 def save_as_segy(self, fn):
+    """Save the radar data as SEG-Y
+
+    Traces and their headers are written a chunk at a time straight from the data, with
+    the traces as IEEE floats. Each trace header has the trace number (as the sequence and
+    CDP numbers), the x and y coordinates (as the source, receiver, and CDP positions), the
+    elevation, and the delay to the first sample. As elsewhere in ImpDAR, times are scaled
+    by 1e6 so that they fit the header fields: the sample interval is in ps and the delay
+    in ns.
+
+    Parameters
+    ----------
+    fn: str
+        The filename of the output
+    """
     if not SEGY:
         raise ImportError('segyio failed to import, cannot save as segy')
 
-    segyio.tools.from_array2D(fn, self.data.transpose(), dt=self.dt * 1.0e12)
+    dt = int(round(self.dt * 1.0e12))
+    delay = int(np.clip(np.round(np.ravel(self.travel_time)[0] * 1.0e3), -2 ** 15, 2 ** 15 - 1))
+    # Header values go in as python ints, converted once for all traces
+    trace_num = np.asarray(self.trace_num if self.trace_num is not None else np.arange(self.tnum) + 1).astype(int).tolist()
+    x, y, elev = [_scaled_header_ints(getattr(self, attr, None), self.tnum)
+                  for attr in ['x_coord', 'y_coord', 'elev']]
+
+    spec = segyio.spec()
+    spec.format = segyio.SegySampleFormat.IEEE_FLOAT_4_BYTE
+    spec.samples = list(range(self.snum))
+    spec.tracecount = self.tnum
+    with segyio.create(fn, spec) as fout:
+        fout.bin.update({segyio.BinField.Interval: dt,
+                         segyio.BinField.IntervalOriginal: dt,
+                         segyio.BinField.Samples: self.snum,
+                         segyio.BinField.SamplesOriginal: self.snum,
+                         segyio.BinField.EnsembleFold: 1})
+        for i in range(0, self.tnum, SEGY_TRACE_CHUNK):
+            j = min(i + SEGY_TRACE_CHUNK, self.tnum)
+            fout.trace[i:j] = np.ascontiguousarray(np.asarray(self.data[:, i:j], dtype=np.float32).transpose())
+            fout.header[i:j] = [{segyio.TraceField.TRACE_SEQUENCE_LINE: tn,
+                                 segyio.TraceField.TRACE_SEQUENCE_FILE: k + 1,
+                                 segyio.TraceField.CDP: tn,
+                                 segyio.TraceField.TRACE_SAMPLE_COUNT: self.snum,
+                                 segyio.TraceField.TRACE_SAMPLE_INTERVAL: dt,
+                                 segyio.TraceField.DelayRecordingTime: delay,
+                                 segyio.TraceField.SourceGroupScalar: SEGY_COORD_SCALAR,
+                                 segyio.TraceField.ElevationScalar: SEGY_COORD_SCALAR,
+                                 segyio.TraceField.SourceX: xk,
+                                 segyio.TraceField.SourceY: yk,
+                                 segyio.TraceField.GroupX: xk,
+                                 segyio.TraceField.GroupY: yk,
+                                 segyio.TraceField.CDP_X: xk,
+                                 segyio.TraceField.CDP_Y: yk,
+                                 segyio.TraceField.SourceSurfaceElevation: ek,
+                                 segyio.TraceField.ReceiverGroupElevation: ek}
+                                for k, tn, xk, yk, ek in zip(range(i, j), trace_num[i:j], x[i:j], y[i:j], elev[i:j])]
+
+
+def _scaled_header_ints(vals, tnum):
+    """Convert coordinates to the integers that go in SEG-Y headers, with NaN or missing as 0"""
+    if vals is None:
+        return [0] * tnum
+    vals = np.nan_to_num(np.ravel(vals).astype(float)) * abs(SEGY_COORD_SCALAR)
+    return np.clip(np.round(vals), -2 ** 31, 2 ** 31 - 1).astype(int).tolist()
 
 
 def output_shp(self, fn, t_srs=4326, target_out=None):
@@ -17,6 +17,7 @@ from scipy.io import loadmat
 from ..RadarFlags import RadarFlags
 from ..ImpdarError import ImpdarError
 from ..Picks import Picks
+from ..LazyData import LazyData, MatVariable
 
 
 class RadarData(object):
@@ -55,12 +56,23 @@ class RadarData(object):
     from ._RadarDataProcessing import reverse, nmo, crop, hcrop, restack, \
         rangegain, agc, constant_space, elev_correct, constant_sample_depth_spacing, \
         traveltime_to_depth
-    from ._RadarDataSaving import save, save_as_segy, output_shp, output_csv, _get_pick_targ_info
+    from ._RadarDataSaving import save, save_as_segy, save_as_h5, output_shp, output_csv, _get_pick_targ_info
     from ._RadarDataFiltering import adaptivehfilt, horizontalfilt, highpass, \
         winavg_hfilt, hfilt, vertical_band_pass, denoise, migrate
 
     # Now make some load/save methods that will work with the matlab format
-    def __init__(self, fn_mat):
+    def __init__(self, fn_mat, load_data=True):
+        """Load a .mat file in the StoDeep/ImpDAR format, or make an empty object
+
+        Parameters
+        ----------
+        fn_mat: str or None
+            The file to load. If None, all attributes are None.
+        load_data: bool, optional
+            If False, read only the metadata (coordinates, picks, flags, etc.) now.
+            The data are then a :class:`~impdar.lib.LazyData.LazyData`, and are read
+            the first time they are used. Default True.
+        """
         if fn_mat is None:
             # Write these out so we can document them
             # Very basics
@@ -118,7 +130,15 @@ class RadarData(object):
             self.data_dtype = None
             return
 
-        mat = loadmat(fn_mat)
+        if load_data:
+            mat = loadmat(fn_mat)
+        else:
+            mat = loadmat(fn_mat, variable_names=[attr for attr in self.attrs_guaranteed + self.attrs_optional
+                                                  if attr != 'data'] + ['flags', 'picks'])
+            try:
+                mat['data'] = LazyData(MatVariable(fn_mat, 'data'), whole=True)
+            except KeyError:
+                raise KeyError('.mat file does not appear to be in the StoDeep/ImpDAR format')
         for attr in self.attrs_guaranteed:
             if attr not in mat:
                 raise KeyError('.mat file does not appear to be in the StoDeep/ImpDAR format')
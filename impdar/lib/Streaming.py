@@ -0,0 +1,280 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+Process traces as they are acquired, for a live look at the data in the field.
+
+Readers for files that are still being written (:func:`~impdar.lib.load.load_gssi.stream_gssi`
+and :func:`~impdar.lib.load.load_olaf.stream_olaf`) yield blocks of new traces as
+(data, attrs) tuples, where attrs holds per-trace arrays. Those blocks can be processed
+with :func:`process_stream`, appended to an h5 file with :class:`StreamWriter`, and shown
+with :class:`~impdar.lib.plot.LiveRadargram`.
+"""
+import io
+import os
+import copy
+import time
+from contextlib import redirect_stdout
+import numpy as np
+
+from .RadarData._RadarDataProcessing import restack_stream
+from .RadarData._RadarDataSaving import H5, create_h5_data, write_h5_metadata
+
+if H5:
+    import h5py
+
+#: Per-trace attributes of the output. Any that the reader did not give are zero.
+TRACE_ATTRS = ['decday', 'lat', 'long', 'pressure', 'trace_int', 'trig_level', 'dist', 'elev',
+               'x_coord', 'y_coord']
+
+
+def follow(read_new, poll=1., timeout=10.):
+    """Yield new traces until they stop coming
+
+    Parameters
+    ----------
+    read_new: callable
+        Takes no arguments. Returns (data, attrs) for the next traces, or None if there are not any yet.
+    poll: float, optional
+        Seconds to wait between checks when there are no new traces. Default 1.
+    timeout: float, optional
+        Stop after this many seconds without new traces. None waits forever. Default 10.
+
+    Yields
+    ------
+    data: np.ndarray
+        The new traces (snum x n)
+    attrs: dict
+        Per-trace attributes of the new traces
+    """
+    last = time.time()
+    while True:
+        chunk = read_new()
+        if chunk is not None:
+            last = time.time()
+            yield chunk
+        elif timeout is not None and time.time() - last >= timeout:
+            return
+        else:
+            time.sleep(poll)
+
+
+def process_stream(dat, chunks, dc=False, vbp=None, restack=None, rgain=None):
+    """Process blocks of traces as they arrive
+
+    Steps are run in the order listed below. DC removal, the bandpass, and the range gain act
+    on each trace on its own, so each block gets exactly what it would in the whole profile.
+    Restacking carries incomplete stacks over to the next block.
+
+    Parameters
+    ----------
+    dat: `~impdar.lib.RadarData.RadarData`
+        The header for the stream, e.g. from :func:`~impdar.lib.load.load_gssi.stream_gssi`.
+        Its flags are updated as the steps are run.
+    chunks: iterable
+        Yields (data, attrs) for blocks of traces
+    dc: bool, optional
+        Subtract the mean of each trace. Default False.
+    vbp: 2-tuple, optional
+        Vertical bandpass between (vbp1, vbp2) MHz. Default None (no filtering).
+    restack: int, optional
+        Stack this many traces. Default None (no restacking).
+    rgain: float, optional
+        Slope of a linear range gain. Default None (no gain).
+
+    Yields
+    ------
+    data: np.ndarray
+        The processed traces. There may be none, if they are waiting to be stacked.
+    attrs: dict
+        Per-trace attributes of the processed traces
+    """
+    steps = []
+    if dc:
+        steps.append(_remove_dc)
+    if vbp is not None:
+        steps.append(lambda block: block.vertical_band_pass(*vbp))
+    chunks = _map_chunks(dat, chunks, steps)
+    if restack is not None:
+        chunks = _set_restack_flag(dat, restack_stream(chunks, restack))
+    if rgain is not None:
+        chunks = _map_chunks(dat, chunks, [lambda block: block.rangegain(rgain)])
+    return chunks
+
+
+def _remove_dc(block):
+    block.data = block.data - np.mean(block.data, axis=0)
+
+
+def _map_chunks(dat, chunks, steps):
+    """Run RadarData methods on each block of traces"""
+    first = True
+    for data, attrs in chunks:
+        block = copy.copy(dat)
+        block.flags = copy.deepcopy(dat.flags)
+        block.data = np.asarray(data, dtype=float)
+        block.tnum = data.shape[1]
+        for attr, val in attrs.items():
+            setattr(block, attr, val)
+        if block.tnum > 0:
+            # Only say what we are doing once
+            if first:
+                _run_steps(block, steps)
+                first = False
+            else:
+                with redirect_stdout(io.StringIO()):
+                    _run_steps(block, steps)
+        dat.flags = block.flags
+        yield block.data, {attr: getattr(block, attr) for attr in attrs}
+
+
+def _run_steps(block, steps):
+    for step in steps:
+        step(block)
+
+
+def _set_restack_flag(dat, chunks):
+    for chunk in chunks:
+        dat.flags.restack = True
+        yield chunk
+
+
+class StreamWriter:
+    """Append blocks of traces to an ImpDAR h5 file as they arrive
+
+    The data are flushed to disk after every block. The metadata are written on close,
+    after which the file can be loaded like any other.
+
+    Parameters
+    ----------
+    fn: str
+        The output file
+    dat: `~impdar.lib.RadarData.RadarData`
+        The header of the stream. Its flags and other metadata are saved on close.
+    chunk_traces: int, optional
+        Traces per chunk of the h5 dataset. Default 256.
+    """
+
+    def __init__(self, fn, dat, chunk_traces=256):
+        if not H5:
+            raise ImportError('You need h5py to write streams')
+        self.fout = h5py.File(fn, 'w')
+        self.dat = dat
+        self.chunk_traces = chunk_traces
+        self.dset = None
+        self.tnum = 0
+        self.attrs = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+        return False
+
+    def append(self, data, attrs):
+        """Add traces to the end of the file
+
+        Parameters
+        ----------
+        data: np.ndarray
+            The new traces (snum x n)
+        attrs: dict
+            Per-trace attributes of the new traces
+        """
+        if self.dset is None:
+            self.dset = create_h5_data(self.fout, (data.shape[0], 0), data.dtype,
+                                       chunk_traces=self.chunk_traces, resizable=True)
+        n_new = data.shape[1]
+        if n_new == 0:
+            return
+        self.dset.resize(self.tnum + n_new, axis=1)
+        self.dset[:, self.tnum:self.tnum + n_new] = data
+        for attr, val in attrs.items():
+            self.attrs.setdefault(attr, []).append(np.asarray(val))
+        self.tnum += n_new
+        self.fout.flush()
+
+    def close(self):
+        """Write the metadata and close the file"""
+        if self.fout is None:
+            return
+        if self.dset is None:
+            create_h5_data(self.fout, (int(self.dat.snum), 0), self.dat.data.dtype, resizable=True)
+        meta = copy.copy(self.dat)
+        meta.tnum = self.tnum
+        # as after a restack, traces are numbered from the start of the output
+        meta.trace_num = np.arange(self.tnum) + 1
+        for attr in TRACE_ATTRS:
+            if attr in self.attrs:
+                setattr(meta, attr, np.concatenate(self.attrs[attr]))
+            else:
+                setattr(meta, attr, np.zeros((self.tnum, )))
+        write_h5_metadata(meta, self.fout)
+        self.fout.close()
+        self.fout = None
+
+
+def stream_and_save(fn, filetype='gssi', o=None, dc=False, vbp=None, restack=None, rgain=None, plot=False,
+                    channel=1, block_traces=100, poll=1., timeout=10., **kwargs):
+    """Process a file as it is written, saving (and optionally plotting) the results as they come
+
+    Parameters
+    ----------
+    fn: str
+        The file being acquired
+    filetype: str, optional
+        gssi or gecko. Default gssi.
+    o: str, optional
+        The output (h5) file. Default is fn with _proc.h5 in place of the extension.
+    dc, vbp, restack, rgain: optional
+        Processing steps, as in :func:`process_stream`
+    plot: bool, optional
+        Show a :class:`~impdar.lib.plot.LiveRadargram` of the processed data. Default False.
+    channel: int, optional
+        The receiver channel, for gecko files. Default 1.
+    block_traces: int, optional
+        Read at most this many traces at once. Default 100.
+    poll: float, optional
+        Seconds between checks for new traces. This bounds how far behind acquisition we are.
+        Default 1.
+    timeout: float, optional
+        Stop after this many seconds with no new traces. None runs until interrupted. Default 10.
+    """
+    if filetype == 'gssi':
+        from .load.load_gssi import stream_gssi
+        dat, chunks = stream_gssi(fn, block_traces=block_traces, poll=poll, timeout=timeout)
+    elif filetype == 'gecko':
+        from .load.load_olaf import stream_olaf
+        dat, chunks = stream_olaf(fn, channel=channel, block_traces=block_traces, poll=poll, timeout=timeout)
+    else:
+        raise ValueError('Can only stream gssi or gecko files')
+    if o is None:
+        bn = os.path.splitext(fn)[0]
+        if bn[-4:] == '_raw':
+            bn = bn[:-4]
+        o = bn + '_proc.h5'
+
+    live = None
+    if plot:
+        import matplotlib.pyplot as plt
+        from .plot import LiveRadargram
+        plt.ion()
+        live = LiveRadargram(dat)
+        plt.show(block=False)
+
+    with StreamWriter(o, dat) as writer:
+        try:
+            for data, attrs in process_stream(dat, chunks, dc=dc, vbp=vbp, restack=restack, rgain=rgain):
+                writer.append(data, attrs)
+                if live is not None:
+                    live.update(data)
+                    plt.pause(0.001)
+        except KeyboardInterrupt:
+            print('Stopping. Saving what we have so far.')
+    print('Wrote {:d} traces to {:s}'.format(writer.tnum, o))
@@ -12,7 +12,7 @@ Do some filetype conversions. Created mainly to have a .DZG to .shp convertsion
 
 import os
 from .RadarData import RadarData
-from .load import load_gssi, load_pulse_ekko, load_segy
+from .load import load_gssi, load_pulse_ekko, load_segy, load_h5
 
 
 def convert(fns_in, out_fmt, t_srs='wgs84', in_fmt=None, *args, **kwargs):
@@ -23,8 +23,8 @@ def convert(fns_in, out_fmt, t_srs='wgs84', in_fmt=None, *args, **kwargs):
     if t_srs == 'wgs84':
         t_srs = 4326
 
-    if out_fmt not in ['shp', 'mat', 'sgy']:
-        raise ValueError('Can only convert to shp, mat, or sgy')
+    if out_fmt not in ['shp', 'mat', 'sgy', 'h5']:
+        raise ValueError('Can only convert to shp, mat, sgy, or h5')
 
     # Treat this like batch input always
     if not isinstance(fns_in, (tuple, list)):
@@ -44,6 +44,8 @@ def convert(fns_in, out_fmt, t_srs='wgs84', in_fmt=None, *args, **kwargs):
                 if not load_segy.SEGY:
                     raise ImportError('You cannot use segy without segyio installed!')
                 loaders[i] = load_segy.load_segy
+            elif f_i[-3:] == '.h5':
+                loaders[i] = load_h5.load_h5
             else:
                 raise ValueError('Unrecognized file extension {:s}'.format(f_i[-4:]))
     else:
@@ -57,6 +59,8 @@ def convert(fns_in, out_fmt, t_srs='wgs84', in_fmt=None, *args, **kwargs):
             if not load_segy.SEGY:
                 raise ImportError('You cannot use segy without segyio installed!')
             loaders = [load_segy.load_segy for i in fns_in]
+        elif in_fmt == 'h5':
+            loaders = [load_h5.load_h5 for i in fns_in]
 
     # Now actually load the data
     data = [loader(f) for loader, f in zip(loaders, fns_in)]
@@ -79,6 +83,13 @@ def convert(fns_in, out_fmt, t_srs='wgs84', in_fmt=None, *args, **kwargs):
         for loader, f_i, dat in zip(loaders, fns_in, data):
             fn_out = os.path.splitext(f_i)[0] + '.sgy'
             dat.save_as_segy(fn_out)
+    elif out_fmt == 'h5':
+        for loader, f_i, dat in zip(loaders, fns_in, data):
+            # Guard against silly re-write
+            if loader == load_h5.load_h5:
+                continue
+            fn_out = os.path.splitext(f_i)[0] + '.h5'
+            dat.save_as_h5(fn_out)
 
 
 if __name__ == '__main__':
@@ -147,24 +147,76 @@ class nmea_info:
 
 def nmea_all_info(list_of_sentences):
     """Return an object with the nmea info from a given list of sentences"""
-    def _gga_sentence_split(sentence):
-        all = sentence.split(',')
-        numbers = list(map(lambda x: float(x) if x != '' else 0, all[1:3] + [1] + [all[4]] + [1] + all[6:10] + [all[11]]))
-        if all[3] == 'S':
-            numbers[2] = -1
-        if all[5] == 'W':
-            numbers[4] = -1
-        return numbers
-
     if list_of_sentences[0].split(',')[0] == '$GPGGA':
         data = nmea_info()
-        data.all_data = np.array([_gga_sentence_split(sentence) for sentence in list_of_sentences])
+        data.all_data = _gga_all_data(list_of_sentences)
         return data
     else:
         print(list_of_sentences[0].split(',')[0])
         raise ValueError('I can only do gga sentences right now')
 
 
+def _gga_all_data(list_of_sentences):
+    """Decode GGA sentences column-wise, rather than field by field
+
+    Returns
+    -------
+    np.ndarray
+        (n x 10) array of time, lat, N/S sign, lon, E/W sign, quality, number of satellites,
+        horizontal dilution, altitude, and geoid separation. Empty fields are 0.
+    """
+    # Fill empty fields so every column parses (twice, since replacements cannot overlap)
+    text = '\n'.join([sentence.rstrip() for sentence in list_of_sentences]) + '\n'
+    lines = text.replace(',,', ',0,').replace(',,', ',0,').replace(',\n', ',0\n').splitlines()
+
+    all_data = np.ones((len(lines), 10))
+    all_data[:, [0, 1, 3, 5, 6, 7, 8, 9]] = np.loadtxt(lines, delimiter=',', comments=None, ndmin=2,
+                                                       usecols=(1, 2, 4, 6, 7, 8, 9, 11))
+    hemispheres = np.loadtxt(lines, delimiter=',', comments=None, ndmin=2, usecols=(3, 5), dtype='U1')
+    all_data[hemispheres[:, 0] == 'S', 2] = -1
+    all_data[hemispheres[:, 1] == 'W', 4] = -1
+    return all_data
+
+
+def read_dzg(fn, marker='$GSSIS', encoding='utf-8'):
+    """Read a GSSI DZG (or similar) file in one pass, pairing GGA sentences with scan numbers.
+
+    Each GGA sentence is matched to the marker line before it, which gives the scan (trace)
+    number at which the GGA was recorded. Other NMEA sentences are ignored.
+
+    Parameters
+    ----------
+    fn: str
+        The file to read
+    marker: str, optional
+        The start of lines that give the scan number as their second field. Default $GSSIS.
+    encoding: str, optional
+        Encoding of the file. Undecodable bytes are ignored.
+
+    Returns
+    -------
+    gga: list of str
+        All the GGA sentences in the file
+    scans: np.ndarray
+        The scan number of each marker line that is followed by a GGA sentence
+    """
+    with open(fn, 'r', encoding=encoding, errors='ignore') as fin:
+        lines = fin.read().splitlines()
+
+    gga = []
+    scans = []
+    last_scan = None
+    for line in lines:
+        if marker in line:
+            last_scan = line
+        elif 'GGA' in line:
+            gga.append(line)
+            if last_scan is not None:
+                scans.append(int(last_scan.split(',')[1]))
+                last_scan = None
+    return gga, np.array(scans)
+
+
 class RadarGPS(nmea_info):
 
     def __init__(self, gga, scans, trace_num):
@@ -11,17 +11,19 @@ A wrapper around the other loading utilities
 """
 
 import os.path
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-from . import load_gssi, load_pulse_ekko, load_gprMax, load_olaf, load_mcords, load_segy
+from . import load_gssi, load_pulse_ekko, load_gprMax, load_olaf, load_mcords, load_segy, load_h5
 from ..RadarData import RadarData
+from ..ImpdarError import ImpdarError
 
 # This should be updated as new functionality arrives
 # executables that accept multiple ftypes should use this
 # to figure out what the available options are
-FILETYPE_OPTIONS = ['mat', 'pe', 'gssi', 'gprMax', 'gecko', 'segy', 'mcords_mat', 'mcords_nc']
+FILETYPE_OPTIONS = ['mat', 'pe', 'gssi', 'gprMax', 'gecko', 'segy', 'mcords_mat', 'mcords_nc', 'h5']
 
 
-def load(filetype, fns_in, channel=1):
+def load(filetype, fns_in, channel=1, memmap=False, n_jobs=1):
     """Load a list of files of a certain type
 
     Parameters
@@ -37,53 +39,103 @@ def load(filetype, fns_in, channel=1):
                         'mcords_nc' (MCoRDS netcdf)
                         'mcords_mat' (MCoRDS matlab format)
                         'mat' (StODeep matlab format)
+                        'h5' (ImpDAR hdf5 format)
     fns: list
         List of files to load
     channel: Receiver channel that the data were recorded on
         This is primarily for the St. Olaf HF data
+    memmap: bool, optional
+        Memory-map the files and only read data as they are used. Only for gssi, mcords_nc,
+        and h5 at present; mat files read only their metadata, and all the data on first use.
+    n_jobs: int, optional
+        Load this many files at once, each in its own process. Default 1.
+        Gecko files are always loaded together, since they are concatenated.
+        Cannot be used with memmap, since the data would be copied back from each process.
 
     Returns
     -------
     RadarDataList: list of ~impdar.RadarData (or its subclasses)
-        Objects with relevant radar information
+        Objects with relevant radar information, in the same order as fns_in
     """
     if not isinstance(fns_in, (list, tuple)):
         fns_in = [fns_in]
+    if filetype not in FILETYPE_OPTIONS:
+        raise ValueError('Unrecognized filetype')
+    if memmap and n_jobs > 1:
+        # Memory maps pickle by value, so the workers would send back all the data
+        raise ValueError('memmap cannot be used with n_jobs > 1')
+
+    if filetype == 'gecko':
+        # Slightly different because we assume that we want to concat
+        return [load_olaf.load_olaf(fns_in, channel=channel)]
+    if n_jobs > 1 and len(fns_in) > 1:
+        return _run_per_file(_load_one, [(filetype, fn, channel, memmap) for fn in fns_in], fns_in, n_jobs)
+    return [_load_one(filetype, fn, channel=channel, memmap=memmap) for fn in fns_in]
+
 
+def _load_one(filetype, fn, channel=1, memmap=False):
+    """Load a single file of any type but gecko"""
     if filetype == 'gssi':
-        dat = [load_gssi.load_gssi(fn) for fn in fns_in]
+        return load_gssi.load_gssi(fn, memmap=memmap)
     elif filetype == 'pe':
-        dat = [load_pulse_ekko.load_pe(fn) for fn in fns_in]
+        return load_pulse_ekko.load_pe(fn)
     elif filetype == 'mat':
-        dat = [RadarData(fn) for fn in fns_in]
+        return RadarData(fn, load_data=not memmap)
     elif filetype == 'gprMax':
         if load_gprMax.H5:
-            dat = [load_gprMax.load_gprMax(fn) for fn in fns_in]
+            return load_gprMax.load_gprMax(fn)
         else:
             raise ImportError('You need h5py for gprmax')
-    elif filetype == 'gecko':
-        # Slightly different because we assume that we want to concat
-        dat = [load_olaf.load_olaf(fns_in, channel=channel)]
     elif filetype == 'segy':
         if load_segy.SEGY:
-            dat = [load_segy.load_segy(fn) for fn in fns_in]
+            return load_segy.load_segy(fn)
         else:
             raise ImportError('Failed to import segyio, cannot read segy')
-    elif filetype == 'gprMax':
-        dat = [load_gprMax.load_gprMax(fn) for fn in fns_in]
     elif filetype == 'mcords_nc':
         if load_mcords.NC:
-            dat = [load_mcords.load_mcords_nc(fn) for fn in fns_in]
+            return load_mcords.load_mcords_nc(fn, lazy=memmap)
         else:
             raise ImportError('You need netCDF4 in order to read the MCoRDS files')
     elif filetype == 'mcords_mat':
-        dat = [load_mcords.load_mcords_mat(fn) for fn in fns_in]
+        return load_mcords.load_mcords_mat(fn)
+    elif filetype == 'h5':
+        if load_h5.H5:
+            return load_h5.load_h5(fn, lazy=memmap)
+        else:
+            raise ImportError('You need h5py in order to read ImpDAR h5 files')
     else:
         raise ValueError('Unrecognized filetype')
-    return dat
 
 
-def load_and_exit(filetype, fns_in, channel=1, *args, **kwargs):
+def _load_and_save(filetype, fn, fn_out, channel=1):
+    """Load a single file and save it, so that only the output name goes back to the parent"""
+    _load_one(filetype, fn, channel=channel).save(fn_out)
+    return fn_out
+
+
+def _run_per_file(func, arg_list, fns_in, n_jobs):
+    """Call func on each set of arguments in a pool of processes.
+
+    Results come back in the order of the inputs. Every file is attempted; failures are
+    reported by filename and then raised together.
+    """
+    with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+        futures = [executor.submit(func, *args) for args in arg_list]
+        results = []
+        failures = []
+        for fn, future in zip(fns_in, futures):
+            try:
+                results.append(future.result())
+            except Exception as err:
+                print('Failed on {:s}: {:s}'.format(fn, str(err)))
+                failures.append((fn, err))
+    if failures:
+        raise ImpdarError('Failed to load {:d} of {:d} files: {:s}'.format(
+            len(failures), len(fns_in), ', '.join([fn for fn, _ in failures]))) from failures[0][1]
+    return results
+
+
+def load_and_exit(filetype, fns_in, channel=1, *args, n_jobs=1, **kwargs):
     """Load a list of files of a certain type, save them as StODeep mat files, exit
 
     Parameters
@@ -98,10 +150,13 @@ def load_and_exit(filetype, fns_in, channel=1, *args, **kwargs):
                         'mcords_nc' (MCoRDS netcdf)
                         'mcords_mat' (MCoRDS matlab format)
                         'mat' (StODeep matlab format)
+                        'h5' (ImpDAR hdf5 format)
     fn: list or str
         List of files to load (or a single file)
     channel: Receiver channel that the data were recorded on
         This is primarily for the St. Olaf HF data
+    n_jobs: int, optional
+        Load and save this many files at once, each in its own process. Default 1.
     """
 
     if not isinstance(fns_in, (list, tuple)):
@@ -126,6 +181,13 @@ def load_and_exit(filetype, fns_in, channel=1, *args, **kwargs):
                 load_pulse_ekko.partition_project_file(fn)
                 os.rename(fn,'../'+fn)
         return
+    elif n_jobs > 1 and len(fns_in) > 1 and filetype != 'gecko':
+        if filetype not in FILETYPE_OPTIONS:
+            raise ValueError('Unrecognized filetype')
+        fns_out = [_out_fn(fn, len(fns_in), **kwargs) for fn in fns_in]
+        _run_per_file(_load_and_save, [(filetype, fn, fn_out, channel) for fn, fn_out in zip(fns_in, fns_out)],
+                      fns_in, n_jobs)
+        return
     else:
         dat = load(filetype, fns_in, channel=channel)
 
@@ -137,18 +199,18 @@ def load_and_exit(filetype, fns_in, channel=1, *args, **kwargs):
         if 'o' in kwargs and kwargs['o'] is not None:
             fn_out = os.path.join(kwargs['o'], os.path.split(fn_out)[-1])
         dat[0].save(fn_out)
-    elif 'o' in kwargs and kwargs['o'] is not None:
-        if len(fns_in) > 1:
-            for d_i, f_i in zip(dat, fns_in):
-                fn_out = os.path.join(kwargs['o'], os.path.split(os.path.splitext(f_i)[0] + '_raw.mat')[-1])
-                d_i.save(fn_out)
-        else:
-            fn_out = kwargs['o']
-            dat[0].save(fn_out)
     else:
         for d_i, f_i in zip(dat, fns_in):
-            fn_out = os.path.splitext(f_i)[0] + '_raw.mat'
-            d_i.save(fn_out)
+            d_i.save(_out_fn(f_i, len(fns_in), **kwargs))
+
+
+def _out_fn(fn_in, n_files, o=None, **kwargs):
+    """Where load_and_exit writes a given input file"""
+    if o is not None:
+        if n_files > 1:
+            return os.path.join(o, os.path.split(os.path.splitext(fn_in)[0] + '_raw.mat')[-1])
+        return o
+    return os.path.splitext(fn_in)[0] + '_raw.mat'
 
 
 def _common_start(string_a, string_b):
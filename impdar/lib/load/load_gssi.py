@@ -9,14 +9,20 @@
 """
 Load data from SIR3000 or SIR4000
 """
-import codecs
 import os.path
 import struct
 import datetime
+from functools import partial
 import numpy as np
-from ..gpslib import RadarGPS
+from ..gpslib import RadarGPS, read_dzg
+from ..LazyData import LazyData
 from ..RadarData import RadarData
 from ..RadarFlags import RadarFlags
+from ..Streaming import follow
+
+
+#: The data start after this many bytes of header
+HEADER_BYTES = 36 * 4096
 
 
 class GSSITime:
@@ -85,45 +91,36 @@ def _get_dzg_data(fn_dzg, trace_nums):
     data: :class:`~impdar.lib.gpslib.nmea_info`
     """
 
-    with codecs.open(fn_dzg, 'r', encoding='utf-8', errors='ignore') as f_in:
-        lines = f_in.readlines()
-    # We have to be careful with this to permit other NMEA strings to have been recorded
-    # and to be sure that the indices line up
-    gssis_inds = [i for i, line in enumerate(lines) if 'GSSIS' in line]
-    gga_inds = [i for i, line in enumerate(lines) if 'GGA' in line]
-    # we may have some records without GGA, so check if this is the case;
-    # we keep track of the offset if so
-    gssis_inds_keep = []
-    offset_ind = 0
-    for i, j in enumerate(gssis_inds[:-1]):
-        if (gga_inds[i + offset_ind] > j and gga_inds[i + offset_ind] < gssis_inds[i + 1]):
-            gssis_inds_keep.append(j)
-        else:
-            offset_ind -= 1
-    if gga_inds[-1] > gssis_inds[-1]:
-        gssis_inds_keep.append(gssis_inds[-1])
-
-    scans = np.array(list(map(lambda x: int(x.split(',')[1]),
-                              [line for i, line in enumerate(lines) if i in gssis_inds_keep])))
-    data = RadarGPS([line for i, line in enumerate(lines) if i in gga_inds], scans, trace_nums)
+    gga, scans = read_dzg(fn_dzg)
+    data = RadarGPS(gga, scans, trace_nums)
     return data
 
 
-def load_gssi(fn_dzt, *args, **kwargs):
-    """Return a RadarData object with the information from a gssi file
+def _correct_dzt_traces(data, trig):
+    """The first two samples of each trace are not data; also remove the trigger offset"""
+    data = data.astype(np.int64)
+    data[0, :] = data[2, :]
+    data[1, :] = data[2, :]
+    return data + trig
 
-    This reader is has many commented-out liens to read everything from the GSSI header.
-    I left this in there the in the hopes that it will be useful to somebody,
-    but ImpDAR does not use all this information
+
+def _read_dzt_header(fn_dzt):
+    """Read the parts of the DZT header that we use
+
+    Returns
+    -------
+    dzt_data: RadarData
+        With the header information (sampling, trigger, etc.) but no traces
+    raw_dtype: np.dtype
+        The type of the samples on disk
     """
     dzt_data = RadarData(None)
     with open(fn_dzt, 'rb') as fid:
-        lines = fid.read()
+        lines = fid.read(HEADER_BYTES)
     # tag = struct.unpack('<H', lines[0:2])[0]
     # data = struct.unpack('<H', lines[2:4])[0]
     dzt_data.snum = struct.unpack('<H', lines[4:6])[0]
     bits = struct.unpack('<H', lines[6:8])[0]
-    n_bytes = bits // 8
     if bits == 32:
         us_dattype = 'I'
     elif bits == 16:
@@ -175,23 +172,56 @@ def load_gssi(fn_dzt, *args, **kwargs):
     #               lines[130 + bytes * Gain + ntext:130 + bytes * Gain + ntext + nproc])[0]
     # else:
     #     processing = ''
-    data = np.array(struct.unpack('<{:d}'.format((len(lines) - 36 * 4096) // n_bytes) + us_dattype,
-                                  lines[36 * 4096:])).reshape((dzt_data.snum, -1), order='F')
-    data[0, :] = data[2, :]
-    data[1, :] = data[2, :]
-    data = data + dzt_data.trig
-    dzt_data.data = data
-
-    dzt_data.tnum = dzt_data.data.shape[1]
-    dzt_data.trace_num = np.arange(dzt_data.data.shape[1]) + 1
-    dzt_data.trig_level = np.zeros((dzt_data.tnum, ))
-    dzt_data.pressure = np.zeros((dzt_data.tnum, ))
     dzt_data.flags = RadarFlags()
     dzt_data.dt = dzt_data.range / dzt_data.snum * 1.0e-9
     dzt_data.travel_time = np.atleast_2d(np.arange(0,
                                                    dzt_data.range / 1.0e3,
                                                    dzt_data.dt * 1.0e6)).transpose()
     dzt_data.travel_time += dzt_data.dt * 1.0e6
+    return dzt_data, np.dtype('<' + us_dattype)
+
+
+def load_gssi(fn_dzt, *args, memmap=False, trace_range=None, **kwargs):
+    """Return a RadarData object with the information from a gssi file
+
+    This reader is has many commented-out liens to read everything from the GSSI header.
+    I left this in there the in the hopes that it will be useful to somebody,
+    but ImpDAR does not use all this information
+
+    Parameters
+    ----------
+    fn_dzt: str
+        The DZT file to read
+    memmap: bool, optional
+        Memory-map the file rather than reading it. The data are then a
+        :class:`~impdar.lib.LazyData.LazyData`, so traces are only read from disk when they
+        are used. Default False.
+    trace_range: tuple, optional
+        (first, last) zero-indexed traces to load, with last exclusive as in slicing.
+        The rest of the file is never read. Default is all traces.
+    """
+    dzt_data, raw_dtype = _read_dzt_header(fn_dzt)
+    n_bytes = raw_dtype.itemsize
+    file_bytes = os.path.getsize(fn_dzt)
+    n_traces = (file_bytes - HEADER_BYTES) // (n_bytes * dzt_data.snum)
+    start, stop, _ = slice(*(trace_range or (None, None))).indices(n_traces)
+    stop = max(start, stop)
+    # Traces are contiguous on disk, so we only touch the bytes for the traces we want
+    offset = HEADER_BYTES + start * n_bytes * dzt_data.snum
+    if memmap:
+        raw = np.memmap(fn_dzt, dtype=raw_dtype, mode='r', offset=offset,
+                        shape=(dzt_data.snum, stop - start), order='F')
+        dzt_data.data = LazyData(raw, func=partial(_correct_dzt_traces, trig=dzt_data.trig), dtype=np.int64)
+    else:
+        with open(fn_dzt, 'rb') as fid:
+            fid.seek(offset)
+            raw = np.fromfile(fid, dtype=raw_dtype, count=dzt_data.snum * (stop - start))
+        dzt_data.data = _correct_dzt_traces(raw.reshape((dzt_data.snum, -1), order='F'), dzt_data.trig)
+
+    dzt_data.tnum = dzt_data.data.shape[1]
+    dzt_data.trace_num = np.arange(start, stop) + 1
+    dzt_data.trig_level = np.zeros((dzt_data.tnum, ))
+    dzt_data.pressure = np.zeros((dzt_data.tnum, ))
 
     # Now deal with the gps info
     if os.path.exists(os.path.splitext(fn_dzt)[0] + '.DZG'):
@@ -222,3 +252,45 @@ def load_gssi(fn_dzt, *args, **kwargs):
 
     dzt_data.check_attrs()
     return dzt_data
+
+
+def stream_gssi(fn_dzt, block_traces=100, poll=1., timeout=10., **kwargs):
+    """Read traces from a DZT file as they are written
+
+    Parameters
+    ----------
+    fn_dzt: str
+        The DZT file, which may still be growing
+    block_traces: int, optional
+        Return at most this many traces at once. Default 100.
+    poll: float, optional
+        Seconds to wait before checking for new traces. Default 1.
+    timeout: float, optional
+        Stop once there have been no new traces for this many seconds. None never stops.
+        Default 10.
+
+    Returns
+    -------
+    dzt_data: RadarData
+        The header information, with no traces. GPS data are not read.
+    chunks: generator
+        Yields (data, attrs) for each new block of traces, where attrs has the trace numbers
+    """
+    dzt_data, raw_dtype = _read_dzt_header(fn_dzt)
+    dzt_data.data = np.zeros((dzt_data.snum, 0), dtype=np.int64)
+    dzt_data.tnum = 0
+    trace_bytes = raw_dtype.itemsize * dzt_data.snum
+    next_trace = [0]
+
+    def read_new():
+        n_traces = min((os.path.getsize(fn_dzt) - HEADER_BYTES) // trace_bytes - next_trace[0], block_traces)
+        if n_traces <= 0:
+            return None
+        with open(fn_dzt, 'rb') as fid:
+            fid.seek(HEADER_BYTES + next_trace[0] * trace_bytes)
+            raw = np.fromfile(fid, dtype=raw_dtype, count=dzt_data.snum * n_traces)
+        trace_num = np.arange(next_trace[0], next_trace[0] + n_traces) + 1
+        next_trace[0] += n_traces
+        return (_correct_dzt_traces(raw.reshape((dzt_data.snum, -1), order='F'), dzt_data.trig),
+                {'trace_num': trace_num})
+    return dzt_data, follow(read_new, poll=poll, timeout=timeout)
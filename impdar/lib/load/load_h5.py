@@ -0,0 +1,148 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+Load ImpDAR's own HDF5 files, as written by :func:`~impdar.lib.RadarData.RadarData.save_as_h5`
+"""
+
+import numpy as np
+from ..LazyData import LazyData, FileWindow
+from ..RadarData import RadarData
+from ..RadarData._RadarDataSaving import H5_FORMAT
+from ..RadarFlags import RadarFlags
+from ..Picks import Picks
+from ..LastTrace import LastTrace
+from ..LeaderTrailer import LeaderTrailer
+from ..PickParameters import PickParameters
+
+try:
+    import h5py
+    H5 = True
+except ImportError:
+    H5 = False
+
+#: Attributes with one value per trace, which we window along with the data
+TRACE_ATTRS = ['decday', 'lat', 'long', 'pressure', 'trace_int', 'trace_num', 'trig',
+               'dist', 'elev', 'x_coord', 'y_coord']
+
+
+def load_h5(fn_h5, *args, trace_range=None, lazy=False, **kwargs):
+    """Load an ImpDAR HDF5 file
+
+    Parameters
+    ----------
+    fn_h5: str
+        The file to read
+    trace_range: tuple, optional
+        (first, last) zero-indexed traces to load, with last exclusive as in slicing.
+        Only these traces are read from the file. Default is all traces.
+    lazy: bool, optional
+        Only read the metadata now. The data are then a
+        :class:`~impdar.lib.LazyData.LazyData`, and traces are read when they are used.
+        Default False.
+
+    Returns
+    -------
+    RadarData
+        The radar data in the file
+    """
+    if not H5:
+        raise ImportError('You need h5py to load h5 files')
+
+    h5_data = RadarData(None)
+    with h5py.File(fn_h5, 'r') as fin:
+        if fin.attrs.get('format') != H5_FORMAT or 'data' not in fin:
+            raise KeyError('.h5 file does not appear to be in the ImpDAR format')
+        tnum_file = fin['data'].shape[1]
+        traces = slice(*(trace_range or (None, None)))
+        if lazy:
+            h5_data.data = LazyData(FileWindow(fn_h5, 'data', slice(None), traces, _open_dataset))
+        else:
+            h5_data.data = fin['data'][:, traces]
+
+        for attr in h5_data.attrs_guaranteed + h5_data.attrs_optional:
+            if attr == 'data':
+                continue
+            if attr in fin:
+                val = fin[attr][()]
+            elif attr in fin.attrs:
+                val = fin.attrs[attr]
+            elif attr in h5_data.attrs_optional:
+                val = None
+            else:
+                raise KeyError('.h5 file does not appear to be in the ImpDAR format')
+            if attr in TRACE_ATTRS and np.ndim(val) > 0 and np.shape(val)[0] == tnum_file:
+                val = val[traces]
+            setattr(h5_data, attr, val)
+        h5_data.tnum = h5_data.data.shape[1]
+
+        h5_data.flags = _flags_from_dict(_read_h5_dict(fin['flags']))
+        if 'picks' in fin:
+            h5_data.picks = _picks_from_dict(h5_data, _read_h5_dict(fin['picks']), traces)
+        else:
+            h5_data.picks = Picks(h5_data)
+
+    h5_data.fn = fn_h5
+    h5_data.check_attrs()
+    return h5_data
+
+
+def _open_dataset(fn, varname):
+    """Open a dataset in an HDF5 file for a FileWindow"""
+    fin = h5py.File(fn, 'r')
+    return fin, fin[varname]
+
+
+def _read_h5_dict(group):
+    """Read an HDF5 group into a (nested) dictionary, the inverse of _write_h5_dict"""
+    dict_out = {key: (_read_h5_dict(val) if isinstance(val, h5py.Group) else val[()])
+                for key, val in group.items()}
+    dict_out.update(group.attrs)
+    return dict_out
+
+
+def _flags_from_dict(flags_dict):
+    """Make RadarFlags from the output of RadarFlags.to_matlab"""
+    flags = RadarFlags()
+    for attr in flags.attrs:
+        if attr in flags_dict:
+            setattr(flags, attr, flags_dict[attr])
+    for attr in flags.bool_attrs:
+        setattr(flags, attr, bool(getattr(flags, attr)))
+    return flags
+
+
+def _picks_from_dict(radardata, picks_dict, traces):
+    """Make Picks from the output of Picks.to_struct, keeping only some traces"""
+    picks = Picks(radardata)
+    for attr in picks.attrs:
+        val = picks_dict[attr]
+        # Zeros stand in for None
+        if np.ndim(val) == 0 and val == 0:
+            val = None
+        setattr(picks, attr, val)
+    for attr in ['samp1', 'samp2', 'samp3', 'time', 'power']:
+        if getattr(picks, attr) is not None:
+            setattr(picks, attr, getattr(picks, attr)[:, traces])
+    if picks.picknums is not None:
+        picks.picknums = np.ravel(picks.picknums).tolist()
+
+    picks.lasttrace = LastTrace()
+    for attr in LastTrace.attrs:
+        val = np.ravel(picks_dict['lasttrace'][attr])
+        setattr(picks.lasttrace, attr, None if (len(val) == 1 and val[0] == -9999) else val)
+
+    picks.lt = LeaderTrailer(radardata)
+    for attr in LeaderTrailer.attrs:
+        setattr(picks.lt, attr, picks_dict['lt'][attr])
+
+    picks.pickparams = PickParameters(radardata)
+    for attr in PickParameters.attrs:
+        setattr(picks.pickparams, attr, picks_dict['pickparams'][attr])
+    picks.pickparams.freq_update(picks.pickparams.freq)
+    return picks
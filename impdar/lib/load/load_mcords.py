@@ -12,6 +12,7 @@ Load data from the CReSIS radar MCoRDS
 import datetime
 import numpy as np
 from scipy.io import loadmat
+from ..LazyData import LazyData, FileWindow
 from ..RadarData import RadarData
 
 try:
@@ -21,42 +22,79 @@ except ImportError:
     NC = False
 
 
-def load_mcords_nc(fn):
+def _open_variable(fn, varname):
+    """Open a variable in a netCDF file, without masking, for a FileWindow"""
+    fin = Dataset(fn, 'r')
+    var = fin.variables[varname]
+    var.set_auto_mask(False)
+    return fin, var
+
+
+def load_mcords_nc(fn, trace_range=None, sample_range=None, decimate=1, lazy=False):
     """
     Load MCoRDS data as netcdf downloaded from the NSIDC
 
+    Only the requested part of the amplitude variable is read from the file, so a
+    (decimated) preview of a big frame is cheap.
+
     Parameters
     ----------
     fn_nc: str
         The filename to load
+    trace_range: tuple, optional
+        (first, last) zero-indexed traces to load, with last exclusive as in slicing.
+        Default is all traces.
+    sample_range: tuple, optional
+        (first, last) zero-indexed fast-time samples to load, with last exclusive.
+        Default is all samples.
+    decimate: int, optional
+        Only load every decimate-th trace in trace_range. Default 1 (every trace).
+    lazy: bool, optional
+        Leave the amplitudes in the file. The data are then a
+        :class:`~impdar.lib.LazyData.LazyData`, and traces are read when they are used.
+        Default False.
     """
 
     mcords_data = RadarData(None)
 
     if not NC:
         raise ImportError('Cannot load MCoRDS without netcdf4')
+    if decimate < 1:
+        raise ValueError('decimate must be a positive integer')
+    traces = slice(*(trace_range or (None, None)) + (int(decimate), ))
+    samples = slice(*(sample_range or (None, None)))
+
     dst = Dataset(fn, 'r')
-    mcords_data.data = dst.variables['amplitude'][:]
-    mcords_data.long = dst.variables['lon'][:]
-    mcords_data.lat = dst.variables['lat'][:]
+    if lazy:
+        mcords_data.data = LazyData(FileWindow(fn, 'amplitude', samples, traces, _open_variable))
+    else:
+        # without masking, to match the lazy data
+        dst.variables['amplitude'].set_auto_mask(False)
+        mcords_data.data = dst.variables['amplitude'][samples, traces]
+    mcords_data.long = dst.variables['lon'][traces]
+    mcords_data.lat = dst.variables['lat'][traces]
     # time has units of seconds according to documentation, but this seems wrong
     # numbers are way too big. Leaving it since that is how it is documented though?
-    partial_days = dst.variables['time'][:] / (24. * 60. * 60.)
+    partial_days = dst.variables['time'][traces] / (24. * 60. * 60.)
     start_day = datetime.datetime(int(dst.variables['time'].units[14:18]),
                                   int(dst.variables['time'].units[19:21]),
                                   int(dst.variables['time'].units[22:24])).toordinal() + 366.
     mcords_data.decday = partial_days + start_day
-    mcords_data.trace_int = mcords_data.decday[1] - mcords_data.decday[0]
-    mcords_data.travel_time = dst.variables['fasttime'][:]
+    # A single trace has no interval
+    if len(mcords_data.decday) > 1:
+        mcords_data.trace_int = mcords_data.decday[1] - mcords_data.decday[0]
+    else:
+        mcords_data.trace_int = 0.
+    mcords_data.travel_time = dst.variables['fasttime'][samples]
     mcords_data.dt = np.mean(np.diff(mcords_data.travel_time)) * 1.0e-6
-    size = dst.variables['amplitude'].matlab_size
-    mcords_data.tnum, mcords_data.snum = int(size[0]), int(size[1])
-    mcords_data.trace_num = np.arange(mcords_data.tnum) + 1
+    mcords_data.snum, mcords_data.tnum = mcords_data.data.shape
+    mcords_data.trace_num = np.arange(dst.variables['lat'].shape[0])[traces] + 1
 
     mcords_data.chan = 0
-    mcords_data.pressure = np.zeros_like(dst.variables['lat'][:])
-    mcords_data.trig = np.zeros_like(dst.variables['lat'][:]).astype(int)
+    mcords_data.pressure = np.zeros_like(mcords_data.lat)
+    mcords_data.trig = np.zeros_like(mcords_data.lat).astype(int)
     mcords_data.trig_level = 0.
+    dst.close()
     mcords_data.check_attrs()
 
     return mcords_data
@@ -9,12 +9,17 @@
 """
 Read the data from a St. Olaf/Gecko file
 """
-import io
+import os
+import copy
 import struct
 import datetime
 import numpy as np
 
 from ..RadarData import RadarData
+from ..Streaming import follow
+
+#: Number of records to check at once when indexing a file
+INDEX_BLOCK = 65536
 
 
 class SInfo:
@@ -224,103 +229,184 @@ class ChannelData:
         self.odometer = np.zeros((sinfo.tnum, ))
         self.pressure = np.zeros((sinfo.tnum, ))
 
-    def read_trace(self, lines, sinfo, n_trc):
-        """Ingest binary trace information
+    def read_records(self, buf, sinfo, offsets):
+        """Ingest all the records for this channel at once
 
         Parameters
         ----------
-        lines: bytes
-            The binary data
+        buf: np.ndarray
+            The file as an array of bytes (e.g. a np.memmap)
         sinfo: SInfo
             The overall collection info
-        n_trc: int
-            The trace under consideration
+        offsets: np.ndarray
+            The offset into buf of each of this channel's records, in trace order.
+            Markers and comments fill a trace slot but have no data.
         """
-        n_header_type = struct.unpack('<B', lines[sinfo.offset: sinfo.offset + 1])[0]
-
-        # I'm rolling with a separate offset counter so i can work on guessing at tnum
-        offset = 2
-
-        # Trace number in file set
-        self.n_trace[n_trc] = struct.unpack('<i', lines[sinfo.offset + offset:
-                                                        sinfo.offset + offset + 4])[0]
-        offset += 4
-
-        # Decimal day from 1 Jan 1970.
-        n_time = struct.unpack('<d', lines[sinfo.offset + offset:sinfo.offset + offset + 8])[0]
-        offset += 8
+        headers = _read_records(buf, offsets, _trace_header_dtype(sinfo.version))
+        n_trc = len(offsets)
+        self.n_trace[:n_trc] = headers['n_trace']
         # We add an offset to 1 Jan 1970 to get MATLAB date numbers
-        self.time[n_trc] = n_time + datetime.date.toordinal(datetime.date(1970, 1, 1)) + 366.
-
-        # Stacks/trace unless record mode is stacks, when it is
-        # time/trace
-        self.trace_interval[n_trc] = struct.unpack('<f', lines[sinfo.offset + offset:
-                                                               sinfo.offset + offset + 4])[0]
-        offset += 4
-
-        # Trigger level in percentage of input range in mV
-        self.trigger_level[n_trc] = struct.unpack('<H', lines[sinfo.offset + offset:
-                                                              sinfo.offset + offset + 2])[0]
-        offset += 2
-
+        self.time[:n_trc] = headers['time'] + datetime.date.toordinal(datetime.date(1970, 1, 1)) + 366.
+        self.trace_interval[:n_trc] = headers['trace_interval']
+        self.trigger_level[:n_trc] = headers['trigger_level']
         if sinfo.version < 3.21:
-            # Odometer readings (0 if no Odometer is used)
-            self.odometer[n_trc] = struct.unpack('<f', lines[sinfo.offset + offset:
-                                                             sinfo.offset + offset + 4])[0]
-            offset += 4
-
-            # Pressure gauge (0 if no pressure gauge is used)
-            self.pressure[n_trc] = struct.unpack('<f', lines[sinfo.offset + offset:
-                                                             sinfo.offset + offset + 4])[0]
-            offset += 4
-
-        # GPS Latitude
-        self.lat[n_trc] = struct.unpack('<d', lines[sinfo.offset + offset:
-                                                    sinfo.offset + offset + 8])[0]
-        offset += 8
-
-        # GPS longitude
-        self.long[n_trc] = struct.unpack('<d', lines[sinfo.offset + offset:
-                                                     sinfo.offset + offset + 8])[0]
-        offset += 8
-
-        # GPS altitude
-        self.altitude[n_trc] = struct.unpack('<f', lines[sinfo.offset + offset:
-                                                         sinfo.offset + offset + 4])[0]
-        offset += 4
-
-        # GPS accuracy
-        self.gps_resolution[n_trc] = struct.unpack('<f', lines[sinfo.offset + offset:
-                                                               sinfo.offset + offset + 4])[0]
-        offset += 4
-
-        # Read and toss last blank bytes
-        # (Only needed for pre 3.6 version)
-        if sinfo.version < 3.6:
-            if sinfo.version < 3.2:
-                offset += 12
-            else:
-                offset += 14
+            self.odometer[:n_trc] = headers['odometer']
+            self.pressure[:n_trc] = headers['pressure']
+        self.lat[:n_trc] = headers['lat']
+        self.long[:n_trc] = headers['long']
+        self.altitude[:n_trc] = headers['altitude']
+        self.gps_resolution[:n_trc] = headers['gps_resolution']
 
         # If it is actual radar data, not a comment or marker
-        if n_header_type == 0:
-            # Read the trace data
-            newdata = struct.unpack('<{:d}h'.format(sinfo.snum),
-                                    lines[sinfo.offset + offset:
-                                          sinfo.offset + offset + 2 * sinfo.snum])
-            offset += 2 * sinfo.snum
-            # Store data
-            # Total number of data points
-            self.data[:, n_trc] = newdata
-        elif n_header_type == 1:
-            # Toss marker information
-            offset += 38
-
-        sinfo.offset += offset
-
-
-def load_olaf(fns_olaf, channel=1):
-    """Read data from a gecko recording"""
+        is_data = headers['header_type'] == 0
+        hlen = _trace_header_dtype(sinfo.version).itemsize
+        self.data[:, np.flatnonzero(is_data)] = _read_records(
+            buf, offsets[is_data] + hlen, np.dtype(('<i2', (sinfo.snum, )))).transpose()
+
+
+def _trace_header_dtype(version):
+    """The layout of the header at the start of every trace record"""
+    fields = [('header_type', 'u1'),
+              ('unused', 'u1'),
+              ('n_trace', '<i4'),
+              ('time', '<f8'),
+              ('trace_interval', '<f4'),
+              ('trigger_level', '<u2')]
+    if version < 3.21:
+        fields += [('odometer', '<f4'), ('pressure', '<f4')]
+    fields += [('lat', '<f8'),
+               ('long', '<f8'),
+               ('altitude', '<f4'),
+               ('gps_resolution', '<f4')]
+    if version < 3.6:
+        fields += [('blank', 'V12' if version < 3.2 else 'V14')]
+    return np.dtype(fields)
+
+
+def _read_records(buf, offsets, dtype):
+    """Read fixed-layout records starting at each of the offsets into buf
+
+    Runs of evenly spaced records (i.e. everything between markers) are read
+    as a single strided view.
+    """
+    out = np.empty((len(offsets), ), dtype=dtype)
+    if len(offsets) == 0:
+        return out
+    steps = np.diff(offsets)
+    starts = np.hstack(([0], np.flatnonzero(steps[1:] != steps[:-1]) + 1))
+    ends = np.hstack((starts[1:], [len(steps)]))
+    for start, end in zip(starts, ends):
+        step = steps[start] if len(steps) > 0 else dtype.itemsize
+        out[start:end + 1] = np.ndarray((end - start + 1, ), dtype=dtype, buffer=buf,
+                                        offset=offsets[start], strides=(step, ))
+    return out
+
+
+def index_records(buf, sinfo, offset=None, max_records=None):
+    """Find where every trace record in a gecko file starts
+
+    Parameters
+    ----------
+    buf: np.ndarray
+        The file as an array of bytes (e.g. a np.memmap)
+    sinfo: SInfo
+        The file header, which tells us the record layout
+    offset: int, optional
+        Start looking here, which must be the start of a record. Default is the first record.
+    max_records: int, optional
+        Stop after this many records. Default is the number of traces that fit in the file.
+
+    Returns
+    -------
+    offsets: np.ndarray
+        The offset of each complete record in the file. Records cycle through the channels.
+    header_types: np.ndarray
+        The type of each record: 0 for data, 1 for a marker
+    """
+    hlen = _trace_header_dtype(sinfo.version).itemsize
+    trace_len = _record_len(sinfo, 0)
+    if offset is None:
+        offset = sinfo.offset
+    if max_records is None:
+        max_records = sinfo.tnum * sinfo.n_channels
+    offsets = [np.zeros((0, ), dtype=np.int64)]
+    header_types = [np.zeros((0, ), dtype=np.uint8)]
+    n_records = 0
+    while offset + hlen <= len(buf) and n_records < max_records:
+        # Guess that the records are all traces, and check the guess in one go.
+        # Blocks keep this from going quadratic if there are lots of markers.
+        n_guess = min((len(buf) - offset) // trace_len, max_records - n_records, INDEX_BLOCK)
+        guess = offset + trace_len * np.arange(n_guess, dtype=np.int64)
+        not_trace = np.flatnonzero(buf[guess] != 0)
+        n_traces = not_trace[0] if len(not_trace) > 0 else n_guess
+        offsets.append(guess[:n_traces])
+        header_types.append(np.zeros((n_traces, ), dtype=np.uint8))
+        n_records += n_traces
+        offset += trace_len * n_traces
+        if n_traces == n_guess and n_guess > 0:
+            continue
+
+        # A marker or comment (or a partial record at the end of the file)
+        if offset + hlen > len(buf) or n_records >= max_records:
+            break
+        header_type = int(buf[offset])
+        record_len = _record_len(sinfo, header_type)
+        if offset + record_len > len(buf):
+            break
+        offsets.append(np.array([offset], dtype=np.int64))
+        header_types.append(np.array([header_type], dtype=np.uint8))
+        n_records += 1
+        offset += record_len
+    return np.hstack(offsets), np.hstack(header_types)
+
+
+def _record_len(sinfo, header_type):
+    """The length of a record: traces have data, markers a fixed-length message"""
+    hlen = _trace_header_dtype(sinfo.version).itemsize
+    return {0: hlen + 2 * sinfo.snum, 1: hlen + 38}.get(header_type, hlen)
+
+
+def _cached_index(fn, buf, sinfo, cache_index):
+    """Get the record index for a file, from the cache next to it if it is still good"""
+    fn_index = fn + '.index.npz'
+    stat = os.stat(fn)
+    if cache_index and os.path.exists(fn_index):
+        with np.load(fn_index) as cached:
+            if cached['size'] == stat.st_size and cached['mtime'] == stat.st_mtime_ns:
+                return cached['offsets'], cached['header_types']
+    offsets, header_types = index_records(buf, sinfo)
+    if cache_index:
+        try:
+            np.savez(fn_index, offsets=offsets, header_types=header_types,
+                     size=stat.st_size, mtime=stat.st_mtime_ns)
+        except OSError:
+            print('Could not write the index cache {:s}'.format(fn_index))
+    return offsets, header_types
+
+
+def _set_header(olaf_data, sinfo):
+    """Put the information about the collection into a RadarData"""
+    olaf_data.dt = 1. / sinfo.samp_freq
+    olaf_data.fns_in = sinfo.fn_in
+    olaf_data.ant_sep = sinfo.antenna_separation
+    olaf_data.freq = sinfo.nominal_frequency
+    olaf_data.travel_time = np.arange(-sinfo.pre_trigger_depth, sinfo.post_trigger_depth) * 1. / sinfo.samp_freq * 1.0e6
+    olaf_data.trig = sinfo.pre_trigger_depth
+
+
+def load_olaf(fns_olaf, channel=1, cache_index=False):
+    """Read data from a gecko recording
+
+    Parameters
+    ----------
+    fns_olaf: str or list
+        The file(s) to read. Multiple files are concatenated in order of acquisition.
+    channel: int, optional
+        The receiver channel to return. Default 1.
+    cache_index: bool, optional
+        Keep the index of where each trace starts in a .index.npz file next to each
+        .gtd file, so that re-opening the files does not need to scan them. Default False.
+    """
     olaf_data = RadarData(None)
     # We want to be able to use this step concatenate a series of files numbered by the controller
     if isinstance(fns_olaf, str):
@@ -330,24 +416,20 @@ def load_olaf(fns_olaf, channel=1):
     stacks = []
     for i, fn_i in enumerate(fns_olaf):
         # We are going to follow the general format that was used by storead_script_v36
-        with io.open(fn_i, 'rb') as fid:
-            lines = fid.read()
+        # but only ever read the parts of the file we need
+        buf = np.memmap(fn_i, dtype=np.uint8, mode='r')
 
         # Header information
-        sinfo.append(SInfo(lines))
-
-        # Data is stored per trace. Make a container
-        s_i = [ChannelData(lines, sinfo[i]) for j in range(sinfo[i].n_channels)]
-
-        # Read trace-by-trace, channel-by-channel
-        for n_trc in range(sinfo[i].tnum):
-            try:
-                for s_j in s_i:
-                    s_j.read_trace(lines, sinfo[i], n_trc)
-            except:
-                continue
+        sinfo.append(SInfo(buf))
+        if channel < 1 or channel > sinfo[i].n_channels:
+            raise ValueError('There is no channel {:d} in {:s}'.format(channel, fn_i))
 
-        stacks.append(s_i[channel - 1])
+        # Find the records, then read just the ones for our channel.
+        # Records go trace-by-trace, channel-by-channel
+        offsets, _ = _cached_index(fn_i, buf, sinfo[i], cache_index)
+        s_i = ChannelData(buf, sinfo[i])
+        s_i.read_records(buf, sinfo[i], offsets[channel - 1::sinfo[i].n_channels])
+        stacks.append(s_i)
 
     # I don't know if we actually want to do this, but the filenaming scheme is wacky and this
     # will make any logical collection look good
@@ -356,13 +438,8 @@ def load_olaf(fns_olaf, channel=1):
     stacks = [stacks[i] for i in sort_idx]
 
     # Now merge the data into the normal format
-    olaf_data.dt = 1. / sinfo[0].samp_freq
-    olaf_data.fns_in = sinfo[0].fn_in
-    olaf_data.ant_sep = sinfo[0].antenna_separation
-    olaf_data.freq = sinfo[0].nominal_frequency
-    olaf_data.travel_time = stacks[0].travel_time * 1.0e6
+    _set_header(olaf_data, sinfo[0])
     olaf_data.trig_level = stacks[0].trigger_level
-    olaf_data.trig = sinfo[0].pre_trigger_depth
 
     olaf_data.fnames = [si.fn_in for si in sinfo]
 
@@ -382,3 +459,67 @@ def load_olaf(fns_olaf, channel=1):
     olaf_data.pressure = np.hstack([s_i.pressure for s_i in stacks])
     olaf_data.check_attrs()
     return olaf_data
+
+
+def stream_olaf(fn_olaf, channel=1, block_traces=100, poll=1., timeout=10., **kwargs):
+    """Read traces from a gecko file as they are written
+
+    Parameters
+    ----------
+    fn_olaf: str
+        The .gtd file, which may still be growing. The header must already be written.
+    channel: int, optional
+        The receiver channel to return. Default 1.
+    block_traces: int, optional
+        Return at most this many traces at once. Default 100.
+    poll: float, optional
+        Seconds to wait before checking for new traces. Default 1.
+    timeout: float, optional
+        Stop once there have been no new traces for this many seconds. None never stops.
+        Default 10.
+
+    Returns
+    -------
+    olaf_data: RadarData
+        The header information, with no traces
+    chunks: generator
+        Yields (data, attrs) for each new block of traces, where attrs has the per-trace
+        GPS, time, and trigger information
+    """
+    sinfo = SInfo(np.memmap(fn_olaf, dtype=np.uint8, mode='r'))
+    if channel < 1 or channel > sinfo.n_channels:
+        raise ValueError('There is no channel {:d} in {:s}'.format(channel, fn_olaf))
+    olaf_data = RadarData(None)
+    _set_header(olaf_data, sinfo)
+    olaf_data.chan = channel
+    olaf_data.fnames = [sinfo.fn_in]
+    olaf_data.snum = sinfo.snum
+    olaf_data.data = np.zeros((sinfo.snum, 0))
+    olaf_data.tnum = 0
+    state = {'offset': sinfo.offset, 'tnum': 0}
+
+    def read_new():
+        buf = np.memmap(fn_olaf, dtype=np.uint8, mode='r')
+        offsets, header_types = index_records(buf, sinfo, offset=state['offset'],
+                                              max_records=block_traces * sinfo.n_channels)
+        # Only take whole cycles through the channels, so we always know which is which
+        n_records = len(offsets) - len(offsets) % sinfo.n_channels
+        if n_records == 0:
+            return None
+        state['offset'] = int(offsets[n_records - 1]) + _record_len(sinfo, header_types[n_records - 1])
+
+        chunk_info = copy.copy(sinfo)
+        chunk_info.tnum = n_records // sinfo.n_channels
+        stack = ChannelData(buf, chunk_info)
+        stack.read_records(buf, chunk_info, offsets[channel - 1:n_records:sinfo.n_channels])
+        attrs = {'trace_num': np.arange(state['tnum'], state['tnum'] + chunk_info.tnum) + 1,
+                 'decday': stack.time,
+                 'elev': stack.altitude,
+                 'lat': stack.lat,
+                 'long': stack.long,
+                 'trace_int': stack.trace_interval,
+                 'pressure': stack.pressure,
+                 'trig_level': stack.trigger_level}
+        state['tnum'] += chunk_info.tnum
+        return stack.data, attrs
+    return olaf_data, follow(read_new, poll=poll, timeout=timeout)
@@ -16,7 +16,6 @@ Read Pulse Ekko data
 """
 
 import os.path
-import struct
 import datetime
 import numpy as np
 
@@ -47,32 +46,32 @@ class TraceHeaders:
         self.comment_flag = np.zeros((1, tnum))
         self.comment = ['' for i in range(tnum)]
 
-    def get_header(self, offset, f_lines):
-        """Get the header information for a single trace"""
-        header = struct.unpack('<25f', f_lines[offset: offset + 25 * 4])
-        comment = struct.unpack('<28c', f_lines[offset + 25 * 4: offset + 25 * 4 + 28])
-        self.trace_numbers[0, self.header_index] = header[0]
-        self.positions[0, self.header_index] = header[1]
-        self.points_per_trace[0, self.header_index] = header[2]
-        self.topography[0, self.header_index] = header[3]
-        self.bytes_per_point[0, self.header_index] = header[5]
-        self.n_stackes[0, self.header_index] = header[7]
-        self.time_window[0, self.header_index] = header[8]
-        self.pos[0, self.header_index] = header[9]
-        self.pos[1, self.header_index] = header[11]
-        self.pos[2, self.header_index] = header[13]
-        self.receive[0, self.header_index] = header[14]
-        self.receive[1, self.header_index] = header[15]
-        self.receive[2, self.header_index] = header[16]
-        self.transmit[0, self.header_index] = header[17]
-        self.transmit[1, self.header_index] = header[18]
-        self.transmit[2, self.header_index] = header[19]
-        self.tz_adjustment[0, self.header_index] = header[20]
-        self.zero_flag[0, self.header_index] = header[21]
-        self.time_of_day[0, self.header_index] = header[23]
-        self.comment_flag[0, self.header_index] = header[24]
-        self.comment[self.header_index] = str(comment[0])
-        self.header_index += 1
+    def from_records(self, headers, comments):
+        """Fill in the headers for all traces at once
+
+        Parameters
+        ----------
+        headers: np.ndarray
+            (tnum x 25) array of the floats at the start of each trace header
+        comments: np.ndarray
+            (tnum x 28) array of the comment bytes at the end of each trace header
+        """
+        self.trace_numbers[0, :] = headers[:, 0]
+        self.positions[0, :] = headers[:, 1]
+        self.points_per_trace[0, :] = headers[:, 2]
+        self.topography[0, :] = headers[:, 3]
+        self.bytes_per_point[0, :] = headers[:, 5]
+        self.n_stackes[0, :] = headers[:, 7]
+        self.time_window[0, :] = headers[:, 8]
+        self.pos[:, :] = headers[:, [9, 11, 13]].transpose()
+        self.receive[:, :] = headers[:, 14:17].transpose()
+        self.transmit[:, :] = headers[:, 17:20].transpose()
+        self.tz_adjustment[0, :] = headers[:, 20]
+        self.zero_flag[0, :] = headers[:, 21]
+        self.time_of_day[0, :] = headers[:, 23]
+        self.comment_flag[0, :] = headers[:, 24]
+        self.comment = [str(bytes(comment[:1])) for comment in comments]
+        self.header_index = headers.shape[0]
 
 
 def _get_gps_data(fn_gps, trace_nums):
@@ -153,6 +152,17 @@ def partition_project_file(fn_project):
         profile_num += 1
 
 
+#: The type of the samples in each version of the DT1 format
+PE_SAMPLE_DTYPES = {'1.0': np.int16, '1.5.340': np.float32}
+
+
+def _dt1_dtype(snum, sample_dtype):
+    """The layout of one trace in a DT1 file: a 128-byte header followed by the samples"""
+    return np.dtype([('header', '<f4', (25, )),
+                     ('comment', 'u1', (28, )),
+                     ('trace', np.dtype(sample_dtype).newbyteorder('<'), (snum, ))])
+
+
 def load_pe(fn_dt1, *args, **kwargs):
     """Load data from a pulse_ekko file"""
 
@@ -162,7 +172,7 @@ def load_pe(fn_dt1, *args, **kwargs):
     true_fn = bn_pe + '.DT1'
     gps_fn = bn_pe + '.GPS'
 
-    with open(hdname, 'rU') as fin:
+    with open(hdname, 'r') as fin:
         if fin.read().find('pulseEKKO') == -1:
             pe_data.version = '1.0'
         else:
@@ -182,30 +192,19 @@ def load_pe(fn_dt1, *args, **kwargs):
             if i == 2 and pe_data.version == '1.5.340':
                 doy = (int(line[6:10]),int(line[:2]),int(line[3:5]))
 
-    if pe_data.version == '1.0':
-        pe_data.data = np.zeros((pe_data.snum, pe_data.tnum), dtype=np.int16)
-    elif pe_data.version == '1.5.340':
-        pe_data.data = np.zeros((pe_data.snum, pe_data.tnum), dtype=np.float32)
+    sample_dtype = PE_SAMPLE_DTYPES[pe_data.version]
 
+    # Every trace is a fixed-size record, so read them all at once
+    records = np.fromfile(true_fn, dtype=_dt1_dtype(pe_data.snum, sample_dtype), count=pe_data.tnum)
+    if records.shape[0] < pe_data.tnum:
+        raise ValueError('The DT1 file has fewer traces than the header says')
     pe_data.traceheaders = TraceHeaders(pe_data.tnum)
-    with open(true_fn, 'rb') as fin:
-        lines = fin.read()
-
-    offset = 0
-    for i in range(pe_data.tnum):
-        pe_data.traceheaders.get_header(offset, lines)
-        offset += 25 * 4 + 28
-        if pe_data.version == '1.0':
-            trace = struct.unpack('<{:d}h'.format(pe_data.snum),lines[offset: offset + pe_data.snum * 2])
-            offset += pe_data.snum * 2
-        elif pe_data.version == '1.5.340':
-            fmt = '<%df' % (len(lines[offset: offset + pe_data.snum*4]) // 4)
-            trace = struct.unpack(fmt,lines[offset: offset + pe_data.snum * 4])
-            offset += pe_data.snum * 4
-
-        trace -= np.nanmean(trace[:100])
-        pe_data.data[:,i] = trace.copy()
+    pe_data.traceheaders.from_records(records['header'], records['comment'])
 
+    # remove the DC offset from each trace, casting straight back to the sample type
+    traces = records['trace'].transpose()
+    pe_data.data = np.empty((pe_data.snum, pe_data.tnum), dtype=sample_dtype)
+    np.subtract(traces, np.nanmean(traces[:100, :], axis=0, dtype=float), out=pe_data.data, casting='unsafe')
 
     # known vars that are not really set
     pe_data.chan = 1
@@ -20,22 +20,65 @@ except ImportError:
     SEGY = False
 
 
-def load_segy(fn_sgy, *args, **kwargs):
+#: Read this many traces at a time, so we never hold a second copy of the data
+TRACE_CHUNK = 4096
+
+
+def load_segy(fn_sgy, *args, trace_range=None, **kwargs):
     """Load segy data. This is very generic for now,
-    need to do work if there are particular types of segy files that need to be read"""
+    need to do work if there are particular types of segy files that need to be read
+
+    The file is memory-mapped if possible, and traces are read in bulk straight into the
+    data array. The file is closed once the data are read.
+
+    Files with an ensemble fold of 1 (e.g. those written by ImpDAR) are stacked profiles,
+    so we read all their traces along with the trace numbers, coordinates, elevations,
+    and delay from the trace headers. Otherwise, we only read the first shot gather.
+
+    Parameters
+    ----------
+    fn_sgy: str
+        The file to read
+    trace_range: tuple, optional
+        (first, last) zero-indexed traces to load, with last exclusive as in slicing.
+        Default is all traces.
+    """
     if not SEGY:
         raise ImportError('Need segyio to load SGY files')
     segy_data = RadarData(None)
-    segy_data.f = segyio.open(fn_sgy, ignore_geometry=True)
-    where_good = np.where(segy_data.f.attributes(
-        segyio.TraceField.SourceX)[:] == segy_data.f.attributes(segyio.TraceField.SourceX)[0])[0]
-    segy_data.data = segyio.tools.collect(
-        segy_data.f.trace[where_good[0]:where_good[-1] + 1]).transpose()
-    segy_data.snum = segy_data.f.bin[segyio.BinField.Samples]
-    segy_data.tnum = segy_data.data.shape[1]
-    segy_data.dt = segy_data.f.bin[segyio.BinField.Interval] * 1.0e-12
-    segy_data.travel_time = np.arange(segy_data.snum) * segy_data.dt * 1.0e6
-    segy_data.trace_num = np.arange(segy_data.data.shape[1]) + 1
+    with segyio.open(fn_sgy, ignore_geometry=True) as fin:
+        fin.mmap()
+        stacked = fin.bin[segyio.BinField.EnsembleFold] == 1
+        if stacked:
+            where_good = np.arange(fin.tracecount)
+        else:
+            source_x = fin.attributes(segyio.TraceField.SourceX)[:]
+            where_good = np.where(source_x == source_x[0])[0]
+        start, stop, _ = slice(*(trace_range or (None, None))).indices(fin.tracecount)
+        start, stop = max(start, where_good[0]), min(stop, where_good[-1] + 1)
+        if stop <= start:
+            raise ValueError('No traces to load in trace_range')
+
+        segy_data.snum = fin.bin[segyio.BinField.Samples]
+        segy_data.data = np.empty((segy_data.snum, stop - start), dtype=np.float32, order='F')
+        # the transpose of a Fortran-ordered array is C-ordered (tnum x snum), like the file
+        for i in range(start, stop, TRACE_CHUNK):
+            j = min(i + TRACE_CHUNK, stop)
+            segy_data.data.T[i - start:j - start, :] = fin.trace.raw[i:j]
+        segy_data.dt = fin.bin[segyio.BinField.Interval] * 1.0e-12
+        segy_data.tnum = segy_data.data.shape[1]
+        segy_data.travel_time = np.arange(segy_data.snum) * segy_data.dt * 1.0e6
+        segy_data.trace_num = np.arange(start, stop) + 1
+
+        if stacked:
+            # Delay is in ns, since we scale times by 1e6 to fit the headers
+            segy_data.travel_time += fin.header[start][segyio.TraceField.DelayRecordingTime] * 1.0e-3
+            segy_data.trace_num = fin.attributes(segyio.TraceField.TRACE_SEQUENCE_LINE)[start:stop]
+            coord_scalar = fin.attributes(segyio.TraceField.SourceGroupScalar)[start:stop]
+            segy_data.x_coord = _scale(fin.attributes(segyio.TraceField.SourceX)[start:stop], coord_scalar)
+            segy_data.y_coord = _scale(fin.attributes(segyio.TraceField.SourceY)[start:stop], coord_scalar)
+            segy_data.elev = _scale(fin.attributes(segyio.TraceField.SourceSurfaceElevation)[start:stop],
+                                    fin.attributes(segyio.TraceField.ElevationScalar)[start:stop])
     segy_data.flags = RadarFlags()
     # segy_data.travel_time = np.atleast_2d(np.arange(0,
     # segy_data.dt * segy_data.snum, segy_data.dt)).transpose()
@@ -53,3 +96,12 @@ def load_segy(fn_sgy, *args, **kwargs):
 
     segy_data.check_attrs()
     return segy_data
+
+
+def _scale(vals, scalars):
+    """Apply SEG-Y header scalars: negative values divide, positive multiply, zero is one"""
+    scalars = np.asarray(scalars, dtype=float)
+    factor = np.ones_like(scalars)
+    factor[scalars > 0] = scalars[scalars > 0]
+    factor[scalars < 0] = -1. / scalars[scalars < 0]
+    return np.asarray(vals, dtype=float) * factor
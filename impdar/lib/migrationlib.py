@@ -24,33 +24,56 @@ Mar 12 2019
 """
 
 from __future__ import print_function
-import sys
 import os
+import shutil
+import hashlib
+import tempfile
 import subprocess as sp
 
 import numpy as np
 import time
+from collections import OrderedDict
+try:
+    from concurrent.futures import ThreadPoolExecutor
+    FUTURES = True
+except ImportError:
+    # python 2 without the futures backport
+    FUTURES = False
 from scipy import sparse
-from scipy.interpolate import griddata, interp2d, interp1d
+try:
+    from scipy.integrate import cumulative_trapezoid
+except ImportError:
+    # scipy < 1.6
+    from scipy.integrate import cumtrapz as cumulative_trapezoid
+from scipy.interpolate import griddata, interp1d
+from scipy.signal import resample
+from .ImpdarError import ImpdarError
 
 
-def migrationKirchhoff(dat, vel=1.69e8, vel_fn=None, nearfield=False):
+def migrationKirchhoff(dat, vel=1.69e8, vel_fn=None, nearfield=False, max_offset=None, mem_limit=1.0e8):
     """Kirchhoff Migration (Berkhout 1980; Schneider 1978; Berryhill 1979)
 
     This migration method uses an integral solution to the scalar wave equation Yilmaz (2001) eqn 4.5.
-    The algorithm cycles through every sample in each trace, creating a hypothetical diffraciton
-    hyperbola for that location,
+    For every sample in each trace we create a hypothetical diffraciton hyperbola for that location,
         t(x)^2 = t(0)^2 + (2x/v)^2
     To migrate, we integrate the power along that hyperbola and assign the solution to the apex point.
     There are two terms in the integral solution, Yilmaz (2001) eqn 4.5, a far-field term and a
     near-field term. Most algorithms ignore the near-field term because it is small. Here there is an option,
     but default is to ignore.
 
+    The hyperbola only depends on the lateral offset between the input and output traces,
+    so rather than looping over every output point we loop over trace offsets (lags),
+    find the travel-time indices for that offset once, and gather along them for all
+    output traces at once. Output samples are processed in blocks to bound the memory use.
+
     Parameters
     ---------
     dat: data as a class in the ImpDAR format
     vel: wave velocity, default is for ice
     nearfield: boolean to indicate whether or not to use the nearfield term in summation
+    max_offset: maximum lateral offset (in the units of dat.dist) of the input traces
+        that are summed into each output point. Default is None (use the full aperture).
+    mem_limit: approximate memory budget for the blocked gathers, in bytes. Default 1e8.
 
     Output
     ---------
@@ -63,59 +86,94 @@ def migrationKirchhoff(dat, vel=1.69e8, vel_fn=None, nearfield=False):
     _check_data_shape(dat)
     # start the timer
     start = time.time()
-    # Calculate the time derivative of the input data
-    gradD = np.gradient(dat.data, dat.travel_time / 1.0e6, axis=0)
-    # Create an empty array to fill with migrated data
-    migdata = np.zeros_like(dat.data)
 
-    # Try to cache some variables that we need lots
     tt_sec = dat.travel_time / 1.0e6
     max_travel_time = np.max(tt_sec)
+    # Calculate the time derivative of the input data
+    # Values that are NaN would be skipped in the summation, so zero them here
+    gradD = np.gradient(dat.data, tt_sec, axis=0)
+    gradD = np.where(np.isnan(gradD), 0., gradD)
+    if nearfield:
+        data = dat.data.astype(float)
+        data = np.where(np.isnan(data), 0., data)
+    # Create an empty array to fill with migrated data
+    migdata = np.zeros(dat.data.shape)
+
     # Cache the depths
-    zs = vel * tt_sec/2.
+    zs = vel * tt_sec / 2.
     zs2 = zs**2.
-
-    # Loop through all traces
-    print('Migrating trace number:')
-    for xi in range(dat.tnum):
-        print('{:d}, '.format(xi), end='')
-        sys.stdout.flush()
-        # get the trace distance
-        x = dat.dist[xi]
-        dists2 = (dat.dist - x)**2.
-        # Loop through all samples
-        for ti in range(dat.snum):
-            # get the radial distances between input point and output point
-            rs = np.sqrt(dists2 + zs2[ti])
+    # Nothing deeper than this contributes to the output
+    max_rs = vel * max_travel_time / 2.
+    if max_offset is not None:
+        max_rs = min(max_rs, max_offset)
+
+    # If the trace spacing is uniform, the hyperbola is the same for every trace pair at a given lag
+    dist = np.asarray(dat.dist, dtype=float)
+    dx = np.diff(dist)
+    uniform = dat.tnum > 1 and np.allclose(dx, dx[0])
+
+    # Size the blocks of output samples so the temporaries fit in the memory budget
+    blocksize = int(max(1, min(dat.snum, mem_limit // (8 * 8 * max(dat.tnum, 1)))))
+
+    for lag in range(dat.tnum):
+        if uniform:
+            offsets2 = np.atleast_1d((lag * dx[0])**2.)
+        else:
+            offsets2 = (dist[lag:] - dist[:dat.tnum - lag])**2.
+        if np.all(offsets2 > max_rs**2.):
+            # for uniform spacing, larger lags are even further away
+            if uniform:
+                break
+            continue
+        for i0 in range(0, dat.snum, blocksize):
+            i1 = min(i0 + blocksize, dat.snum)
+            # radial distances between input points and output points, shape (block, npairs)
+            rs = np.sqrt(offsets2[np.newaxis, :] + zs2[i0:i1, np.newaxis])
+            tt_hyp = 2. * rs / vel
             # find the cosine of the angle of the tangent line, correct for obliquity factor
-            with np.errstate(invalid='ignore'):
-                costheta = zs[ti] / rs
-            # get the exact indices from the array (closest to rs)
-            Didx = np.argmin(np.abs(np.atleast_2d(tt_sec).transpose() - 2. * rs / vel), axis=0)
-            # integrate the farfield term
-            gradDhyp = gradD[Didx, np.arange(len(Didx))]
-            gradDhyp[2. * rs / vel > max_travel_time] = 0.    # zero points that are outside of the domain
-            integral = np.nansum(gradDhyp * costheta / vel)  # TODO: Yilmaz eqn 4.5 has an extra r in this weight factor???
-            # integrate the nearfield term
+            with np.errstate(invalid='ignore', divide='ignore'):
+                costheta = zs[i0:i1, np.newaxis] / rs
+                weight_far = costheta / vel
+                if nearfield:
+                    weight_near = costheta / rs**2.
+            # zero points that are outside of the domain or beyond the aperture
+            outside = (tt_hyp > max_travel_time) | ~np.isfinite(costheta)
+            if max_offset is not None:
+                outside |= np.broadcast_to(offsets2[np.newaxis, :] > max_offset**2., outside.shape)
+            weight_far[outside] = 0.
+            if nearfield:
+                weight_near[outside] = 0.
+            # get the exact indices from the array (closest to the hyperbola travel times)
+            Didx = _nearest_index(tt_sec, tt_hyp)
+
+            # inputs to the right of the output traces
+            cols = np.arange(lag, dat.tnum)[np.newaxis, :]
+            out_cols = slice(0, dat.tnum - lag)
+            migdata[i0:i1, out_cols] += gradD[Didx, cols] * weight_far
             if nearfield:
-                Dhyp = dat.data[Didx, np.arange(len(Didx))]
-                Dhyp[2. * rs / vel > max_travel_time] = 0.    # zero points that are outside of the domain
-                integral += np.nansum(Dhyp * costheta / rs**2.)
-            # sum the integrals and output
-            migdata[ti, xi] = 1. / (2. * np.pi) * integral
-    dat.data = migdata.copy()
+                migdata[i0:i1, out_cols] += data[Didx, cols] * weight_near
+            # inputs to the left, the same hyperbola mirrored
+            if lag > 0:
+                cols = np.arange(0, dat.tnum - lag)[np.newaxis, :]
+                out_cols = slice(lag, dat.tnum)
+                migdata[i0:i1, out_cols] += gradD[Didx, cols] * weight_far
+                if nearfield:
+                    migdata[i0:i1, out_cols] += data[Didx, cols] * weight_near
+
+    dat.data = migdata / (2. * np.pi)
     # print the total time
-    print('')
     print('Kirchhoff Migration of %.0fx%.0f matrix complete in %.2f seconds'
           % (dat.tnum, dat.snum, time.time() - start))
     return dat
 
 
-def migrationStolt(dat,vel=1.68e8,htaper=100,vtaper=1000):
+def migrationStolt(dat, vel=1.68e8, htaper=100, vtaper=1000, pad=False, n_jobs=1):
     """Stolt Migration (Stolt, 1978, Geophysics)
 
     This is by far the fastest migration method. It is a simple transformation from
     frequency-wavenumber (FKx) to wavenumber-wavenumber (KzKx) space.
+    The mapping from temporal frequency to vertical wavenumber is a linear interpolation
+    along the frequency axis, done for the whole FK plane at once.
 
     Parameters
     ---------
@@ -123,6 +181,8 @@ def migrationStolt(dat,vel=1.68e8,htaper=100,vtaper=1000):
     vel: wave velocity, default is for ice
     htaper: number of traces for the linear horizontal taper from the edges of the domain
     vtaper: number of samples for the vertical taper from the top and bottom.
+    pad: zero pad the data to power-of-two sizes in x and t before the Fourier transform
+    n_jobs: number of threads over which to split the wavenumbers
 
     Output
     ---------
@@ -143,41 +203,46 @@ def migrationStolt(dat,vel=1.68e8,htaper=100,vtaper=1000):
     v[v>1.] = 1.
     H,V = np.meshgrid(h,v)
     dat.data *= H*V
+    # optionally pad the array with zeros up to the next power of 2 for the discrete fft
+    if pad:
+        nt = 2**(np.ceil(np.log(dat.snum)/np.log(2))).astype(int)
+        nx = 2**(np.ceil(np.log(dat.tnum)/np.log(2))).astype(int)
+    else:
+        nt = dat.snum
+        nx = dat.tnum
     # 2D Forward Fourier Transform to get data in frequency-wavenumber space, FK = D(kx,z=0,ws)
-    FK = np.fft.fft2(dat.data,(dat.snum,dat.tnum))[:dat.snum//2]
+    FK = np.fft.fft2(dat.data,(nt,nx))[:nt//2]
     # get the temporal frequencies
-    ws = 2.*np.pi*np.fft.fftfreq(dat.snum, d=dat.dt)[:dat.snum//2]
+    ws = 2.*np.pi*np.fft.fftfreq(nt, d=dat.dt)[:nt//2]
     # get the horizontal wavenumbers
     if np.mean(dat.trace_int) <= 0:
         Warning("The trace spacing, variable 'dat.trace_int', should be greater than 0. Using gradient(dat.dist) instead.")
         trace_int = np.gradient(dat.dist)
     else:
         trace_int = dat.trace_int
-    kx = 2.*np.pi*np.fft.fftfreq(dat.tnum, d=np.mean(trace_int))
-    # interpolate from frequency (ws) into wavenumber (kz)
-    interp_real = interp2d(kx,ws,FK.real)
-    interp_imag = interp2d(kx,ws,FK.imag)
-    # interpolation will move from frequency-wavenumber to wavenumber-wavenumber, KK = D(kx,kz,t=0)
-    KK = np.zeros_like(FK)
-    print('Interpolating from temporal frequency (ws) to vertical wavenumber (kz):')
-    print('Interpolating:')
-    # for all temporal frequencies
-    for zj in range(dat.snum//2):
-        kzj = ws[zj]*2./vel
-        if zj%100 == 0:
-            print(int(ws[zj]/1e6/2/np.pi), 'MHz, ', end='')
-            sys.stdout.flush()
-        # for all horizontal wavenumbers
-        for xi in range(len(kx)):
-            kxi = kx[xi]
-            # migration conversion to wavenumber (Yilmaz equation C.53)
-            wsj = vel/2.*np.sqrt(kzj**2.+kxi**2.)
-            # get the interpolated FFT values, real and imaginary, S(kx,kz,t=0)
-            KK[zj,xi] = interp_real(kxi,wsj) + 1j*interp_imag(kxi,wsj)
+    kx = 2.*np.pi*np.fft.fftfreq(nx, d=np.mean(trace_int))
     # all vertical wavenumbers
     kz = ws*2./vel
-    # grid wavenumbers for scaling calculation
+    # grid wavenumbers for the mapping and the scaling calculation
     kX,kZ = np.meshgrid(kx,kz)
+
+    print('Interpolating from temporal frequency (ws) to vertical wavenumber (kz)')
+    # migration conversion to wavenumber (Yilmaz equation C.53)
+    ws_mig = vel/2.*np.sqrt(kZ**2.+kX**2.)
+    # interpolation will move from frequency-wavenumber to wavenumber-wavenumber, KK = D(kx,kz,t=0)
+    # the frequencies are evenly spaced, so find the fractional index directly
+    # values off the end of the frequency axis take the nearest value
+    KK = np.zeros_like(FK)
+
+    def remap(sl):
+        w_ind = np.clip(ws_mig[:, sl]/(ws[1]-ws[0]), 0., len(ws)-1.)
+        w_lo = np.minimum(np.floor(w_ind).astype(int), len(ws)-2)
+        w_frac = w_ind - w_lo
+        cols = np.arange(len(kx))[np.newaxis, sl]
+        KK[:, sl] = FK[w_lo,cols]*(1.-w_frac) + FK[w_lo+1,cols]*w_frac
+
+    # each wavenumber is independent, so split them between threads
+    _run_slabs(remap, len(kx), n_jobs)
     # scaling for obliquity factor (Yilmaz equation C.56)
     with np.errstate(invalid='ignore'):
         scaling = kZ/np.sqrt(kX**2.+kZ**2.)
@@ -186,23 +251,22 @@ def migrationStolt(dat,vel=1.68e8,htaper=100,vtaper=1000):
     KK[0,0] = 0.+0j
     # 2D Inverse Fourier Transform to get back to distance spce, D(x,z,t=0)
     dat.data = np.real(np.fft.ifft2(KK))
-    # Cut array to input matrix dimensions
-    dat.data = dat.data[:dat.snum,:dat.tnum]
+    # Cut array to input matrix dimensions (dropping any padding)
+    dat.data = dat.data[:dat.snum//2,:dat.tnum]
 
     # this changes the vertical scale
     print('Rescaling TWTT')
-    dat.travel_time = np.arange(dat.travel_time[0], dat.travel_time[-1], dat.data.shape[0])
+    dat.travel_time = np.linspace(dat.travel_time[0], dat.travel_time[-1], dat.data.shape[0])
     dat.dt = dat.dt * 2.
     dat.snum = dat.data.shape[0]
 
     # print the total time
-    print('')
     print('Stolt Migration of %.0fx%.0f matrix complete in %.2f seconds'
           %(dat.tnum,dat.snum,time.time()-start))
     return dat
 
 
-def migrationPhaseShift(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
+def migrationPhaseShift(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000,mem_limit=1.0e8,n_jobs=1):
     """
 
     Phase-Shift Migration
@@ -230,6 +294,8 @@ def migrationPhaseShift(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
         If uniform velocity (i.e. vel=constant) input constant
         If layered velocity (i.e. vel=v(z)) input array with shape (#vel-points, 2) (i.e. no x-values)
     vel_fn: filename for layered velocity input, .txt file with columns for v, x, z
+    mem_limit: approximate memory budget, in bytes, for the constant velocity imaging sum
+    n_jobs: number of threads over which to split the frequencies
 
     Output
     ---------
@@ -271,7 +337,7 @@ def migrationPhaseShift(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
             raise TypeError('File %s was given for input velocity array, but cannot be loaded. Please reformat to txt file.'%vel_fn)
     vmig = getVelocityProfile(dat,vel)
     # Migration by phase shift, frequency-wavenumber (FKx) to time-wavenumber (TKx)
-    TK = phaseShift(dat, vmig, vel, kx, ws, FK)
+    TK = phaseShift(dat, vmig, vel, kx, ws, FK, mem_limit=mem_limit, n_jobs=n_jobs)
     # Transform from time-wavenumber (TKx) to time-space (TX) domain to get migrated section
     dat.data = np.fft.ifft(TK).real
     # print the total time
@@ -281,7 +347,7 @@ def migrationPhaseShift(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
     return dat
 
 
-def migrationTimeWavenumber(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
+def migrationTimeWavenumber(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000,refine=2):
     """
 
     Time-Wavenumber Migration
@@ -289,10 +355,16 @@ def migrationTimeWavenumber(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
     The migration is a reverse time migration in the (t,k) domain. In the
     first step, the data g(t,x) are Fourier transformed x->k into
     the time-wavenumber domain g(t,k).
-    Then looping over wavenumbers, the data are then reverse-time
-    finite-difference migrated, wavenumber by wavenumber.  The resulting
-    migrated data m(tau,k), now in the tau (migrated time) and k domain,
-    are inverse fourier transformed back into m(tau,xout) and written out.
+    Then the data are reverse-time finite-difference migrated, for all wavenumbers at once.
+    The resulting migrated data m(tau,k), now in the tau (migrated time) and k domain,
+    are inverse fourier transformed back into m(tau,xout).
+
+    For each wavenumber, the upgoing wavefield p(tau,t) obeys
+        p_tt = p_tautau - (v*k/2)^2 p
+    We march this backward in time from the last sample to t=0, injecting the recorded data
+    at the surface (tau=0), and the field at t=0 is the migrated image. The time step is the sample
+    interval, which propagates the wave exactly for k=0, and the (v*k/2)^2 term is
+    averaged over the previous and next time steps so the scheme is stable for all k.
 
     **
     The foundation of this script was taken from:
@@ -302,12 +374,14 @@ def migrationTimeWavenumber(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
     Parameters
     ---------
     dat: data as a class in the ImpDAR format
-    vel: v(x,z)
-        Up to 2-D array with three columns for velocities (m/s), and z/x (m).
-        Array structure is velocities in first column, z location in second, x location in third.
+    vel: v(z)
+        Up to 2-D array with two columns for velocities (m/s), and z (m).
         If uniform velocity (i.e. vel=constant) input constant
         If layered velocity (i.e. vel=v(z)) input array with shape (#vel-points, 2) (i.e. no x-values)
-    vel_fn: filename for layered velocity input, .txt file with columns for v, x, z
+        Lateral velocity variations cannot be used in the wavenumber domain.
+    vel_fn: filename for layered velocity input, .txt file with columns for v, z
+    refine: factor by which the finite-difference time step is refined relative to the
+        sample interval. Larger values are more accurate for steep dips but cost refine^2.
 
     Output
     ---------
@@ -334,16 +408,26 @@ def migrationTimeWavenumber(dat,vel=1.69e8,vel_fn=None,htaper=100,vtaper=1000):
     else:
         trace_int = dat.trace_int
     kx = 2.*np.pi*np.fft.fftfreq(dat.tnum,d=np.mean(trace_int))
+    # Velocity structure from input
+    if vel_fn is not None:
+        try:
+            vel = np.genfromtxt(vel_fn)
+            print('Velocities loaded from %s.'%vel_fn)
+        except:
+            raise TypeError('File %s was given for input velocity array, but cannot be loaded. Please reformat to txt file.'%vel_fn)
+    if hasattr(vel,"__len__") and np.shape(vel)[-1] == 3:
+        raise ValueError('Lateral velocity variations cannot be used for time-wavenumber migration.')
+    vmig = getVelocityProfile(dat,vel)
     # 1D Forward Fourier Transform to get data in time-wavenumber space, TK = D(kx,z=0,ts)
+    TK = np.fft.fft(dat.data,axis=1)
 
-    # Loop over wavenumbers for reverse time migration
-    for k in kx:
-        continue
+    # Reverse time migration, all wavenumbers at once
+    TK = reverseTimeFD(TK, vmig, kx, dat.dt, refine=refine)
 
     # 1D Inverse Fourier Transform to get data back into migrated time-distance space
+    dat.data = np.fft.ifft(TK,axis=1).real
 
     # print the total time
-    print('')
     print('Time-Wavenumber Migration of %.0fx%.0f matrix complete in %.2f seconds'
           %(dat.tnum,dat.snum,time.time()-start))
     return dat
@@ -369,6 +453,10 @@ def migrationSeisUnix(dat,
                 migration which combines the advantages of phase shift and finite difference migrations.
     3) sustolt - Stolt migration for stacked data or common-offset gathers
 
+    The traces are written in SU format straight to the standard input of the SeisUnix routine,
+    and its standard output is parsed back into the data array, so nothing is written to disk.
+    The routine is run in its own temporary directory, so several migrations can run at once
+    from the same place.
 
     Parameters
     ---------
@@ -395,16 +483,9 @@ def migrationSeisUnix(dat,
 
     """
 
-    if sp.Popen(['which', mtype]).wait() != 0:
+    if shutil.which(mtype) is None:
         raise FileNotFoundError('Cannot find chosen SeisUnix migration routine,' + mtype + '. Either install or choose a different migration routine.')
 
-    # save to seisunix format for migration with SU routines
-    if dat.fn is None:
-        raise TypeError('Need a filename. Please save the file using the ImpDAR save function.')
-    else:
-        out_fn = os.path.splitext(dat.fn)[0] + '.sgy'
-        dat.save_as_segy(out_fn)
-
     # Get the trace spacing
     if np.mean(dat.trace_int) <= 0:
         Warning("The trace spacing, variable 'dat.trace_int', should be greater than 0. Using gradient(dat.dist) instead.")
@@ -417,71 +498,51 @@ def migrationSeisUnix(dat,
     if dz is None:
         dz = vel/1e6 * dat.travel_time[-1] / 2 / dat.snum
 
-    # Do the migration through the command line
-    segy_name = os.path.splitext(dat.fn)[0]
-    bin_fn = os.path.splitext(dat.fn)[0] + '_mig.bin'
-
-    ps1 = sp.Popen(['segyread', 'tape=' + segy_name + '.sgy'], stdout=sp.PIPE)
-    ps2 = sp.Popen(['segyclean'], stdin=ps1.stdout, stdout=sp.PIPE)
-    with open(segy_name+'_mig.sgy','wb') as fout:
-        # Time Wavenumber
-        if mtype == 'sumigtk':
-            ps3 = sp.Popen(['sumigtk',
-                            'tmig={:f}'.format(tmig),
-                            'vmig={:f}'.format(vel * 1.e-6),
-                            'verbose=' + str(verbose),
-                            'nxpad={:d}'.format(int(nxpad)),
-                            'ltaper={:d}'.format(htaper),
-                            'dxcdp={:f}'.format(dx)],
-                            stdin=ps2.stdout,
-                            stdout=fout)
-
-        # Fourier Finite Difference
-        elif mtype == 'sumigffd':
-            if vel_fn is None:
-                raise ValueError('vel_fn needed for gffd')
-            ps3 = sp.Popen(['sumigffd',
-                            'vfile=' + vel_fn,
-                            'nz={:d}'.format(nz),
-                            'dz={:f}'.format(dz),
-                            'dt={:f}'.format(dat.dt * 1.0e-6),
-                            'dx={:f}'.format(dx)],
-                           stdout=fout,
-                           stdin=ps2.stdout)
-
-        # Stolt
-        elif mtype == 'sustolt':
-            ps3 = sp.Popen(['sustolt',
-                            'tmig={:f}'.format(tmig),
-                            'vmig={:f}'.format(vel * 1.0e-6),
-                            'verbose=' + str(verbose),
-                            'lstaper={:d}'.format(htaper),
-                            'lbtaper={:d}'.format(vtaper),
-                            'dxcdp={:f}'.format(dx),
-                            'cdpmin=0',
-                            'cdpmax={:d}'.format(dat.tnum)],
-                           stdout=fout,
-                           stdin=ps2.stdout)
-        else:
-            ps1.stdout.close()
-            ps2.communicate()
-
-            raise ValueError('The SeisUnix migration routine', mtype, 'has not been implemented in ImpDAR. Optionally, use ImpDAR to convert to SegY and run the migration in the command line.')
-
-    ps1.wait()
-    ps2.wait()
-    ps3.communicate()
-    ps1.stdout.close()
-    ps2.stdout.close()
-    sp.run('sustrip < '+segy_name+'_mig.sgy '+'> '+bin_fn,shell=True)
-    with open(bin_fn, 'rb') as fid:
-        data_flat = np.fromfile(fid, np.float32)
-
-    dat.data = np.transpose(np.reshape(data_flat, (dat.tnum, dat.snum)))
-    os.remove(bin_fn)
-    os.remove('header')
-    os.remove('binary')
-    os.remove(segy_name + '.sgy')
+    # Time Wavenumber
+    if mtype == 'sumigtk':
+        args = ['sumigtk',
+                'tmig={:f}'.format(tmig),
+                'vmig={:f}'.format(vel * 1.e-6),
+                'verbose=' + str(verbose),
+                'nxpad={:d}'.format(int(nxpad)),
+                'ltaper={:d}'.format(htaper),
+                'dxcdp={:f}'.format(dx)]
+
+    # Fourier Finite Difference
+    elif mtype == 'sumigffd':
+        if vel_fn is None:
+            raise ValueError('vel_fn needed for gffd')
+        args = ['sumigffd',
+                'vfile=' + os.path.abspath(vel_fn),
+                'nz={:d}'.format(nz),
+                'dz={:f}'.format(dz),
+                'dt={:f}'.format(dat.dt * 1.0e-6),
+                'dx={:f}'.format(dx)]
+
+    # Stolt
+    elif mtype == 'sustolt':
+        args = ['sustolt',
+                'tmig={:f}'.format(tmig),
+                'vmig={:f}'.format(vel * 1.0e-6),
+                'verbose=' + str(verbose),
+                'lstaper={:d}'.format(htaper),
+                'lbtaper={:d}'.format(vtaper),
+                'dxcdp={:f}'.format(dx),
+                'cdpmin=0',
+                'cdpmax={:d}'.format(dat.tnum)]
+    else:
+        raise ValueError('The SeisUnix migration routine', mtype, 'has not been implemented in ImpDAR. Optionally, use ImpDAR to convert to SegY and run the migration in the command line.')
+
+    # Do the migration through a pipe, in a scratch directory for anything the routine writes
+    with tempfile.TemporaryDirectory(prefix='impdar_su_') as tmpdir:
+        proc = sp.run(args, input=_to_su(dat), stdout=sp.PIPE, cwd=tmpdir)
+    if proc.returncode != 0:
+        raise ImpdarError('SeisUnix routine {:s} failed with exit code {:d}'.format(mtype, proc.returncode))
+
+    data = _from_su(proc.stdout)
+    if data.shape != (dat.snum, dat.tnum):
+        raise ValueError('SeisUnix returned an array of shape {:s}, expected {:s}'.format(str(data.shape), str((dat.snum, dat.tnum))))
+    dat.data = data
     return dat
 
 # -----------------------------------------------------------------------------
@@ -492,12 +553,16 @@ def migrationSeisUnix(dat,
 # -----------------------------------------------------------------------------
 # Supporting functions
 
-def phaseShift(dat, vmig, vels_in, kx, ws, FK):
+def phaseShift(dat, vmig, vels_in, kx, ws, FK, mem_limit=1.0e8, n_jobs=1):
     """
 
     Phase-Shift migration to get from frequency-wavenumber (FKx) space to time-wavenumber (TKx) space.
     This is for either constant or layered velocity v(z).
 
+    Each temporal frequency is migrated independently, so the FK plane is split into
+    slabs of frequencies that can be run in parallel, and the partial time-wavenumber images
+    from each slab are summed.
+
     **
     The foundation of this script was taken from Matlab code written by Andreas Tzanis,
     Dept. of Geophysics, University of Athens (2005)
@@ -516,6 +581,8 @@ def phaseShift(dat, vmig, vels_in, kx, ws, FK):
     kx: horizontal wavenumbers
     ws: temporal frequencies
     FK: 2-D array of the data image in frequency-wavenumber space (FKx)
+    mem_limit: approximate memory budget, in bytes, for blocks of output times (constant velocity only)
+    n_jobs: number of threads over which to split the frequencies
 
     Output
     ---------
@@ -523,35 +590,24 @@ def phaseShift(dat, vmig, vels_in, kx, ws, FK):
 
     """
 
-    # initialize the time-wavenumber array to be filled with complex values
-    TK = np.zeros((dat.snum,len(kx)))+0j
+    w = ws.copy()
+    w[w == 0.0] = 1e-10/dat.dt
 
     # Uniform velocity case, vmig=constant
     if not hasattr(vmig,"__len__"):
         print('Constant velocity %s m/usec'%(vmig/1e6))
-        # iterate through all frequencies
-        print('Frequency: ',end='')
-        sys.stdout.flush()
-
-        print('Frequency: ')
-        for iw in range(len(ws)):
-            w = ws[iw]
-            if w == 0.0:
-                w = 1e-10/dat.dt
-            if iw%100 == 0:
-                print(int(w/1e6/(2.*np.pi)),'MHz',', ',end='')
-                sys.stdout.flush()
-            # remove frequencies outside of the domain
-            vkx2 = (vmig*kx/2.)**2.
-            ik = np.argwhere(vkx2 < w**2.)
-            FFK = FK[iw,ik]
-            # get the phase for shift
-            phase = (-w*dat.dt*np.sqrt(1.0 - vkx2[ik]/w**2.)).real
-            cp = np.conj(np.cos(phase)+1j*np.sin(phase))
-            # Accumulate output image (time-wavenumber space) summed over all frequencies
-            for itau in range(dat.snum):
-                 FFK *= cp
-                 TK[itau,ik] += FFK
+        # remove frequencies outside of the domain
+        vkx2 = (vmig*kx/2.)**2.
+        inside = vkx2[np.newaxis, :] < w[:, np.newaxis]**2.
+        # get the phase for shift, for all (w, kx) at once
+        with np.errstate(invalid='ignore'):
+            phase = (-w[:, np.newaxis]*dat.dt*np.sqrt(1.0 - vkx2[np.newaxis, :]/w[:, np.newaxis]**2.)).real
+        cp = np.exp(-1j*phase)
+        cp[~inside] = 0.
+        FK = FK*inside
+        # Accumulate output image (time-wavenumber space) summed over all frequencies
+        TK = sum(_run_slabs(lambda sl: _phase_shift_constant(FK[sl], cp[sl], dat.snum, mem_limit=mem_limit / n_jobs),
+                            len(ws), n_jobs))
 
     else:
         # Layered and/or lateral velocity case, vmig=v(x,z)
@@ -559,63 +615,13 @@ def phaseShift(dat, vmig, vels_in, kx, ws, FK):
             raise ValueError('Interpolated velocity profile is not the length of the number of samples in a trace.')
         if hasattr(vmig[0],"__len__"):
             print('2-D velocity structure, Fourier Finite-Difference Migration')
-            # Finite Difference Stencil
-            stencil = Sp_Matr(dat.tnum,-2,1,1)
-            FFX_last = 0.
         else:
             print('1-D velocity structure, Gazdag Migration')
             print('Velocities (m/s): %.2e',vels_in[:,0])
             print('Depths (m):',vels_in[:,1])
-            print('Travel Times ($\mu$ sec):',dat.travel_time)
-        # iterate through all output travel times
-        for itau in range(dat.snum):
-            tau = dat.travel_time[itau]/1e6
-            if itau%100 == 0:
-                print('Time %.2e, ' %(tau), end='')
-                sys.stdout.flush()
-            # iterate through all frequencies
-            for iw in range(len(ws)):
-                w = ws[iw]
-                if w == 0.0:
-                    w = 1e-10/dat.dt
-
-                # Get foreground and background velocities
-                if hasattr(vmig[itau],"__len__"):
-                    vbg = np.min(vmig[itau])
-                    vfg = vmig[itau]-vbg
-                else:
-                    vbg = vmig[itau]
-
-                ### Retardation term
-                # cosine squared
-                coss = 1.0+0j - (0.5*vbg*kx/w)**2.
-                # calculate phase for shift
-                phase = (-w*dat.dt*np.sqrt(coss)).real
-                cshift = np.conj(np.cos(phase)+1j*np.sin(phase))
-                FK[iw] *= cshift
-
-                if hasattr(vmig[itau],"__len__"):
-                    # inverse fourier tranform to frequency-space domain
-                    FFX = np.fft.ifft(FK[iw])
-
-                    ### Thin-lens term (Stoffa et al. 1990)
-                    phase2 = (1./vbg - 2./vfg)*w*dat.dt # TODO: I am pretty sure that this is wrong
-                    cshift2 = np.cos(phase2) + 1j*np.sin(phase2)
-                    FFX *= cshift2
-
-                    ### Diffraction term, Finite Difference operator
-                    if itau > 0:
-                        FFX = fourierFiniteDiff(dat,vfg,w,FFX,FFX_last,stencil)
-                    FFX_last = FFX
-
-                    # Fourier transform back to frequency-wavenumber domain
-                    FK[iw] = np.fft.fft(FFX)
-
-                # zero if outside domain
-                idx = coss <= (tau/dat.travel_time[-1]/1e6)**2.
-                FK[iw,idx] = 0.0 + 0j
-                # sum over all frequencies
-                TK[itau] += FK[iw]
+            print('Travel Times ($\\mu$ sec):',dat.travel_time)
+        TK = sum(_run_slabs(lambda sl: _phase_shift_variable(dat, vmig, kx, w[sl], FK[sl]),
+                            len(ws), n_jobs))
 
     # Cut to original array size
     TK = TK[:,:dat.tnum]
@@ -624,6 +630,188 @@ def phaseShift(dat, vmig, vels_in, kx, ws, FK):
     return TK
 
 
+def _phase_shift_constant(FK, cp, ntau, mem_limit=1.0e8):
+    """Sum the phase-shifted FK plane over frequency for every output time.
+
+    The image at time step tau is TK[tau] = sum_w FK[w] * cp[w]**(tau+1).
+    Rather than looping over frequencies and times, we precompute the powers of cp
+    for a block of output times, sum the whole block with one einsum,
+    then step the FK plane forward by the block length.
+
+    Parameters
+    ---------
+    FK: 2-D array (frequency x wavenumber) of the data in FKx space
+    cp: 2-D array (same shape as FK) of the phase increment for one time step
+    ntau: number of output time steps
+    mem_limit: approximate memory budget for the block of powers, in bytes
+
+    Output
+    ---------
+    TK: 2-D array (ntau x wavenumber) of the image in TKx space
+    """
+    TK = np.zeros((ntau, FK.shape[1]), dtype=complex)
+    nblock = int(max(1, min(ntau, mem_limit // (16 * max(cp.size, 1)))))
+    # powers cp**1 ... cp**nblock
+    cp_pow = np.empty((nblock,) + cp.shape, dtype=complex)
+    cp_pow[0] = cp
+    for i in range(1, nblock):
+        cp_pow[i] = cp_pow[i - 1] * cp
+    FFK = FK.astype(complex)
+    for itau in range(0, ntau, nblock):
+        n = min(nblock, ntau - itau)
+        TK[itau:itau + n] = np.einsum('wk,twk->tk', FFK, cp_pow[:n])
+        FFK *= cp_pow[nblock - 1]
+    return TK
+
+
+def _phase_shift_variable(dat, vmig, kx, ws, FK):
+    """Downward continue a slab of frequencies through a v(z) or v(x,z) velocity structure.
+
+    FK is modified in place, so slabs should not overlap.
+
+    Parameters
+    ---------
+    dat: data as a dictionary in the ImpDAR format
+    vmig: 1-D or 2-D array of migration velocity (m/s)
+    kx: horizontal wavenumbers
+    ws: temporal frequencies of this slab (nonzero)
+    FK: 2-D array (frequency x wavenumber) of the data in FKx space for this slab
+
+    Output
+    ---------
+    TK: 2-D array (snum x wavenumber) of the partial image in TKx space
+    """
+    TK = np.zeros((dat.snum, FK.shape[1]), dtype=complex)
+    lateral = hasattr(vmig[0],"__len__")
+    if lateral:
+        # Finite Difference Stencil
+        stencil = Sp_Matr(dat.tnum,-2,1,1).tocsr()
+        FFX_last = 0.
+    w = ws[:, np.newaxis]
+    # iterate through all output travel times
+    for itau in range(dat.snum):
+        tau = dat.travel_time[itau]/1e6
+
+        # Get foreground and background velocities
+        if lateral:
+            vbg = np.min(vmig[itau])
+            vfg = vmig[itau]-vbg
+        else:
+            vbg = vmig[itau]
+
+        ### Retardation term
+        # cosine squared
+        coss = 1.0+0j - (0.5*vbg*kx[np.newaxis, :]/w)**2.
+        # calculate phase for shift
+        phase = (-w*dat.dt*np.sqrt(coss)).real
+        FK *= np.exp(-1j*phase)
+
+        if lateral:
+            # inverse fourier tranform to frequency-space domain
+            FFX = np.fft.ifft(FK, axis=1)
+
+            ### Thin-lens term (Stoffa et al. 1990)
+            with np.errstate(divide='ignore'):
+                phase2 = (1./vbg - 2./vfg)*w*dat.dt # TODO: I am pretty sure that this is wrong
+            FFX *= np.cos(phase2) + 1j*np.sin(phase2)
+
+            ### Diffraction term, Finite Difference operator
+            if itau > 0:
+                FFX = fourierFiniteDiff(dat,vfg,w,FFX,FFX_last,stencil)
+            FFX_last = FFX
+
+            # Fourier transform back to frequency-wavenumber domain
+            FK[:, :] = np.fft.fft(FFX, axis=1)
+
+        # zero if outside domain
+        FK[coss.real <= (tau/dat.travel_time[-1]/1e6)**2.] = 0.0 + 0j
+        # sum over all frequencies
+        TK[itau] = np.sum(FK, axis=0)
+    return TK
+
+
+def _run_slabs(func, n, n_jobs=1):
+    """Split range(n) into contiguous slabs and map func over them.
+
+    The slabs are run in a thread pool; numpy releases the GIL in the heavy
+    array operations, and the threads work on views of the same arrays
+    so nothing needs to be copied between workers. Without concurrent.futures
+    (python 2) the slabs are run one after another.
+
+    Parameters
+    ---------
+    func: callable taking a slice
+    n: length of the axis to split
+    n_jobs: number of slabs (and threads)
+
+    Output
+    ---------
+    list of the results of func for each slab, in order
+    """
+    n_jobs = int(max(1, min(n_jobs, n)))
+    bounds = np.linspace(0, n, n_jobs + 1).astype(int)
+    slabs = [slice(bounds[i], bounds[i + 1]) for i in range(n_jobs)]
+    if n_jobs == 1 or not FUTURES:
+        return [func(slab) for slab in slabs]
+    with ThreadPoolExecutor(max_workers=n_jobs) as executor:
+        return list(executor.map(func, slabs))
+
+
+def reverseTimeFD(TK, vmig, kx, dt, refine=2):
+    """
+
+    Reverse-time finite-difference migration in the time-wavenumber (TKx) domain.
+
+    Each wavenumber is an independent 1-D problem in migrated time (tau),
+        p_tt = p_tautau - a^2 p,  a = vmig*k/2
+    The recorded data are the boundary condition at tau=0 and we step backward in time,
+    so that the field at t=0 is the image. The leapfrog update, with a time step equal
+    to the tau spacing and the a^2 term averaged over time steps n-1 and n+1, is
+        p[n+1,j] = (p[n,j+1] + p[n,j-1]) / (1 + (a*dt)^2 / 2) - p[n-1,j]
+    which is applied to all wavenumbers at once. The scheme is exact for k=0 but disperses
+    high wavenumbers, so the data can be resampled onto a finer time grid for the migration.
+
+    Parameters
+    ---------
+    TK: 2-D array (snum x tnum) of the data in time-wavenumber space
+    vmig: migration velocity (m/s), constant or 1-D array with one value per sample
+    kx: horizontal wavenumbers
+    dt: sample interval (s)
+    refine: integer factor by which the time step is refined relative to dt
+
+    Output
+    ---------
+    MK: 2-D array (snum x tnum) of the migrated image in migrated time-wavenumber space
+
+    """
+    refine = int(max(1, refine))
+    snum_in = TK.shape[0]
+    vmig = np.atleast_1d(vmig)
+    if refine > 1:
+        # band-limited interpolation onto the finer grid
+        TK = resample(TK, snum_in*refine, axis=0)
+        if len(vmig) > 1:
+            vmig = np.repeat(vmig, refine)
+        dt = dt/refine
+    snum = TK.shape[0]
+    # coefficient for the a^2 term, one extra row for the fixed bottom boundary
+    ak2 = (0.5*vmig[:, np.newaxis]*kx[np.newaxis, :]*dt)**2.
+    coeff = np.ones((snum + 1, len(kx)))
+    coeff[:snum] = 1./(1. + ak2/2.)
+    coeff = coeff[1:-1]
+
+    p_last = np.zeros((snum + 1, len(kx)), dtype=complex)
+    p = np.zeros_like(p_last)
+    for n in range(snum):
+        p_next = np.empty_like(p)
+        # inject the recorded data at the surface, latest time first
+        p_next[0] = TK[snum - 1 - n]
+        p_next[1:-1] = (p[2:] + p[:-2])*coeff - p_last[1:-1]
+        p_next[-1] = 0.
+        p_last, p = p, p_next
+    return p[:snum:refine]
+
+
 def fourierFiniteDiff(dat, vs, w, FFX, FFX_last, stencil, alpha=0.5,beta=0.25):
     """
 
@@ -635,7 +823,7 @@ def fourierFiniteDiff(dat, vs, w, FFX, FFX_last, stencil, alpha=0.5,beta=0.25):
     dat: data as a dictionary in the ImpDAR format
     vs: 1-D array of migration velocity (m/s)
     w: scalar temporal frequency
-    FFX: 2-D array of the data image in frequency-space (FX)
+    FFX: 2-D array of the data image in frequency-space (FX), one row per frequency
     FFX_last: same as FFX but for the last iteration (i.e. tau-1)
     alpha: coefficient on second order term, default to 0.5 for 45-degree equation
     beta: coefficient on third order term, default to 0.25 for 45-degree equation
@@ -651,8 +839,12 @@ def fourierFiniteDiff(dat, vs, w, FFX, FFX_last, stencil, alpha=0.5,beta=0.25):
     coeff1 = dat.dt*alpha*vs**2./(1j*4.*w*dx**2.)
     coeff2 = -beta*vs**2./(4.*w**2.*dx**2.)
 
+    # Apply the stencil along x for every frequency
+    def d2x(arr):
+        return stencil.dot(np.atleast_2d(arr).T).T.reshape(np.shape(arr))
+
     # Update equation, explicit backward Euler
-    FFX = FFX_last + coeff1*(stencil*FFX) + coeff2*(stencil*FFX - stencil*FFX_last)
+    FFX = FFX_last + coeff1*d2x(FFX) + coeff2*(d2x(FFX) - d2x(FFX_last))
     return FFX
 
 
@@ -671,11 +863,14 @@ def Sp_Matr(N,diag,k1,k2,k3=0,k4=0,nx=0):
     return A
 
 
-def getVelocityProfile(dat,vels_in):
+def getVelocityProfile(dat,vels_in,cache=True):
     """
 
     Map the layered velocity structure into the shape of the data.
 
+    Results are cached, keyed on the contents of the velocity input and the data geometry,
+    so repeated migrations of lines that share a velocity model do not redo the gridding.
+
     Parameters
     ---------
     dat: data as a dictionary in the ImpDAR format
@@ -684,12 +879,14 @@ def getVelocityProfile(dat,vels_in):
         Array structure is velocities in first column, z location in second, x location in third.
         If uniform velocity (i.e. vel=constant) input constant
         If layered velocity (i.e. vel=v(z)) input array with shape (#vel-points, 2) (i.e. no x-values)
+    cache: use (and fill) the cache of previously interpolated velocity profiles
 
     Output
     ---------
     vmig: 2-D array of migration velocities (m/s), shape is (#traces, #samples).
         If constant input velocity, output is constant.
         If only z-component in input velocity array, output is v(z)
+        Cached output is read-only.
 
     """
 
@@ -697,6 +894,34 @@ def getVelocityProfile(dat,vels_in):
     if not hasattr(vels_in,"__len__"):
         return vels_in
 
+    if not cache:
+        return _interpVelocityProfile(dat,vels_in)
+
+    key = _vmig_cache_key(dat,vels_in)
+    if key in _VMIG_CACHE:
+        print('Using cached velocity profile.')
+        _VMIG_CACHE.move_to_end(key)
+        return _VMIG_CACHE[key]
+    vmig = _interpVelocityProfile(dat,vels_in)
+    vmig.setflags(write=False)
+    _VMIG_CACHE[key] = vmig
+    while len(_VMIG_CACHE) > VMIG_CACHE_SIZE:
+        _VMIG_CACHE.popitem(last=False)
+    return vmig
+
+
+def _vmig_cache_key(dat,vels_in):
+    """Hash the velocity input together with the geometry (travel times and distances) of the data"""
+    sha = hashlib.sha1()
+    for arr in [vels_in, dat.travel_time, dat.dist]:
+        arr = np.zeros((0,)) if arr is None else np.ascontiguousarray(arr, dtype=float)
+        sha.update(str(arr.shape).encode())
+        sha.update(arr.tobytes())
+    return sha.hexdigest()
+
+
+def _interpVelocityProfile(dat,vels_in):
+    """Do the actual work for getVelocityProfile, without caching"""
     start = time.time()
     print('Interpolating the velocity profile.')
 
@@ -749,22 +974,22 @@ def getVelocityProfile(dat,vels_in):
         VS = np.reshape(VS,np.shape(XS))
 
         # convert velocities into travel_time space for all traces
-        vmig = np.zeros_like(VS)
+        # Compute times from input velocity/location array (vels_in),
+        # vel_t[j] is twice the integral of the slowness over the first j depths
+        vel_t = np.zeros_like(VS)
+        vel_t[2:] = 2.*cumulative_trapezoid(1./VS,ZS,axis=0)[:-1]
+        # All traces share the depth array, so this is also t(z) for the maximum penetration depth array
+        tofz = vel_t
+        if np.any(twtt[-1] > tofz[-1]):
+            raise ValueError('Two-way travel time array extends outside of interpolation range')
+        if np.any(twtt[0] < tofz[0]):
+            raise ValueError('Two-way travel time array extends outside of interpolation range')
+        # Compute z(t) from monotonically increasing t
+        zoft = np.empty_like(VS)
         for i in range(dat.tnum):
-            vel_z = ZS[:,i]
-            vel_v = VS[:,i]
-            # Compute times from input velocity/location array (vels_in)
-            vel_t = 2*np.array([np.trapz(1./vel_v[:j],vel_z[:j]) for j in range(dat.snum)])
-            # Interpolate to get t(z) for maximum penetration depth array
-            tinterp = interp1d(ZS[:,i],vel_t)
-            tofz = tinterp(zs)
-            # Compute z(t) from monotonically increasing t
-            zinterp = interp1d(tofz,zs)
-            if twtt[-1] > tofz[-1]:
-                raise ValueError('Two-way travel time array extends outside of interpolation range')
-            zoft = zinterp(twtt)
-            # Compute vmig(t) from z(t)
-            vmig[:,i] = 2.*np.gradient(zoft,twtt)
+            zoft[:,i] = np.interp(twtt,tofz[:,i],zs)
+        # Compute vmig(t) from z(t)
+        vmig = 2.*np.gradient(zoft,twtt,axis=0)
     else:
         # We get here if the number of columns is bad
         raise ValueError('Input must be 2d with 2 or 3 columns')
@@ -774,6 +999,74 @@ def getVelocityProfile(dat,vels_in):
     return vmig
 
 
+#: Maximum number of interpolated velocity profiles kept by getVelocityProfile
+VMIG_CACHE_SIZE = 8
+_VMIG_CACHE = OrderedDict()
+
+
+def _su_trace_dtype(ns):
+    """The numpy dtype of one SU trace: a 240-byte SEG-Y trace header and ns float32 samples.
+
+    SU files are in the native byte order. Only the header fields ImpDAR fills are named.
+    """
+    header = np.dtype({'names': ['tracl', 'tracr', 'cdp', 'cdpt', 'trid', 'ns', 'dt'],
+                       'formats': [np.int32, np.int32, np.int32, np.int32, np.int16, np.uint16, np.uint16],
+                       'offsets': [0, 4, 20, 24, 28, 114, 116],
+                       'itemsize': 240})
+    return np.dtype([('header', header), ('data', np.float32, (ns,))])
+
+
+def _to_su(dat):
+    """Pack the data into the bytes of an SU stream, one trace per column of dat.data
+
+    The sample interval is written in the same scaled units as in a segy export,
+    i.e. nanoseconds stand in for microseconds.
+
+    Raises
+    ------
+    ValueError
+        If the number of samples or the scaled sample interval do not fit in the
+        (16-bit) SU header fields
+    """
+    su_dt = int(round(dat.dt * 1.0e12))
+    if su_dt > np.iinfo(np.uint16).max or su_dt < 1:
+        raise ValueError('A sample interval of {:g} s cannot be written to an SU header, which holds up to '
+                         '{:g} s in these units'.format(dat.dt, np.iinfo(np.uint16).max * 1.0e-12))
+    if dat.snum > np.iinfo(np.uint16).max:
+        raise ValueError('SU headers cannot hold {:d} samples per trace'.format(int(dat.snum)))
+    traces = np.zeros(dat.tnum, dtype=_su_trace_dtype(dat.snum))
+    traces['header']['tracl'] = np.arange(1, dat.tnum + 1)
+    traces['header']['tracr'] = np.arange(1, dat.tnum + 1)
+    traces['header']['cdp'] = np.arange(dat.tnum)
+    traces['header']['cdpt'] = 1
+    traces['header']['trid'] = 1
+    traces['header']['ns'] = dat.snum
+    traces['header']['dt'] = su_dt
+    traces['data'] = dat.data.transpose()
+    return traces.tobytes()
+
+
+def _from_su(buf):
+    """Unpack the bytes of an SU stream into a (ns x ntraces) array"""
+    if len(buf) < 240:
+        raise ValueError('No traces in the SeisUnix output')
+    ns = int(np.frombuffer(buf, dtype=np.uint16, count=1, offset=114)[0])
+    traces = np.frombuffer(buf, dtype=_su_trace_dtype(ns))
+    return np.array(traces['data'].transpose())
+
+
+def _nearest_index(tt, targets):
+    """Find the index of the closest value in a monotonic array tt for each target.
+
+    This matches the result of argmin(abs(tt - target)), including taking the
+    lower index for ties, without building the full difference matrix.
+    """
+    hi = np.clip(np.searchsorted(tt, targets), 1, len(tt) - 1)
+    lo = hi - 1
+    take_lo = (targets - tt[lo]) <= (tt[hi] - targets)
+    return np.where(take_lo, lo, hi)
+
+
 def _check_data_shape(dat):
     if np.size(dat.data, 1) != dat.tnum or np.size(dat.data, 0) != dat.snum:
         raise ValueError('The input array must be of size (tnum,snum)')
@@ -32,7 +32,8 @@ def plot(fns, tr=None, s=False, ftype='png', dpi=300, xd=False, yd=False, x_rang
     x_range: tuple, optional
         The range of traces to plot in the radargram. Default is (0, -1) (plot all traces)
     """
-    radar_data = load(filetype, fns)
+    # Power plots only need the picks, so do not read the data
+    radar_data = load(filetype, fns, memmap=power is not None)
 
     if xd:
         xdat = 'dist'
@@ -178,6 +179,68 @@ def plot_radargram(dat, xdat='tnum', ydat='twtt', x_range=(0, -1), y_range=(0, -
         return im, xd, yd, x_range, lims
 
 
+class LiveRadargram:
+    """A radargram of the latest traces, which is redrawn as new traces arrive
+
+    Only the last max_traces traces are kept, so this can run through a whole traverse.
+
+    Parameters
+    ----------
+    dat: impdar.lib.RadarData.Radardata
+        The header of the data to plot. Only travel_time is used.
+    max_traces: int, optional
+        The number of traces to show. Default 1000.
+    cmap: matplotlib.pyplot.cm, optional
+        The colormap to use
+    fig: matplotlib.pyplot.Figure
+        Figure canvas that should be plotted upon
+    ax: matplotlib.pyplot.Axes
+        Axes that should be plotted upon
+    """
+
+    def __init__(self, dat, max_traces=1000, cmap=plt.cm.gray, fig=None, ax=None):
+        if fig is not None:
+            if ax is None:
+                ax = plt.gca()
+        else:
+            fig, ax = plt.subplots(figsize=(12, 8))
+        self.fig, self.ax = fig, ax
+        self.max_traces = max_traces
+        self.tnum = 0
+        self.traces = np.full((len(np.ravel(dat.travel_time)), max_traces), np.nan)
+        self.yd = np.ravel(dat.travel_time)
+        self.im = ax.imshow(self.traces, cmap=cmap, aspect='auto',
+                            extent=[-max_traces, 0, np.max(self.yd), np.min(self.yd)])
+        ax.set_ylabel('Two way travel time (usec)')
+        ax.set_xlabel('Trace number')
+
+    def update(self, data):
+        """Add some traces to the right of the plot, and redraw
+
+        Parameters
+        ----------
+        data: np.ndarray
+            The new traces (snum x n)
+        """
+        n_new = data.shape[1]
+        if n_new == 0:
+            return
+        if n_new >= self.max_traces:
+            self.traces[:, :] = data[:, -self.max_traces:]
+        else:
+            self.traces[:, :-n_new] = self.traces[:, n_new:]
+            self.traces[:, -n_new:] = data
+        self.tnum += n_new
+
+        self.im.set_data(self.traces)
+        self.im.set_extent([self.tnum - self.max_traces, self.tnum, np.max(self.yd), np.min(self.yd)])
+        finite = self.traces[np.isfinite(self.traces)]
+        if finite.size > 0:
+            self.im.set_clim(*np.percentile(finite, (10, 90)))
+        self.fig.canvas.draw_idle()
+        self.fig.canvas.flush_events()
+
+
 def plot_traces(dat, tr, ydat='twtt', fig=None, ax=None, linewidth=1.0, linestyle='solid'):
     """Plot power vs depth or twtt in a trace
 
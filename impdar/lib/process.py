@@ -9,16 +9,30 @@
 """
 Define generic processing functions to ease calls from executables.
 """
+import io
 import os.path
+import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from contextlib import redirect_stdout
 import numpy as np
 
 from .load import load
-from .gpslib import interp as interpdeep
+from .ImpdarError import ImpdarError
+from .Pipeline import Pipeline, format_bytes
+from .ProcessingCache import ProcessingCache
+from .OutOfCore import run_out_of_core
 
 
-def process_and_exit(fn, cat=False, filetype='mat', **kwargs):
+def process_and_exit(fn, cat=False, filetype='mat', dry_run=False, n_jobs=1, cache=None, cache_size=10.,
+                     out_of_core=False, **kwargs):
     """Perform one or more processing steps, save, and exit
 
+    Each file is loaded, processed, and saved before the next one is read, so only one file
+    (per job) is ever in memory. Files are opened lazily where possible, so leading crops
+    only read what they keep. A summary of the files processed is printed at the end.
+
     Parameters
     ----------
     fn: list of strs
@@ -26,52 +40,176 @@ def process_and_exit(fn, cat=False, filetype='mat', **kwargs):
     cat: bool, optional
         If True, concatenate files before processing rather than running through each individually
     filetype: str, optional
-        The type of input file. Default is .mat.
+        The type of input file. Default is .mat. Outputs are .h5 if this is h5, otherwise .mat.
+    dry_run: bool, optional
+        Do not process anything. Just print the steps that would be run and an estimate of
+        the peak memory needed for each file. Default False.
+    n_jobs: int, optional
+        Process this many files at once, each in its own process. The output of each file
+        is printed together once it is done. Ignored if cat. Default 1.
+    cache: str, optional
+        Directory for a :class:`~impdar.lib.ProcessingCache.ProcessingCache`. The data are
+        cached after every processing stage, and reruns with the same input and early steps
+        start from the last cached stage. Default is no cache.
+    cache_size: float, optional
+        Size limit of the cache, in GB. Default 10.
+    out_of_core: bool, optional
+        Process each file a block of traces at a time (see :mod:`~impdar.lib.OutOfCore`), for
+        files that are too large for memory. Outputs are .h5. Cannot be used with cat, cache,
+        migrate, or interp. Default False.
     kwargs:
         These are the processing arguments for `process`
     """
-
-    radar_data = load(filetype, fn)
+    ext = '.h5' if (filetype == 'h5' or out_of_core) else '.mat'
+    if out_of_core and (cat or cache is not None):
+        raise ValueError('Cannot concatenate or cache when processing out of core')
+    pipeline = Pipeline.from_kwargs(**kwargs)
+    if cache is not None:
+        cache = ProcessingCache(cache, max_bytes=cache_size * 1.0e9)
+
+    if dry_run:
+        radar_data = load(filetype, fn, memmap=True)
+        if cat:
+            radar_data, fn = [_concat_metadata(radar_data)], [fn[0]]
+        for dat, f in zip(radar_data, fn):
+            stages, peak = pipeline.estimate_memory(dat)
+            print('{:s}: {:d} x {:d}'.format(f, int(dat.snum), int(dat.tnum)))
+            for desc, shape, stage_peak in stages:
+                print('    {:s}: {:d} x {:d}, peak {:s}'.format(desc, shape[0], shape[1], format_bytes(stage_peak)))
+            print('Estimated peak memory: {:s}'.format(format_bytes(peak)))
+        return
 
     # first we do the quirky one
     if cat:
-        radar_data = concat(radar_data)
         bn = os.path.splitext(fn[0])[0]
         if bn[-4:] == '_raw':
             bn = bn[:-4]
-        fn = [bn + '_cat.mat']
+        if 'o' in kwargs and kwargs['o'] is not None:
+            out_fn = kwargs['o']
+        else:
+            out_fn = bn + '_cat' + ext
+        # The files are opened lazily and read one at a time into the concatenated output
+        dat = _run_pipeline(pipeline, filetype, fn, lambda: concat(load(filetype, fn, memmap=True))[0], cache)
+        dat.save(out_fn)
+        return
 
-    processed = process(radar_data, **kwargs)
-    if not processed and not cat:
+    if len(pipeline) == 0:
         print('No processing steps performed. Not saving!')
         return
 
-    if 'o' in kwargs and kwargs['o'] is not None:
-        if len(radar_data) > 1:
-            for d, f in zip(radar_data, fn):
+    fns_out = []
+    for f in fn:
+        if 'o' in kwargs and kwargs['o'] is not None:
+            if len(fn) > 1:
                 bn = os.path.split(os.path.splitext(f)[0])[1]
                 if bn[-4:] == '_raw':
                     bn = bn[:-4]
-                out_fn = os.path.join(kwargs['o'], bn + '_proc.mat')
-                d.save(out_fn)
+                fns_out.append(os.path.join(kwargs['o'], bn + '_proc' + ext))
+            else:
+                fns_out.append(kwargs['o'])
         else:
-            out_fn = kwargs['o']
-            radar_data[0].save(out_fn)
-    else:
-        for d, f in zip(radar_data, fn):
             bn = os.path.splitext(f)[0]
             if bn[-4:] == '_raw':
                 bn = bn[:-4]
-            if cat:
-                out_fn = bn + '.mat'
-            else:
-                out_fn = bn + '_proc.mat'
-            d.save(out_fn)
+            fns_out.append(bn + '_proc' + ext)
+    _process_files(filetype, fn, fns_out, pipeline, n_jobs=n_jobs, cache=cache, out_of_core=out_of_core)
+
+
+def _run_pipeline(pipeline, filetype, fns, load_input, cache=None):
+    """Run the pipeline on the data from load_input, using the cache if there is one"""
+    if cache is None:
+        dat = load_input()
+        pipeline.run(dat)
+    else:
+        dat = cache.run(pipeline, cache.input_key(filetype, fns), load_input)
+        dat.fn = fns[0]
+    return dat
+
+
+def _process_file(filetype, fn, fn_out, pipeline, capture=False, cache=None, out_of_core=False):
+    """Load, process, and save a single file
+
+    Errors are caught, so that one bad file does not stop a batch.
+
+    Returns
+    -------
+    error: str
+        Description of what went wrong, or None if nothing did
+    log: str
+        Everything printed while processing the file, if capture, otherwise empty
+    seconds: float
+        Time taken
+    """
+    start = time.time()
+    log = io.StringIO()
+    if capture:
+        with redirect_stdout(log):
+            error = _try_process_file(filetype, fn, fn_out, pipeline, cache, out_of_core)
+    else:
+        error = _try_process_file(filetype, fn, fn_out, pipeline, cache, out_of_core)
+    return error, log.getvalue(), time.time() - start
+
+
+def _try_process_file(filetype, fn, fn_out, pipeline, cache, out_of_core):
+    """Process a file, printing the traceback and returning a description of any error"""
+    try:
+        if out_of_core:
+            run_out_of_core(pipeline, load(filetype, fn, memmap=True)[0], fn_out)
+        else:
+            dat = _run_pipeline(pipeline, filetype, [fn], lambda: load(filetype, fn, memmap=True)[0], cache)
+            dat.save(fn_out)
+    except Exception as err:
+        traceback.print_exc(file=sys.stdout)
+        return '{:s}: {:s}'.format(type(err).__name__, str(err))
+    return None
+
+
+def _process_files(filetype, fns, fns_out, pipeline, n_jobs=1, cache=None, out_of_core=False):
+    """Run _process_file on each file, in a pool of processes if n_jobs > 1
+
+    Only n_jobs files are in flight at once. The output of each file is printed in one block
+    when that file finishes, then a summary of the whole batch. Every file is attempted, and
+    any failures are raised together at the end.
+    """
+    start = time.time()
+    results = [None for f in fns]
+    if n_jobs > 1 and len(fns) > 1:
+        with ProcessPoolExecutor(max_workers=n_jobs) as executor:
+            todo = list(range(len(fns)))[::-1]
+            pending = {}
+            while todo or pending:
+                while todo and len(pending) < n_jobs:
+                    i = todo.pop()
+                    pending[executor.submit(_process_file, filetype, fns[i], fns_out[i], pipeline, True, cache,
+                                             out_of_core)] = i
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    i = pending.pop(future)
+                    results[i] = future.result()
+                    print('==> {:s} <=='.format(fns[i]))
+                    print(results[i][1], end='')
+    else:
+        for i, (f, f_out) in enumerate(zip(fns, fns_out)):
+            results[i] = _process_file(filetype, f, f_out, pipeline, cache=cache, out_of_core=out_of_core)
+
+    failures = [f for f, result in zip(fns, results) if result[0] is not None]
+    print('Processed {:d} of {:d} files in {:.1f} s'.format(len(fns) - len(failures), len(fns), time.time() - start))
+    for f, f_out, (error, _, seconds) in zip(fns, fns_out, results):
+        if error is None:
+            print('    {:s} -> {:s} ({:.1f} s)'.format(f, f_out, seconds))
+        else:
+            print('    {:s} failed ({:s})'.format(f, error))
+    if failures:
+        raise ImpdarError('Failed to process {:d} of {:d} files: {:s}'.format(
+            len(failures), len(fns), ', '.join(failures)))
 
 
 def process(RadarDataList, interp=None, rev=False, vbp=None, hfilt=None, ahfilt=False, nmo=None, crop=None, hcrop=None, restack=None, denoise=None, migrate=None, **kwargs):
     """Perform one or more processing steps on a list of RadarData objects
 
+    The steps are run through a :class:`~impdar.lib.Pipeline.Pipeline`, so crops go first
+    where that does not change the result, and most steps modify the data in place.
+
     Parameters
     ----------
     RadarDataList: list of strs
@@ -95,97 +233,21 @@ def process(RadarDataList, interp=None, rev=False, vbp=None, hfilt=None, ahfilt=
         If True, we did something, if False we didn't
     """
 
-    # first some argument checking so we don't crash later
-    if crop is not None:
-        try:
-            if crop[1] not in ['top', 'bottom']:
-                raise ValueError('First element of crop must be in ["top", "bottom"]')
-            if crop[2] not in ['snum', 'twtt', 'depth']:
-                raise ValueError('Second element of crop must be in ["snum", "twtt", "depth"]')
-            try:
-                crop = (float(crop[0]), crop[1], crop[2])
-            except ValueError:
-                raise ValueError('Third element of crop must be convertible to a float')
-        except TypeError:
-            raise TypeError('Crop must be subscriptible')
-
-    if hcrop is not None:
-        try:
-            if crop[1] not in ['left', 'right']:
-                raise ValueError('First element of crop must be in ["left", "right"]')
-            if crop[2] not in ['tnum', 'dist']:
-                raise ValueError('Second element of crop must be in ["tnum", "dist"]')
-            try:
-                crop = (float(crop[0]), crop[1], crop[2])
-            except ValueError:
-                raise ValueError('Third element of crop must be convertible to a float')
-        except TypeError:
-            raise TypeError('Crop must be subscriptible')
-
-    done_stuff = False
-    # hcrop first to reduce computation
-    if hcrop is not None:
-        for dat in RadarDataList:
-            dat.hcrop(*hcrop)
-        done_stuff = True
-
-    if restack is not None:
-        for dat in RadarDataList:
-            if type(restack) in [list, tuple]:
-                restack = int(restack[0])
-            dat.restack(restack)
-        done_stuff = True
-
-    if rev:
-        for dat in RadarDataList:
-            dat.reverse()
-        done_stuff = True
-
-    if vbp is not None:
-        for dat in RadarDataList:
-            dat.vertical_band_pass(*vbp)
-        done_stuff = True
-
-    if hfilt is not None:
-        for dat in RadarDataList:
-            dat.hfilt(ftype='hfilt', bounds=hfilt)
-        done_stuff = True
-
-    if ahfilt:
-        for dat in RadarDataList:
-            dat.hfilt(ftype='adaptive')
-        done_stuff = True
-
-    if nmo is not None:
-        if type(nmo) == float:
-            print('One nmo value given. Assuming that this is the separation. Uice=1.6')
-            nmo = (nmo, 1.6)
-        for dat in RadarDataList:
-            dat.nmo(*nmo)
-        done_stuff = True
-
-    if denoise is not None:
-        for dat in RadarDataList:
-            dat.denoise(*denoise)
-        done_stuff = True
-
-    if interp is not None:
-        interpdeep(RadarDataList, float(interp[0]), interp[1])
-        done_stuff = True
-
-    # Crop after nmo so that we have nmo_depth available for cropping if desired
-    if crop is not None:
-        for dat in RadarDataList:
-            dat.crop(*crop)
-        done_stuff = True
-
-    if migrate is not None:
-        dat.migrate(mtype='stolt')
-        done_stuff = True
-
-    if not done_stuff:
-        return False
-    return True
+    pipeline = Pipeline.from_kwargs(interp=interp, rev=rev, vbp=vbp, hfilt=hfilt, ahfilt=ahfilt, nmo=nmo,
+                                    crop=crop, hcrop=hcrop, restack=restack, denoise=denoise, migrate=migrate)
+    for dat in RadarDataList:
+        pipeline.run(dat)
+    return len(pipeline) > 0
+
+
+def _concat_metadata(radar_data):
+    """Shallow copy of the first of radar_data, with the size and distance of them concatenated"""
+    from copy import copy
+    out = copy(radar_data[0])
+    out.tnum = sum(int(dat.tnum) for dat in radar_data)
+    dists = np.hstack((np.array([0]), np.cumsum([dat.dist[-1] for dat in radar_data])))
+    out.dist = np.hstack([dat.dist + dist for dat, dist in zip(radar_data, dists)])
+    return out
 
 
 def concat(radar_data):
@@ -194,7 +256,8 @@ def concat(radar_data):
     Parameters
     ----------
     radar_data: list of RadarData
-        Objects to concatenate
+        Objects to concatenate. The data of each are read straight into the output,
+        so lazily loaded inputs are only read one at a time.
 
     Returns
     -------
@@ -203,16 +266,19 @@ def concat(radar_data):
     """
     from copy import deepcopy
     # let's do some checks to make sure we are consistent here
-    out = deepcopy(radar_data[0])
-
     for dat in radar_data[1:]:
-        if out.snum != dat.snum:
+        if radar_data[0].snum != dat.snum:
             raise ValueError('Need the same number of vertical samples in each file')
-        if not np.all(out.travel_time == dat.travel_time):
+        if not np.all(radar_data[0].travel_time == dat.travel_time):
             raise ValueError('Need matching travel time vectors')
 
-    out.data = np.hstack([dat.data for dat in radar_data])
-    tnums = np.hstack((np.array([0]), np.cumsum([dat.tnum for dat in radar_data])))
+    # Copy everything but the data, which are read into the output one file at a time
+    out = deepcopy(radar_data[0], {id(radar_data[0].data): None})
+    tnums = np.hstack((np.array([0]), np.cumsum([int(dat.tnum) for dat in radar_data])))
+    out.data = np.empty((int(radar_data[0].snum), tnums[-1]),
+                        dtype=np.result_type(*[dat.data.dtype for dat in radar_data]))
+    for dat, first, last in zip(radar_data, tnums[:-1], tnums[1:]):
+        out.data[:, first:last] = dat.data[:, :]
     out.tnum = out.data.shape[1]
     out.trace_num = np.hstack([dat.trace_num + tnum for dat, tnum in zip(radar_data, tnums)])
     dists = np.hstack((np.array([0]), np.cumsum([dat.dist[-1] for dat in radar_data])))
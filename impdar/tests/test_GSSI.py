@@ -12,7 +12,9 @@ Make sure that we can successfully read gssi input files
 
 import os
 import unittest
+import numpy as np
 from impdar.lib.load import load_gssi
+from impdar.lib.LazyData import LazyData
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -31,6 +33,31 @@ class TestGSSI(unittest.TestCase):
     def test_load4000_partialDZG(self):
         load_gssi.load_gssi(os.path.join(THIS_DIR, 'input_data', 'test_gssi_partialgps.DZT'))
 
+    def test_load_memmap(self):
+        dat = load_gssi.load_gssi(os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT'))
+        dat_mm = load_gssi.load_gssi(os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT'), memmap=True)
+        self.assertIsInstance(dat_mm.data, LazyData)
+        self.assertEqual(dat_mm.data.shape, dat.data.shape)
+        self.assertTrue(np.all(dat_mm.data[:, 10:20] == dat.data[:, 10:20]))
+        self.assertTrue(np.all(dat_mm.data[:, -1] == dat.data[:, -1]))
+        self.assertFalse(dat_mm.data.materialized)
+        self.assertTrue(np.all(dat_mm.data * 2 == dat.data * 2))
+
+        # writing reads everything in
+        dat_mm.data[0, 0] = 0
+        self.assertTrue(dat_mm.data.materialized)
+        self.assertEqual(dat_mm.data[0, 0], 0)
+        self.assertTrue(np.all(dat_mm.data[:, 1:] == dat.data[:, 1:]))
+
+    def test_load_trace_range(self):
+        dat = load_gssi.load_gssi(os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT'))
+        for memmap in [False, True]:
+            dat_part = load_gssi.load_gssi(os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT'), trace_range=(10, 30), memmap=memmap)
+            self.assertEqual(dat_part.tnum, 20)
+            self.assertTrue(np.all(dat_part.data[:, :] == dat.data[:, 10:30]))
+            self.assertTrue(np.all(dat_part.trace_num == dat.trace_num[10:30]))
+            self.assertTrue(np.allclose(dat_part.lat, dat.lat[10:30]))
+
     def test_save_withDZG(self):
         load_gssi.load_gssi(os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT')).save(os.path.join(THIS_DIR, 'input_data', 'test_gssi_raw.mat'))
         os.remove(os.path.join(THIS_DIR, 'input_data', 'test_gssi_raw.mat'))
@@ -11,38 +11,121 @@ Make sure that we can successfully read gssi input files
 """
 
 import os
+import pickle
+import tempfile
 import unittest
 import numpy as np
-from impdar.lib.load import load_mcords_nc, load_mcords_mat
+from impdar.lib.load import load_mcords
+from impdar.lib.LazyData import LazyData
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
 
 class TestMCoRDS_NC(unittest.TestCase):
 
-    @unittest.skipIf(not load_mcords_nc.NC, 'No netcdf on this version')
+    @unittest.skipIf(not load_mcords.NC, 'No netcdf on this version')
     def test_loadnc(self):
-        dat = load_mcords_nc.load_mcords_nc(os.path.join(THIS_DIR, 'input_data', 'zeros_mcords.nc'))
+        dat = load_mcords.load_mcords_nc(os.path.join(THIS_DIR, 'input_data', 'zeros_mcords.nc'))
         self.assertTrue(np.all(dat.data == 0.))
 
-    @unittest.skipIf(load_mcords_nc.NC, 'NETCDF on this version')
+    @unittest.skipIf(load_mcords.NC, 'NETCDF on this version')
     def test_loadnc_failure(self):
         with self.assertRaises(ImportError):
-            load_mcords_nc.load_mcords_nc(os.path.join(THIS_DIR, 'input_data', 'zeros_mcords.nc'))
+            load_mcords.load_mcords_nc(os.path.join(THIS_DIR, 'input_data', 'zeros_mcords.nc'))
+
+    @unittest.skipIf(not load_mcords.NC, 'No netcdf on this version')
+    def test_loadnc_window(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'frame.nc')
+            amp = _write_nc(fn, 40, 30)
+
+            dat = load_mcords.load_mcords_nc(fn)
+            self.assertTrue(np.all(dat.data == amp))
+
+            dat = load_mcords.load_mcords_nc(fn, trace_range=(2, 20), sample_range=(5, 35), decimate=3)
+            self.assertEqual(dat.data.shape, (30, 6))
+            self.assertTrue(np.all(dat.data == amp[5:35, 2:20:3]))
+            self.assertTrue(np.all(dat.trace_num == np.arange(3, 21, 3)))
+            self.assertEqual(dat.lat.shape, (6, ))
+            self.assertEqual(dat.travel_time.shape[0], 30)
+
+            with self.assertRaises(ValueError):
+                load_mcords.load_mcords_nc(fn, decimate=0)
+
+    @unittest.skipIf(not load_mcords.NC, 'No netcdf on this version')
+    def test_loadnc_lazy(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'frame.nc')
+            amp = _write_nc(fn, 40, 30)
+
+            dat = load_mcords.load_mcords_nc(fn, trace_range=(2, 20), sample_range=(5, 35), decimate=3, lazy=True)
+            self.assertTrue(isinstance(dat.data, LazyData))
+            self.assertEqual(dat.data.shape, (30, 6))
+            self.assertTrue(np.all(dat.data[:, 1:5:2] == amp[5:35, 2:20:3][:, 1:5:2]))
+            self.assertTrue(np.all(dat.data[:, ::-1] == amp[5:35, 2:20:3][:, ::-1]))
+            self.assertTrue(np.all(dat.data[3, 4] == amp[8, 14]))
+
+            # the lazy data can go to another process
+            data = pickle.loads(pickle.dumps(dat.data))
+            self.assertTrue(np.all(np.asarray(data) == amp[5:35, 2:20:3]))
+
+            # and the file is closed with the window
+            fin = dat.data._raw._file
+            self.assertTrue(fin.isopen())
+            dat.data._raw.close()
+            self.assertFalse(fin.isopen())
+            dat.data._raw.close()
+
+    @unittest.skipIf(not load_mcords.NC, 'No netcdf on this version')
+    def test_loadnc_mask_single(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'frame.nc')
+            _write_nc(fn, 40, 30)
+            from netCDF4 import default_fillvals
+            dst = load_mcords.Dataset(fn, 'a')
+            dst.variables['amplitude'][5, 2] = default_fillvals['f8']
+            dst.close()
+
+            # Lazy and eager loads give the same, unmasked, amplitudes
+            dat = load_mcords.load_mcords_nc(fn)
+            dat_lazy = load_mcords.load_mcords_nc(fn, lazy=True)
+            self.assertFalse(isinstance(dat.data, np.ma.MaskedArray))
+            self.assertTrue(np.all(dat.data == np.asarray(dat_lazy.data)))
+
+            dat = load_mcords.load_mcords_nc(fn, trace_range=(3, 4))
+            self.assertEqual(dat.tnum, 1)
+            dat = load_mcords.load_mcords_nc(fn, trace_range=(3, 6), decimate=5)
+            self.assertEqual(dat.tnum, 1)
+
+
+def _write_nc(fn, snum, tnum):
+    """Write a small netcdf file laid out like the NSIDC MCoRDS frames"""
+    amp = np.random.RandomState(0).rand(snum, tnum)
+    dst = load_mcords.Dataset(fn, 'w')
+    dst.createDimension('fasttime', snum)
+    dst.createDimension('time', tnum)
+    dst.createVariable('amplitude', 'f8', ('fasttime', 'time'))[:] = amp
+    dst.createVariable('fasttime', 'f8', ('fasttime', ))[:] = np.arange(snum) * 0.1
+    for var in ['lat', 'lon']:
+        dst.createVariable(var, 'f8', ('time', ))[:] = np.linspace(0., 1., tnum)
+    dst.createVariable('time', 'f8', ('time', ))[:] = np.arange(tnum) * 0.1
+    dst.variables['time'].units = 'seconds since 2019-01-01 00:00:00'
+    dst.close()
+    return amp
 
 
 class TestMCoRDS_MAT(unittest.TestCase):
 
     def test_loadmat(self):
-        dat = load_mcords_mat.load_mcords_mat(os.path.join(THIS_DIR, 'input_data', 'zeros_mcords_mat.mat'))
+        dat = load_mcords.load_mcords_mat(os.path.join(THIS_DIR, 'input_data', 'zeros_mcords_mat.mat'))
         self.assertTrue(np.allclose(dat.data, 0.))
 
     def test_loadbadmat(self):
         with self.assertRaises(KeyError):
-            load_mcords_mat.load_mcords_mat(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'))
+            load_mcords.load_mcords_mat(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'))
 
         with self.assertRaises(KeyError):
-            load_mcords_mat.load_mcords_mat(os.path.join(THIS_DIR, 'input_data', 'nonimpdar_matlab.mat'))
+            load_mcords.load_mcords_mat(os.path.join(THIS_DIR, 'input_data', 'nonimpdar_matlab.mat'))
 
 
 if __name__ == '__main__':
@@ -15,13 +15,22 @@ Mar 12 2019
 """
 
 import os
+import sys
+import shutil
+import tempfile
 import unittest
 import numpy as np
 import subprocess as sp
+from copy import deepcopy
+if sys.version_info[0] >= 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+from scipy.interpolate import griddata
 
 from impdar.lib import migrationlib
-from impdar.lib.load import load_segy
 from impdar.lib.NoInitRadarData import NoInitRadarData
+from impdar.lib.ImpdarError import ImpdarError
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 OUT_DIR = os.path.join(THIS_DIR, 'Migration_tests')
@@ -91,18 +100,131 @@ class TestMigration(unittest.TestCase):
         with self.assertRaises(ValueError):
             migrationlib.getVelocityProfile(data, 1.68e8 * np.ones((8, 4)))
 
+    def test_getVelocityProfileCache(self):
+        vels_in = np.genfromtxt(os.path.join(THIS_DIR, 'input_data', 'velocity_lateral.txt'))
+        data = NoInitRadarData(big=True)
+        vmig = migrationlib.getVelocityProfile(data, vels_in)
+        self.assertFalse(vmig.flags.writeable)
+        self.assertIs(migrationlib.getVelocityProfile(data, vels_in.copy()), vmig)
+        self.assertTrue(np.allclose(migrationlib.getVelocityProfile(data, vels_in, cache=False), vmig))
+
+        # compare one trace against direct integration of the slowness
+        zs = np.linspace(np.min(vels_in[:, 0]) * data.travel_time[0],
+                         np.max(vels_in[:, 0]) * data.travel_time[-1], data.snum) / 2.0e6
+        XS, ZS = np.meshgrid(data.dist, zs)
+        VS = griddata(vels_in[:, [2, 1]], vels_in[:, 0], (XS, ZS), method='nearest')
+        tofz = 2. * np.array([np.trapz(1. / VS[:j, 3], zs[:j]) for j in range(data.snum)])
+        zoft = np.interp(data.travel_time / 1.0e6, tofz, zs)
+        self.assertTrue(np.allclose(vmig[:, 3], 2. * np.gradient(zoft, data.travel_time / 1.0e6)))
+
+        # new geometry means a new profile
+        data.dist = data.dist * 2.
+        self.assertIsNot(migrationlib.getVelocityProfile(data, vels_in), vmig)
+
     def test_Stolt(self):
         data = NoInitRadarData(big=True)
         data = migrationlib.migrationStolt(data)
 
+    def test_StoltPad(self):
+        data = NoInitRadarData(big=True)
+        data.data = np.random.rand(data.snum, data.tnum)
+        snum = data.snum
+        data = migrationlib.migrationStolt(data, pad=True)
+        self.assertEqual(data.data.shape, (snum // 2, data.tnum))
+        self.assertEqual(data.snum, snum // 2)
+        self.assertEqual(len(data.travel_time), data.snum)
+
+        # the same through RadarData.migrate
+        data = NoInitRadarData(big=True)
+        data.data = np.random.RandomState(0).rand(data.snum, data.tnum)
+        direct = migrationlib.migrationStolt(deepcopy(data), htaper=10, vtaper=10, pad=True)
+        data.migrate('stolt', htaper=10, vtaper=10, pad=True)
+        self.assertTrue(np.allclose(data.data, direct.data))
+
     def test_Kirchhoff(self):
         data = NoInitRadarData(big=True)
         data = migrationlib.migrationKirchhoff(data)
 
+    def test_KirchhoffMatchesSummation(self):
+        for nearfield in [False, True]:
+            for uniform in [True, False]:
+                data = NoInitRadarData(big=True)
+                data.data = np.random.rand(data.snum, data.tnum)
+                if not uniform:
+                    data.dist = np.cumsum(np.random.rand(data.tnum) * 2.)
+                target = _kirchhoff_reference(data, 1.69e8, nearfield)
+                # a tiny memory limit forces blocking
+                data = migrationlib.migrationKirchhoff(data, nearfield=nearfield, mem_limit=1.0e3)
+                self.assertTrue(np.allclose(data.data, target))
+
+    def test_KirchhoffAperture(self):
+        data = NoInitRadarData(big=True)
+        data.data = np.random.rand(data.snum, data.tnum)
+        data_full = migrationlib.migrationKirchhoff(deepcopy(data))
+        data_wide = migrationlib.migrationKirchhoff(deepcopy(data), max_offset=1.0e6)
+        self.assertTrue(np.allclose(data_full.data, data_wide.data))
+
+        # With no aperture, each output is just from its own trace
+        data_narrow = deepcopy(data)
+        data_narrow.data[:, 1:] = 0.
+        data_narrow = migrationlib.migrationKirchhoff(data_narrow, max_offset=0.)
+        self.assertTrue(np.all(data_narrow.data[:, 1:] == 0.))
+
     def test_PhaseShiftConstant(self):
         data = NoInitRadarData(big=True)
         data = migrationlib.migrationPhaseShift(data)
 
+    def test_PhaseShiftConstantBlocks(self):
+        data = NoInitRadarData(big=True)
+        data.data = np.random.rand(data.snum, data.tnum)
+        data_blocked = deepcopy(data)
+        data = migrationlib.migrationPhaseShift(data)
+        # force one output time per block
+        data_blocked = migrationlib.migrationPhaseShift(data_blocked, mem_limit=1.0)
+        self.assertTrue(np.allclose(data.data, data_blocked.data))
+
+    def test_ParallelSlabs(self):
+        data = NoInitRadarData(big=True)
+        data.data = np.random.rand(data.snum, data.tnum)
+        data.travel_time = data.travel_time / 10.
+        for func, kwargs in [(migrationlib.migrationStolt, {}),
+                             (migrationlib.migrationPhaseShift, {}),
+                             (migrationlib.migrationPhaseShift, {'vel_fn': os.path.join(THIS_DIR, 'input_data', 'velocity_layers.txt')})]:
+            serial = func(deepcopy(data), **kwargs)
+            parallel = func(deepcopy(data), n_jobs=3, **kwargs)
+            self.assertTrue(np.allclose(serial.data, parallel.data))
+            # without concurrent.futures the slabs run one after another
+            with patch('impdar.lib.migrationlib.FUTURES', False):
+                parallel = func(deepcopy(data), n_jobs=3, **kwargs)
+            self.assertTrue(np.allclose(serial.data, parallel.data))
+
+        # Laterally varying velocities go through the finite-difference correction.
+        # The thin-lens term divides by zero where the velocity is lowest, so the image is
+        # not finite; it should still be the same in serial and parallel.
+        data = NoInitRadarData(big=True)
+        data.data = np.random.rand(data.snum, data.tnum)
+        kwargs = {'vel_fn': os.path.join(THIS_DIR, 'input_data', 'velocity_lateral.txt')}
+        serial = migrationlib.migrationPhaseShift(deepcopy(data), **kwargs)
+        parallel = migrationlib.migrationPhaseShift(deepcopy(data), n_jobs=3, **kwargs)
+        self.assertTrue(np.allclose(serial.data, parallel.data, equal_nan=True))
+
+        # The finite-difference step keeps a separate state for each frequency, so running it on
+        # slabs of frequencies, or one frequency at a time, gives the same as all at once
+        rand = np.random.RandomState(0)
+        stencil = migrationlib.Sp_Matr(data.tnum, -2, 1, 1).tocsr()
+        vs = 1.5e8 + 1.0e7 * rand.rand(data.tnum)
+        w = np.atleast_2d(np.linspace(1.0e6, 1.0e7, 6)).transpose()
+        FFX = rand.rand(6, data.tnum) + 1j * rand.rand(6, data.tnum)
+        FFX_last = rand.rand(6, data.tnum) + 1j * rand.rand(6, data.tnum)
+        whole = migrationlib.fourierFiniteDiff(data, vs, w, FFX, FFX_last, stencil)
+        self.assertTrue(np.all(np.isfinite(whole)))
+        slabs = np.vstack([migrationlib.fourierFiniteDiff(data, vs, w[sl], FFX[sl], FFX_last[sl], stencil)
+                           for sl in [slice(0, 2), slice(2, 6)]])
+        self.assertTrue(np.allclose(whole, slabs))
+        for i in range(6):
+            self.assertTrue(np.allclose(whole[i], migrationlib.fourierFiniteDiff(
+                data, vs, w[i, 0], FFX[i], FFX_last[i], stencil)))
+
     def test_PhaseShiftVariable(self):
         data = NoInitRadarData(big=True)
         data.travel_time = data.travel_time / 10.
@@ -116,7 +238,36 @@ class TestMigration(unittest.TestCase):
         data = NoInitRadarData(big=True)
         data = migrationlib.migrationPhaseShift(data, vel_fn=os.path.join(THIS_DIR, 'input_data', 'velocity_lateral.txt'))
 
-    @unittest.skipIf(sp.Popen(['which', 'sumigtk']).wait() != 0 or (not load_segy.SEGY), 'SeisUnix not found')
+    def test_TimeWavenumber(self):
+        data = NoInitRadarData(big=True)
+        data = migrationlib.migrationTimeWavenumber(data)
+        self.assertEqual(data.data.shape, (data.snum, data.tnum))
+
+        # a diffraction hyperbola should collapse to its apex
+        data = _diffraction_hyperbola()
+        hyp_spread = np.sum(np.abs(data.data) > 0.5 * np.max(np.abs(data.data)))
+        data = migrationlib.migrationTimeWavenumber(data, vel=1.69e8, htaper=10, vtaper=10)
+        apex = np.unravel_index(np.argmax(np.abs(data.data)), data.data.shape)
+        self.assertTrue(abs(apex[0] - 75) <= 1)
+        self.assertEqual(apex[1], 50)
+        self.assertTrue(np.sum(np.abs(data.data) > 0.5 * np.max(np.abs(data.data))) < hyp_spread / 10)
+
+        # refine gets through RadarData.migrate
+        data = _diffraction_hyperbola()
+        direct = migrationlib.migrationTimeWavenumber(deepcopy(data), vel=1.69e8, htaper=10, vtaper=10, refine=1)
+        data.migrate('tk', vel=1.69e8, htaper=10, vtaper=10, refine=1)
+        self.assertTrue(np.allclose(data.data, direct.data))
+
+    def test_TimeWavenumberVariable(self):
+        data = NoInitRadarData(big=True)
+        data.travel_time = data.travel_time / 10.
+        data = migrationlib.migrationTimeWavenumber(data, vel_fn=os.path.join(THIS_DIR, 'input_data', 'velocity_layers.txt'))
+
+        data = NoInitRadarData(big=True)
+        with self.assertRaises(ValueError):
+            data = migrationlib.migrationTimeWavenumber(data, vel_fn=os.path.join(THIS_DIR, 'input_data', 'velocity_lateral.txt'))
+
+    @unittest.skipIf(sp.Popen(['which', 'sumigtk']).wait() != 0, 'SeisUnix not found')
     def test_sumigtk(self):
         data = NoInitRadarData(big=True)
         data.dt = 1.0e-9
@@ -124,7 +275,7 @@ class TestMigration(unittest.TestCase):
         data.fn = os.path.join(THIS_DIR, 'input_data', 'rectangle_sumigtk.mat')
         migrationlib.migrationSeisUnix(data)
 
-    @unittest.skipIf(sp.Popen(['which', 'sustolt']).wait() != 0 or (not load_segy.SEGY), 'SeisUnix not found')
+    @unittest.skipIf(sp.Popen(['which', 'sustolt']).wait() != 0, 'SeisUnix not found')
     def test_sustolt(self):
         data = NoInitRadarData(big=True)
         data.dt = 1.0e-9
@@ -132,14 +283,47 @@ class TestMigration(unittest.TestCase):
         data.fn = os.path.join(THIS_DIR, 'input_data', 'rectangle_sustolt.mat')
         migrationlib.migrationSeisUnix(data)
 
-    @unittest.skipIf(sp.Popen(['which', 'sustolt']).wait() != 0 or load_segy.SEGY, 'Test of edge case')
-    def test_sustolt_nosegy(self):
+    @unittest.skipIf(os.name != 'posix', 'Fake SeisUnix script needs a posix shell')
+    def test_seisunix_pipe(self):
+        # A stand-in for sumigtk that passes the SU stream through, scaling the samples
+        bin_dir = tempfile.mkdtemp()
+        with open(os.path.join(bin_dir, 'sumigtk'), 'w') as fout:
+            fout.write('#!' + sys.executable + '\n')
+            fout.write('import sys, numpy as np\n')
+            fout.write('buf = np.frombuffer(sys.stdin.buffer.read(), dtype=np.uint8).copy()\n')
+            fout.write('ns = int(buf[114:116].view(np.uint16)[0])\n')
+            fout.write('traces = buf.reshape((-1, 240 + 4 * ns))\n')
+            fout.write('traces[:, 240:] = (traces[:, 240:].copy().view(np.float32) * 2.).view(np.uint8)\n')
+            fout.write('sys.stdout.buffer.write(traces.tobytes())\n')
+        os.chmod(os.path.join(bin_dir, 'sumigtk'), 0o755)
+
         data = NoInitRadarData(big=True)
+        data.data = np.random.rand(data.snum, data.tnum)
         data.dt = 1.0e-9
-        data.travel_time = data.travel_time * 1.0e-9
-        data.fn = os.path.join(THIS_DIR, 'input_data', 'rectangle_sustolt.mat')
-        with self.assertRaises(ImportError):
-            migrationlib.migrationSeisUnix(data)
+        # we should not need a filename
+        data.fn = None
+        target = 2. * data.data.astype(np.float32)
+        cwd_files = os.listdir(os.getcwd())
+        with patch.dict(os.environ, {'PATH': bin_dir + os.pathsep + os.environ['PATH']}):
+            data = migrationlib.migrationSeisUnix(data, mtype='sumigtk')
+        self.assertTrue(np.allclose(data.data, target))
+        # nothing left lying around
+        self.assertEqual(sorted(cwd_files), sorted(os.listdir(os.getcwd())))
+
+        # non-zero exit codes are errors
+        with open(os.path.join(bin_dir, 'sumigtk'), 'w') as fout:
+            fout.write('#!' + sys.executable + '\n')
+            fout.write('import sys\n')
+            fout.write('sys.exit(1)\n')
+        with patch.dict(os.environ, {'PATH': bin_dir + os.pathsep + os.environ['PATH']}):
+            with self.assertRaises(ImpdarError):
+                migrationlib.migrationSeisUnix(data, mtype='sumigtk')
+
+            # sample intervals too long for the 16-bit SU header field
+            data.dt = 1.0e-7
+            with self.assertRaises(ValueError):
+                migrationlib.migrationSeisUnix(data, mtype='sumigtk')
+        shutil.rmtree(bin_dir)
 
     @unittest.skipIf(sp.Popen(['which', 'sustolt']).wait() == 0, 'Test for no SeisUnix')
     def test_sustolt_seisunix(self):
@@ -156,5 +340,49 @@ class TestMigration(unittest.TestCase):
                 os.remove(os.path.join(THIS_DIR, 'input_data', 'rectangle_' + suff + '.mat'))
 
 
+def _diffraction_hyperbola(snum=150, tnum=100, vel=1.69e8):
+    """A smoothed diffraction from a point at the center of the profile, halfway down"""
+    data = NoInitRadarData(big=True)
+    data.data = np.zeros((snum, tnum))
+    data.snum, data.tnum = snum, tnum
+    data.dt = 1.0e-9
+    data.travel_time = np.arange(snum) * data.dt * 1.0e6
+    data.trace_int = 0.25
+    data.dist = np.arange(tnum) * data.trace_int
+    x = data.dist - data.dist[tnum // 2]
+    t = np.sqrt(((snum // 2) * data.dt)**2. + (2. * x / vel)**2.) / data.dt
+    for i in range(tnum):
+        if t[i] < snum - 1:
+            data.data[int(t[i]), i] = 1. - t[i] % 1
+            data.data[int(t[i]) + 1, i] = t[i] % 1
+    data.data = np.apply_along_axis(np.convolve, 0, data.data, np.exp(-np.arange(-6, 7)**2. / 8.), mode='same')
+    return data
+
+
+def _kirchhoff_reference(dat, vel, nearfield):
+    """Brute-force diffraction summation, one output point at a time"""
+    tt_sec = dat.travel_time / 1.0e6
+    gradD = np.gradient(dat.data, tt_sec, axis=0)
+    zs = vel * tt_sec / 2.
+    out = np.zeros_like(dat.data)
+    for xi in range(dat.tnum):
+        for ti in range(dat.snum):
+            rs = np.sqrt((dat.dist - dat.dist[xi])**2. + zs[ti]**2.)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                costheta = zs[ti] / rs
+            Didx = np.argmin(np.abs(np.atleast_2d(tt_sec).transpose() - 2. * rs / vel), axis=0)
+            outside = 2. * rs / vel > np.max(tt_sec)
+            gradDhyp = gradD[Didx, np.arange(dat.tnum)]
+            gradDhyp[outside] = 0.
+            integral = np.nansum(gradDhyp * costheta / vel)
+            if nearfield:
+                Dhyp = dat.data[Didx, np.arange(dat.tnum)]
+                Dhyp[outside] = 0.
+                with np.errstate(invalid='ignore', divide='ignore'):
+                    integral += np.nansum(Dhyp * costheta / rs**2.)
+            out[ti, xi] = integral / (2. * np.pi)
+    return out
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -11,7 +11,10 @@ Make sure that we can successfully read gssi input files
 """
 
 import os
+import shutil
+import tempfile
 import unittest
+import numpy as np
 from impdar.lib.load import load_pulse_ekko
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -22,6 +25,27 @@ class Dummy(unittest.TestCase):
     def test_load_pe(self):
         load_pulse_ekko.load_pe(os.path.join(THIS_DIR, 'input_data', 'test_pe.DT1'))
 
+    def test_load_pe_records(self):
+        # write a DT1 to go with the test header and gps files
+        tnum, snum = 2771, 3000
+        records = np.zeros((tnum, ), dtype=load_pulse_ekko._dt1_dtype(snum, np.int16))
+        records['header'][:, 0] = np.arange(tnum) + 1
+        records['header'][:, 9] = 2.
+        records['trace'] = np.random.RandomState(0).randint(-1000, 1000, size=(tnum, snum))
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for ext in ['.HD', '.GPS']:
+                shutil.copy(os.path.join(THIS_DIR, 'input_data', 'test_pe' + ext), tmpdir)
+            records.tofile(os.path.join(tmpdir, 'test_pe.DT1'))
+            pe_data = load_pulse_ekko.load_pe(os.path.join(tmpdir, 'test_pe.DT1'))
+
+        self.assertEqual(pe_data.data.shape, (snum, tnum))
+        self.assertEqual(pe_data.data.dtype, np.int16)
+        for i in [0, 100, tnum - 1]:
+            trace = records['trace'][i].astype(float)
+            self.assertTrue(np.all(pe_data.data[:, i] == (trace - np.mean(trace[:100])).astype(np.int16)))
+        self.assertTrue(np.all(pe_data.traceheaders.trace_numbers[0, :] == np.arange(tnum) + 1))
+        self.assertTrue(np.all(pe_data.traceheaders.pos[0, :] == 2.))
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -13,6 +13,8 @@ import os
 import unittest
 import numpy as np
 from impdar.lib.RadarData import RadarData
+from impdar.lib.LazyData import LazyData
+from impdar.lib.RadarData._RadarDataProcessing import restack_stream
 from impdar.lib import process
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -27,6 +29,24 @@ class TestRadarDataLoading(unittest.TestCase):
     def test_badread(self):
         with self.assertRaises(KeyError):
             data = RadarData(os.path.join(THIS_DIR, 'input_data', 'nonimpdar_matlab.mat'))
+        with self.assertRaises(KeyError):
+            data = RadarData(os.path.join(THIS_DIR, 'input_data', 'nonimpdar_matlab.mat'), load_data=False)
+
+    def test_ReadMetadata(self):
+        data = RadarData(os.path.join(THIS_DIR, 'input_data', 'small_data_picks.mat'))
+        meta = RadarData(os.path.join(THIS_DIR, 'input_data', 'small_data_picks.mat'), load_data=False)
+        self.assertTrue(isinstance(meta.data, LazyData))
+        self.assertFalse(meta.data.materialized)
+        self.assertEqual(meta.data.shape, (20, 40))
+        self.assertEqual(meta.data_dtype, data.data.dtype)
+        self.assertTrue(np.all(meta.lat == data.lat))
+        self.assertEqual(meta.picks.picknums, data.picks.picknums)
+        self.assertFalse(meta.data.materialized)
+
+        # and now read the data
+        self.assertTrue(np.all(meta.data[:, 3] == data.data[:, 3]))
+        self.assertTrue(meta.data.materialized)
+        self.assertTrue(np.all(meta.data == data.data))
 
     def tearDown(self):
         if os.path.exists(os.path.join(THIS_DIR, 'input_data', 'test_out.mat')):
@@ -173,6 +193,32 @@ class TestRadarDataMethods(unittest.TestCase):
         self.data.agc()
         self.assertTrue(self.data.flags.agc)
 
+    def test_agc_window(self):
+        self.data.data = np.random.RandomState(0).normal(size=self.data.data.shape)
+        orig_data = self.data.data.copy()
+        self.data.agc(window=6, scaling_factor=1)
+        for i in [0, 2, 3, 10, 19]:
+            maxamp = np.max(np.abs(orig_data[max(0, i - 3):i + 3, :]))
+            self.assertTrue(np.allclose(self.data.data[i, :], orig_data[i, :] / maxamp))
+
+        with self.assertRaises(ValueError):
+            self.data.agc(window=1)
+        with self.assertRaises(ValueError):
+            self.data.agc(per_trace=True, amp='mean')
+
+    def test_agc_per_trace(self):
+        self.data.data = np.random.RandomState(0).normal(size=self.data.data.shape)
+        orig_data = self.data.data.copy()
+        self.data.agc(window=6, scaling_factor=1, per_trace=True)
+        self.assertTrue(np.all(np.abs(self.data.data) <= 1.))
+        self.assertTrue(np.allclose(np.max(np.abs(self.data.data), axis=0), 1.))
+
+        self.data.data = orig_data.copy()
+        self.data.agc(window=6, scaling_factor=1, per_trace=True, amp='rms')
+        for i in [0, 3, 10, 19]:
+            rms = np.sqrt(np.mean(orig_data[max(0, i - 3):i + 3, :] ** 2., axis=0))
+            self.assertTrue(np.allclose(self.data.data[i, :], orig_data[i, :] / rms))
+
     def test_rangegain(self):
         self.data.rangegain(1.0)
         self.assertTrue(self.data.flags.rgain)
@@ -182,6 +228,14 @@ class TestRadarDataMethods(unittest.TestCase):
         self.data.rangegain(1.0)
         self.assertTrue(self.data.flags.rgain)
 
+    def test_rangegain_trig_array(self):
+        self.data.data = np.ones((self.data.snum, self.data.tnum))
+        self.data.trig = np.arange(self.data.tnum) % 5
+        self.data.rangegain(2.0)
+        for i, trig in enumerate(self.data.trig):
+            self.assertTrue(np.all(self.data.data[:trig + 1, i] == 1.))
+            self.assertTrue(np.allclose(self.data.data[trig + 1:, i], 2.0 * self.data.travel_time[trig + 1:]))
+
     def test_NMO_noexcpetion(self):
         # If velocity is 2
         self.data.nmo(0., uice=2.0, uair=2.0)
@@ -214,6 +268,25 @@ class TestRadarDataMethods(unittest.TestCase):
         self.data.restack(4)
         self.assertTrue(self.data.data.shape == (20, 8))
 
+    def test_restack_values(self):
+        self.data.trace_int = np.ones((self.data.tnum, ))
+        orig_data = self.data.data.copy()
+        orig_lat = self.data.lat.copy()
+        self.data.restack(5)
+        self.assertTrue(np.allclose(self.data.data[:, 2], np.mean(orig_data[:, 10:15], axis=1)))
+        self.assertTrue(np.allclose(self.data.lat[2], np.mean(orig_lat[10:15])))
+        self.assertTrue(np.allclose(self.data.trace_int, 5.))
+
+    def test_restack_stream(self):
+        self.data.trace_int = np.ones((self.data.tnum, ))
+        chunks = [(self.data.data[:, i:i + 7], {'lat': self.data.lat[i:i + 7], 'trace_int': self.data.trace_int[i:i + 7]})
+                  for i in range(0, self.data.tnum, 7)]
+        out = list(restack_stream(chunks, 4))
+        self.data.restack(5)
+        self.assertTrue(np.allclose(np.hstack([data for data, attrs in out]), self.data.data))
+        self.assertTrue(np.allclose(np.hstack([attrs['lat'] for data, attrs in out]), self.data.lat))
+        self.assertTrue(np.allclose(np.hstack([attrs['trace_int'] for data, attrs in out]), self.data.trace_int))
+
     def test_process_restack(self):
         process.process([self.data], restack=3)
         self.assertTrue(self.data.data.shape == (20, 13))
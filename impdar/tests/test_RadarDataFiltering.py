@@ -12,6 +12,7 @@
 
 import unittest
 import numpy as np
+from scipy.signal import filtfilt
 from impdar.lib.NoInitRadarData import NoInitRadarDataFiltering as NoInitRadarData
 from impdar.lib import process
 from impdar.lib.ImpdarError import ImpdarError
@@ -27,6 +28,39 @@ class TestAdaptive(unittest.TestCase):
         # since we subtract average trace and all traces are identical, we should get zeros out
         self.assertTrue(np.all(radardata.data <= 1.))
 
+    def test_AdaptiveNaNTrace(self):
+        # A bad trace only spoils the packets of traces around it
+        radardata = NoInitRadarData()
+        radardata.data = np.random.RandomState(0).normal(size=radardata.data.shape)
+        radardata.data[:, 200] = np.nan
+        radardata.adaptivehfilt()
+        self.assertTrue(np.all(np.isnan(radardata.data[:, 200])))
+        self.assertTrue(np.all(np.isfinite(radardata.data[:, :140])))
+        self.assertTrue(np.all(np.isfinite(radardata.data[:, 260:])))
+
+    def test_AdaptiveMatchesLoop(self):
+        radardata = NoInitRadarData()
+        radardata.data = np.random.RandomState(0).normal(size=radardata.data.shape)
+        data = radardata.data.copy()
+        radardata.adaptivehfilt()
+
+        tt = radardata.travel_time
+        mtt = np.max(tt)
+        scale = np.where(tt <= 0.3 * mtt,
+                         1. - (tt - 0.1 * mtt) ** 2. / mtt ** 2.,
+                         0.96 * np.exp(-30. * (tt - 0.3 * mtt) ** 2. / mtt ** 2.))
+
+        # build each average trace directly from its packet of 100 traces
+        for i in [0, 50, 51, 200, 349, 350, 399]:
+            if i <= 50:
+                scpacket = data[:, 0:100 - i]
+            elif i >= radardata.tnum - 50:
+                scpacket = data[:, radardata.tnum - 100:radardata.tnum]
+            else:
+                scpacket = data[:, i - 49:i + 50]
+            avg_trace = filtfilt([.25, .25, .25, .25], 1, np.mean(scpacket, axis=-1))
+            self.assertTrue(np.allclose(radardata.data[:, i], data[:, i] - avg_trace * scale))
+
 
 class TestHfilt(unittest.TestCase):
 
@@ -84,6 +118,30 @@ class TestWinAvgHfilt(unittest.TestCase):
         radardata.winavg_hfilt(11, taper='pexp', filtdepth=-1)
         self.assertTrue(np.all(radardata.data == radardata.pexp_target_output))
 
+    def test_WinAvgMatchesLoop(self):
+        radardata = NoInitRadarData()
+        radardata.data = np.random.RandomState(0).normal(size=radardata.data.shape)
+        data = radardata.data.copy()
+        radardata.winavg_hfilt(11, taper='full')
+        exptaper = np.exp(-radardata.travel_time * 0.05) / np.exp(-radardata.travel_time[0] * 0.05)
+        for i in [0, 3, 5, 200, 394, 395, 399]:
+            avg_trace = np.mean(data[:, max(i - 5, 0):min(i + 5, radardata.tnum)], axis=-1) * exptaper
+            self.assertTrue(np.allclose(radardata.data[:, i], data[:, i] - avg_trace))
+
+    def test_WinAvgNaNTrace(self):
+        # A bad trace only spoils the windows that contain it
+        radardata = NoInitRadarData()
+        radardata.data = np.random.RandomState(0).normal(size=radardata.data.shape)
+        radardata.data[:, 200] = np.nan
+        data = radardata.data.copy()
+        radardata.winavg_hfilt(11, taper='full')
+        exptaper = np.exp(-radardata.travel_time * 0.05) / np.exp(-radardata.travel_time[0] * 0.05)
+        for i in [0, 194, 195, 205, 206, 394, 399]:
+            avg_trace = np.mean(data[:, max(i - 5, 0):min(i + 5, radardata.tnum)], axis=-1) * exptaper
+            self.assertTrue(np.allclose(radardata.data[:, i], data[:, i] - avg_trace, equal_nan=True))
+        self.assertTrue(np.all(np.isfinite(radardata.data[:, 206:])))
+        self.assertTrue(np.all(np.isnan(radardata.data[:, 196:205])))
+
     def test_WinAvgbadtaper(self):
         radardata = NoInitRadarData()
         with self.assertRaises(ValueError):
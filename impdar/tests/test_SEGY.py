@@ -10,10 +10,18 @@
 Test the basics of RadarData
 """
 import os
+import sys
+import tempfile
 import unittest
 import numpy as np
+if sys.version_info[0] >= 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
 from impdar.lib.NoInitRadarData import NoInitRadarData
 from impdar.lib.load.load_segy import load_segy, SEGY
+if SEGY:
+    import segyio
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -37,6 +45,54 @@ class TestSEGY(unittest.TestCase):
         self.assertEqual(data.data.shape, data2.data.shape)
         self.assertTrue(np.all(data.data == data2.data))
 
+    @unittest.skipIf(not SEGY, 'No SEGY on this version')
+    def test_ReadTraceRange(self):
+        data = np.random.RandomState(0).rand(20, 50).astype(np.float32)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'rand.segy')
+            segyio.tools.from_array2D(fn, data, dt=4000)
+            segy_data = load_segy(fn)
+            segy_data_sub = load_segy(fn, trace_range=(2, 10))
+            with self.assertRaises(ValueError):
+                load_segy(fn, trace_range=(10, 2))
+        self.assertTrue(np.all(segy_data.data == data.transpose()))
+        self.assertTrue(segy_data.data.flags['F_CONTIGUOUS'])
+        self.assertEqual(segy_data_sub.tnum, 8)
+        self.assertTrue(np.all(segy_data_sub.data == data.transpose()[:, 2:10]))
+        self.assertTrue(np.all(segy_data_sub.trace_num == np.arange(3, 11)))
+
+    @unittest.skipIf(not SEGY, 'No SEGY on this version')
+    def test_WriteHeaders(self):
+        data = NoInitRadarData(big=True)
+        data.dt = 1.0e-9
+        data.travel_time = np.arange(data.snum) * 1.0e-3 + 0.05
+        data.x_coord = np.linspace(500000., 501000., data.tnum)
+        data.y_coord = np.linspace(7.0e6, 7.001e6, data.tnum)
+        data.elev = np.linspace(100., 110., data.tnum)
+        data.elev[3] = np.nan
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'headers.segy')
+            data.save_as_segy(fn)
+            data2 = load_segy(fn)
+            with segyio.open(fn, ignore_geometry=True) as fin:
+                self.assertTrue(np.all(fin.attributes(segyio.TraceField.CDP)[:] == data.trace_num))
+                self.assertTrue(np.all(fin.attributes(segyio.TraceField.TRACE_SAMPLE_COUNT)[:] == data.snum))
+
+            # Writing in several chunks gives the same file
+            fn_chunks = os.path.join(tmpdir, 'headers_chunks.segy')
+            with patch('impdar.lib.RadarData._RadarDataSaving.SEGY_TRACE_CHUNK', 7):
+                data.save_as_segy(fn_chunks)
+            with open(fn, 'rb') as fin, open(fn_chunks, 'rb') as fin_chunks:
+                self.assertEqual(fin.read(), fin_chunks.read())
+        self.assertTrue(np.allclose(data2.data, data.data))
+        self.assertTrue(np.allclose(data2.dt, data.dt))
+        self.assertTrue(np.allclose(data2.travel_time, data.travel_time))
+        self.assertTrue(np.all(data2.trace_num == data.trace_num))
+        self.assertTrue(np.allclose(data2.x_coord, data.x_coord, atol=0.01))
+        self.assertTrue(np.allclose(data2.y_coord, data.y_coord, atol=0.01))
+        self.assertEqual(data2.elev[3], 0.)
+        self.assertTrue(np.allclose(data2.elev[4:], data.elev[4:], atol=0.01))
+
     @unittest.skipIf(SEGY, 'SEGY on this version, only a graceful failure test')
     def test_SaveFails(self):
         print(SEGY)
@@ -15,7 +15,14 @@ Mar 28 2019
 """
 import sys
 import os
+import shutil
+import tempfile
 import unittest
+if sys.version_info[0] >= 3:
+    from unittest.mock import patch
+else:
+    from mock import patch
+import numpy as np
 from impdar.lib.load import load_olaf
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -28,6 +35,51 @@ class TestLoadGecko(unittest.TestCase):
         load_olaf.load_olaf(os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd'), channel=1)
         load_olaf.load_olaf(os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd'), channel=2)
 
+    @unittest.skipIf(sys.version_info[0] < 3, 'Bytes are weird in 2')
+    def test_load_gecko_index_cache(self):
+        dat = load_olaf.load_olaf(os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd'), channel=2)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'test_gecko.gtd')
+            shutil.copy(os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd'), fn)
+            dat_cached = load_olaf.load_olaf(fn, channel=2, cache_index=True)
+            self.assertTrue(os.path.exists(fn + '.index.npz'))
+            self.assertTrue(np.all(dat_cached.data == dat.data))
+
+            # Now read from the cache
+            with patch('impdar.lib.load.load_olaf.index_records') as index_patch:
+                dat_cached = load_olaf.load_olaf(fn, channel=2, cache_index=True)
+                self.assertFalse(index_patch.called)
+            self.assertTrue(np.all(dat_cached.data == dat.data))
+            self.assertTrue(np.all(dat_cached.decday == dat.decday))
+
+    @unittest.skipIf(sys.version_info[0] < 3, 'Bytes are weird in 2')
+    def test_index_records_marker(self):
+        buf = np.memmap(os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd'), dtype=np.uint8, mode='r')
+        sinfo = load_olaf.SInfo(buf)
+        offsets, header_types = load_olaf.index_records(buf, sinfo)
+        self.assertTrue(np.all(header_types == 0))
+        self.assertTrue(np.all(np.diff(offsets) == load_olaf._record_len(sinfo, 0)))
+
+        # Put a marker after the third record, and part of a trace at the end
+        marker_len = load_olaf._record_len(sinfo, 1)
+        marker = np.zeros((marker_len, ), dtype=np.uint8)
+        marker[0] = 1
+        end = offsets[-1] + load_olaf._record_len(sinfo, 0)
+        marked = np.hstack((buf[:offsets[3]], marker, buf[offsets[3]:end], buf[offsets[0]:offsets[0] + 100]))
+        for block in [2, load_olaf.INDEX_BLOCK]:
+            with patch('impdar.lib.load.load_olaf.INDEX_BLOCK', block):
+                marked_offsets, marked_types = load_olaf.index_records(marked, sinfo, max_records=len(offsets) + 10)
+            self.assertTrue(np.all(marked_offsets == np.hstack((offsets[:4], offsets[3:] + marker_len))))
+            self.assertTrue(np.all(marked_types == np.hstack((header_types[:3], [1], header_types[3:]))))
+
+        # and stop early if asked to
+        marked_offsets, _ = load_olaf.index_records(marked, sinfo, offset=int(offsets[1]), max_records=5)
+        self.assertTrue(np.all(marked_offsets == np.hstack((offsets[1:4], offsets[3:5] + marker_len))))
+
+    def test_load_gecko_badchannel(self):
+        with self.assertRaises(ValueError):
+            load_olaf.load_olaf(os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd'), channel=3)
+
 
 if __name__ == '__main__':
     unittest.main()
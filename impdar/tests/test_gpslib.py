@@ -11,6 +11,7 @@
 """
 import sys
 import os
+import tempfile
 import unittest
 import numpy as np
 from impdar.lib.NoInitRadarData import NoInitRadarData
@@ -95,5 +96,31 @@ class TestGPS(unittest.TestCase):
         self.assertTrue(len(dats[0].constant_space.mock_calls) > 0)
 
 
+class TestNMEA(unittest.TestCase):
+
+    def test_gga_all_data(self):
+        sentences = ['$GPGGA,123519,4807.038,S,01131.000,W,1,08,0.9,545.4,M,46.9,M,,*47\r\n',
+                     '$GPGGA,123520,4807.038,N,01131.000,E,,,,,M,,M,,*47\n']
+        data = gpslib.nmea_all_info(sentences)
+        self.assertEqual(data.all_data.shape, (2, 10))
+        self.assertTrue(np.all(data.all_data[0, :] == [123519, 4807.038, -1, 1131., -1, 1, 8, 0.9, 545.4, 46.9]))
+        self.assertTrue(np.all(data.all_data[1, :] == [123520, 4807.038, 1, 1131., 1, 0, 0, 0, 0, 0]))
+
+    def test_read_dzg(self):
+        gga, scans = gpslib.read_dzg(os.path.join(THIS_DIR, 'input_data', 'test_gssi_partialgps.DZG'))
+        self.assertEqual(len(gga), len(scans))
+        self.assertTrue(np.all(np.diff(scans) > 0))
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fn = os.path.join(tmpdir, 'test.DZG')
+            with open(fn, 'w') as fout:
+                fout.write('$GSSIS,0,0.0\n$GPGGA,1,0,N,0,E,1,8,1,1,M,1,M,,*47\n\n')
+                fout.write('$GSSIS,10,0.0\n$GPRMC,junk\n\n')
+                fout.write('$GSSIS,20,0.0\n$GPZDA,junk\n$GPGGA,2,0,N,0,E,1,8,1,1,M,1,M,,*47\n')
+            gga, scans = gpslib.read_dzg(fn)
+        self.assertEqual(len(gga), 2)
+        self.assertTrue(np.all(scans == [0, 20]))
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+Make sure that we can save and load our hdf5 format
+"""
+
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import numpy as np
+from impdar.lib.RadarData import RadarData
+from impdar.lib.LazyData import LazyData
+from impdar.lib.load import load, load_h5
+from impdar.lib import convert
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@unittest.skipIf(not load_h5.H5, 'No h5py on this version')
+class TestH5(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.dat = RadarData(os.path.join(THIS_DIR, 'input_data', 'small_data_picks.mat'))
+        self.fn = os.path.join(self.tmpdir, 'small_data_picks.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_save_load(self):
+        self.dat.save(self.fn)
+        dat = load_h5.load_h5(self.fn)
+        for attr in self.dat.attrs_guaranteed:
+            self.assertTrue(np.all(np.asarray(getattr(dat, attr)) == np.asarray(getattr(self.dat, attr))))
+        self.assertEqual(dat.flags.restack, self.dat.flags.restack)
+        self.assertTrue(np.all(dat.flags.bpass == self.dat.flags.bpass))
+        self.assertEqual(dat.picks.picknums, self.dat.picks.picknums)
+        self.assertTrue(np.allclose(dat.picks.samp2, self.dat.picks.samp2, equal_nan=True))
+        self.assertEqual(dat.picks.pickparams.freq, self.dat.picks.pickparams.freq)
+
+        # and back to .mat
+        dat.save(os.path.join(self.tmpdir, 'resave.mat'))
+        dat = RadarData(os.path.join(self.tmpdir, 'resave.mat'))
+        self.assertTrue(np.allclose(dat.picks.samp2, self.dat.picks.samp2, equal_nan=True))
+
+    def test_compression(self):
+        self.dat.save_as_h5(self.fn, compression='gzip', chunk_traces=3)
+        dat = load_h5.load_h5(self.fn)
+        self.assertTrue(np.all(dat.data == self.dat.data))
+
+    def test_trace_range(self):
+        self.dat.save(self.fn)
+        dat = load_h5.load_h5(self.fn, trace_range=(2, 8))
+        self.assertEqual(dat.tnum, 6)
+        self.assertTrue(np.all(dat.data == self.dat.data[:, 2:8]))
+        self.assertTrue(np.all(dat.lat == self.dat.lat[2:8]))
+        self.assertTrue(np.all(dat.travel_time == self.dat.travel_time))
+        self.assertTrue(np.allclose(dat.picks.samp1, self.dat.picks.samp1[:, 2:8], equal_nan=True))
+
+    def test_lazy(self):
+        self.dat.save(self.fn)
+        dat = load_h5.load_h5(self.fn, trace_range=(2, 8), lazy=True)
+        self.assertTrue(isinstance(dat.data, LazyData))
+        self.assertTrue(np.all(dat.data[:, ::-1] == self.dat.data[:, 2:8][:, ::-1]))
+        self.assertTrue(np.all(dat.data[:, [3, 1]] == self.dat.data[:, [5, 3]]))
+        data = pickle.loads(pickle.dumps(dat.data))
+        self.assertTrue(np.all(np.asarray(data) == self.dat.data[:, 2:8]))
+
+        # the windows hold the file open until they are closed or go away
+        fin = dat.data._raw._file
+        self.assertTrue(fin)
+        dat.data._raw.close()
+        self.assertFalse(fin)
+        del data
+        self.dat.save(self.fn)
+
+        dat = load('h5', self.fn, memmap=True)[0]
+        self.assertTrue(isinstance(dat.data, LazyData))
+
+    def test_badfile(self):
+        with self.assertRaises(KeyError):
+            load_h5.load_h5(os.path.join(THIS_DIR, 'input_data', 'rectangle_gprMax_Bscan.h5'))
+
+    def test_convert(self):
+        fn_mat = os.path.join(self.tmpdir, 'small_data.mat')
+        shutil.copy(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'), fn_mat)
+        convert.convert(fn_mat, 'h5')
+        dat = load('h5', os.path.join(self.tmpdir, 'small_data.h5'))[0]
+        self.assertTrue(np.all(dat.data == RadarData(fn_mat).data))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -33,6 +33,12 @@ class TestMain(unittest.TestCase):
         aca, kwca = load_patch.call_args
         self.assertEqual(kwca['fns_in'], ['fn.mat'])
         self.assertEqual(kwca['filetype'], 'mat')
+        self.assertEqual(kwca['n_jobs'], 1)
+
+        impdarexec.sys.argv = ['dummy', 'load', 'mat', 'fn.mat', 'fn2.mat', '-j', '4']
+        impdarexec.main()
+        aca, kwca = load_patch.call_args
+        self.assertEqual(kwca['n_jobs'], 4)
 
         with self.assertRaises(SystemExit):
             impdarexec.sys.argv = ['dummy', 'load', 'notanintype', 'fn.mat']
@@ -47,6 +53,27 @@ class TestMain(unittest.TestCase):
         self.assertEqual(kwca['fn'], ['fn.mat'])
         self.assertEqual(kwca['rev'], True)
 
+        self.assertEqual(kwca['n_jobs'], 1)
+        self.assertFalse(kwca['dry_run'])
+
+        impdarexec.sys.argv = ['dummy', 'proc', '-rev', '-j', '4', '--dry_run', 'fn.mat']
+        impdarexec.main()
+        aca, kwca = process_patch.call_args
+        self.assertEqual(kwca['n_jobs'], 4)
+        self.assertTrue(kwca['dry_run'])
+
+        impdarexec.sys.argv = ['dummy', 'proc', '-rev', '--cache', 'cachedir', '--cache_size', '2', 'fn.mat']
+        impdarexec.main()
+        aca, kwca = process_patch.call_args
+        self.assertEqual(kwca['cache'], 'cachedir')
+        self.assertEqual(kwca['cache_size'], 2.)
+
+        impdarexec.sys.argv = ['dummy', 'proc', '-rev', '--filetype', 'h5', 'fn.h5']
+        impdarexec.main()
+        aca, kwca = process_patch.call_args
+        self.assertEqual(kwca['fn'], ['fn.h5'])
+        self.assertEqual(kwca['filetype'], 'h5')
+
     @patch('impdar.bin.impdarexec.plot.plot')
     def test_plot(self, plot_patch):
         impdarexec.sys.argv = ['dummy', 'plot', 'fn.mat']
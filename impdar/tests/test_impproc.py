@@ -132,6 +132,13 @@ class TestInputs(unittest.TestCase):
 
         aca, kwca = agc_patch.call_args
         self.assertEqual(kwca['window'], window)
+        self.assertFalse(kwca['per_trace'])
+
+        impproc.sys.argv = ['dummy', 'agc', 'dummy.mat', '-per_trace', '-amp', 'rms']
+        impproc.main()
+        aca, kwca = agc_patch.call_args
+        self.assertTrue(kwca['per_trace'])
+        self.assertEqual(kwca['amp'], 'rms')
 
         with self.assertRaises(SystemExit):
             impproc.sys.argv = ['dummy', 'agc', 'dummy.mat', '-window', '10.1']
@@ -407,6 +414,19 @@ class TestInputs(unittest.TestCase):
         aca, kwca = migrate_patch.call_args
         self.assertEqual(kwca['nearfield'], True)
 
+        impproc.sys.argv = ['dummy', 'migrate', '--pad', 'dummy.mat']
+        impproc.main()
+        aca, kwca = migrate_patch.call_args
+        self.assertEqual(kwca['pad'], True)
+
+        impproc.sys.argv = ['dummy', 'migrate', '--refine', '4', 'dummy.mat']
+        impproc.main()
+        aca, kwca = migrate_patch.call_args
+        self.assertEqual(kwca['refine'], 4)
+        with self.assertRaises(SystemExit):
+            impproc.sys.argv = ['dummy', 'migrate', '--refine', '0.1', 'dummy.mat']
+            impproc.main()
+
         badint = 0.1
         goodint = 10
         worseint = 'hello'
@@ -11,8 +11,11 @@
 """
 import sys
 import os
+import shutil
+import tempfile
 import unittest
 from impdar.lib import load
+from impdar.lib.ImpdarError import ImpdarError
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
 
@@ -41,6 +44,36 @@ class TestLoad(unittest.TestCase):
         with self.assertRaises(ValueError):
             data = load.load('bad', os.path.join(THIS_DIR, 'input_data', 'small_data.bad'))
 
+    def test_loadparallel(self):
+        fns = [os.path.join(THIS_DIR, 'input_data', 'small_data.mat'),
+               os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT')]
+        data = load.load('mat', fns[:1] * 3, n_jobs=2)
+        self.assertEqual(len(data), 3)
+        self.assertEqual(data[2].data.shape, (20, 40))
+
+        # one bad file should not stop the others, but we should hear about it
+        with self.assertRaises(ImpdarError):
+            load.load('mat', fns, n_jobs=2)
+
+        # memory maps would come back by value
+        with self.assertRaises(ValueError):
+            load.load('gssi', fns[1:] * 2, memmap=True, n_jobs=2)
+
+    def test_load_and_exitparallel(self):
+        with tempfile.TemporaryDirectory() as tmpdir:
+            fns = [os.path.join(tmpdir, 'small_data{:d}.mat'.format(i)) for i in range(3)]
+            for fn in fns:
+                shutil.copy(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'), fn)
+            load.load_and_exit('mat', fns, n_jobs=2)
+            for fn in fns:
+                self.assertTrue(os.path.exists(os.path.splitext(fn)[0] + '_raw.mat'))
+
+            outdir = os.path.join(tmpdir, 'out')
+            os.mkdir(outdir)
+            with self.assertRaises(ImpdarError):
+                load.load_and_exit('mat', fns + [os.path.join(tmpdir, 'notafile.mat')], n_jobs=2, o=outdir)
+            self.assertEqual(sorted(os.listdir(outdir)), ['small_data{:d}_raw.mat'.format(i) for i in range(3)])
+
     def test_load_and_exitmat(self):
         data = load.load_and_exit('mat', os.path.join(THIS_DIR, 'input_data', 'small_data.mat'), o=os.path.join(THIS_DIR, 'input_data', 'small_data_rawrrr.mat'))
         self.assertTrue(os.path.exists(os.path.join(THIS_DIR, 'input_data', 'small_data_rawrrr.mat')))
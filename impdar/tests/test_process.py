@@ -10,9 +10,18 @@
 Test the machinery of process. This is broken up to match where it would likely fail; tests process wrappers of various methods are with the tests of those methods
 """
 import os
+import shutil
+import tempfile
 import unittest
 import numpy as np
 from impdar.lib.NoInitRadarData import NoInitRadarData
+from impdar.lib.RadarData import RadarData
+from impdar.lib.Pipeline import Pipeline
+from impdar.lib.ProcessingCache import ProcessingCache
+from impdar.lib.ImpdarError import ImpdarError
+from impdar.lib.OutOfCore import run_out_of_core
+from impdar.lib.RadarData._RadarDataSaving import H5
+from impdar.lib.load import load
 from impdar.lib import process
 
 THIS_DIR = os.path.dirname(os.path.abspath(__file__))
@@ -35,6 +44,189 @@ class TestConcat(unittest.TestCase):
             dats = process.concat([NoInitRadarData(), d2])
 
 
+class TestPipeline(unittest.TestCase):
+
+    def setUp(self):
+        self.dat = RadarData(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'))
+        self.dat.data = np.random.RandomState(0).normal(size=(400, self.dat.tnum))
+        self.dat.snum = 400
+        self.dat.travel_time = np.arange(400) * self.dat.dt * 1.0e6
+
+    def test_plan(self):
+        pipeline = Pipeline().add('vbp', 100., 400.).add('hfilt', 0, 10).add('rgain', 0.1).add('crop', 300, 'bottom', 'snum')
+        self.assertEqual([[step[0] for step in stage] for stage in pipeline.plan()],
+                         [['vbp'], ['crop'], ['hfilt', 'rgain']])
+        # cropping the top changes the travel times used by hfilt
+        pipeline = Pipeline().add('rev').add('hfilt', 0, 10).add('crop', 3, 'top', 'snum')
+        self.assertEqual([stage[0][0] for stage in pipeline.plan()], ['rev', 'hfilt', 'crop'])
+        pipeline = Pipeline().add('rev').add('crop', 3, 'top', 'snum').add('restack', 3).add('hcrop', 5, 'left', 'tnum')
+        self.assertEqual([stage[0][0] for stage in pipeline.plan()], ['crop', 'rev', 'restack', 'hcrop'])
+
+        with self.assertRaises(ValueError):
+            Pipeline().add('notastep')
+
+    def test_run_matches_steps(self):
+        dat = RadarData(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'))
+        dat.data, dat.snum, dat.travel_time = self.dat.data.copy(), self.dat.snum, self.dat.travel_time.copy()
+        dat.trig = 2.
+        self.dat.trig = 2.
+        Pipeline().add('hcrop', 3, 'left', 'tnum').add('vbp', 100., 400.).add('hfilt', 0, 10).add(
+            'rgain', 0.1).add('crop', 300, 'bottom', 'snum').run(self.dat)
+        dat.hcrop(3, 'left', 'tnum')
+        dat.vertical_band_pass(100., 400.)
+        dat.hfilt(bounds=(0, 10))
+        dat.rangegain(0.1)
+        dat.crop(300, 'bottom', 'snum')
+        self.assertEqual(self.dat.data.shape, dat.data.shape)
+        self.assertTrue(np.allclose(self.dat.data, dat.data))
+        self.assertTrue(self.dat.flags.rgain)
+        self.assertTrue(np.all(self.dat.flags.hfilt == 1))
+
+    def test_process(self):
+        self.assertFalse(process.process([self.dat]))
+        self.assertTrue(process.process([self.dat], hcrop=(3, 'left', 'tnum'), restack=3))
+        self.assertEqual(self.dat.tnum, 12)
+        with self.assertRaises(ValueError):
+            process.process([self.dat], hcrop=(3, 'up', 'tnum'))
+
+    def test_estimate_memory(self):
+        pipeline = Pipeline().add('restack', 3).add('vbp', 100., 400.).add('crop', 200, 'bottom', 'snum')
+        stages, peak = pipeline.estimate_memory(self.dat)
+        self.assertEqual([stage[1] for stage in stages], [(400, 13), (400, 13), (200, 13)])
+        self.assertTrue(peak >= self.dat.data.nbytes)
+        self.assertTrue(all(stage[2] <= peak for stage in stages))
+
+
+class TestProcessingCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'data.mat')
+        dat = RadarData(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'))
+        dat.data = np.random.RandomState(0).normal(size=(400, dat.tnum))
+        dat.snum = 400
+        dat.travel_time = np.arange(400) * dat.dt * 1.0e6
+        dat.save(self.fn)
+        self.cache = ProcessingCache(os.path.join(self.tmpdir, 'cache'))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _run(self, pipeline):
+        loads = []
+
+        def load_input():
+            loads.append(1)
+            return RadarData(self.fn)
+        dat = self.cache.run(pipeline, self.cache.input_key('mat', [self.fn]), load_input)
+        return dat, len(loads)
+
+    def test_keys(self):
+        key = self.cache.input_key('mat', [self.fn])
+        self.assertEqual(key, self.cache.input_key('mat', [self.fn]))
+        self.assertNotEqual(key, self.cache.input_key('gssi', [self.fn]))
+        keys = self.cache.stage_keys(key, Pipeline().add('restack', 3).add('hfilt', 0, 5).plan())
+        self.assertEqual(keys, self.cache.stage_keys(key, Pipeline().add('restack', 3.).add('hfilt', 0., 5.).plan()))
+        self.assertEqual(keys[0], self.cache.stage_keys(key, Pipeline().add('restack', 3).add('hfilt', 0, 8).plan())[0])
+        self.assertNotEqual(keys[1], self.cache.stage_keys(key, Pipeline().add('restack', 3).add('hfilt', 0, 8).plan())[1])
+
+    def test_rerun(self):
+        dat, loads = self._run(Pipeline().add('restack', 3).add('vbp', 100., 400.).add('hfilt', 0, 5))
+        self.assertEqual(loads, 1)
+        dat, loads = self._run(Pipeline().add('restack', 3).add('vbp', 100., 400.).add('hfilt', 0, 8))
+        self.assertEqual(loads, 0)
+
+        direct = RadarData(self.fn)
+        Pipeline().add('restack', 3).add('vbp', 100., 400.).add('hfilt', 0, 8).run(direct)
+        self.assertTrue(np.allclose(dat.data, direct.data))
+        self.assertTrue(np.all(dat.trace_num == direct.trace_num))
+
+    def test_evict(self):
+        self._run(Pipeline().add('restack', 3).add('rev'))
+        self.assertEqual(len(os.listdir(self.cache.directory)), 2)
+        ProcessingCache(self.cache.directory, max_bytes=0)
+        self.assertEqual(len(os.listdir(self.cache.directory)), 0)
+
+    def test_process_and_exit(self):
+        fn_out = os.path.join(self.tmpdir, 'out.mat')
+        cache = os.path.join(self.tmpdir, 'cache')
+        process.process_and_exit([self.fn], rev=True, hfilt=(0, 5), cache=cache, o=fn_out)
+        process.process_and_exit([self.fn], rev=True, hfilt=(0, 5), cache=cache, o=fn_out)
+        cached = RadarData(fn_out)
+        process.process_and_exit([self.fn], rev=True, hfilt=(0, 5), o=fn_out)
+        self.assertTrue(np.allclose(cached.data, RadarData(fn_out).data))
+
+
+@unittest.skipIf(not H5, 'No h5py on this version')
+class TestOutOfCore(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(self.tmpdir, 'data.h5')
+        dat = RadarData(os.path.join(THIS_DIR, 'input_data', 'small_data.mat'))
+        dat.data = np.random.RandomState(0).normal(size=(400, 250))
+        dat.snum, dat.tnum = 400, 250
+        dat.travel_time = np.arange(400) * dat.dt * 1.0e6
+        for attr in ['lat', 'long', 'elev', 'x_coord', 'y_coord', 'decday', 'pressure', 'trig_level', 'trace_int']:
+            setattr(dat, attr, np.random.RandomState(1).normal(size=(250, )))
+        dat.dist = np.cumsum(np.ones((250, )))
+        dat.trace_num = np.arange(250) + 1
+        dat.save(self.fn)
+        self.fn_out = os.path.join(self.tmpdir, 'out.h5')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _compare(self, pipeline, block_traces=7):
+        dat = run_out_of_core(pipeline, load('h5', [self.fn], memmap=True)[0], self.fn_out, block_traces=block_traces)
+        direct = load('h5', [self.fn])[0]
+        pipeline.run(direct)
+        self.assertEqual(dat.data.shape, direct.data.shape)
+        self.assertTrue(np.allclose(np.asarray(dat.data), direct.data))
+        self.assertTrue(np.allclose(dat.travel_time, direct.travel_time))
+        for attr in ['lat', 'dist', 'trace_num', 'elev']:
+            self.assertTrue(np.allclose(getattr(dat, attr), getattr(direct, attr)))
+        # only the output is left
+        self.assertEqual(sorted(os.listdir(self.tmpdir)), ['data.h5', 'out.h5'])
+        return dat, direct
+
+    def test_local(self):
+        dat, direct = self._compare(Pipeline().add('vbp', 100., 400.).add('rgain', 0.1).add('crop', 300, 'bottom', 'snum'))
+        self.assertTrue(dat.flags.rgain)
+        self._compare(Pipeline().add('crop', 20, 'top', 'snum').add('nmo', 10.))
+        self._compare(Pipeline())
+
+    def test_elementwise(self):
+        dat, direct = self._compare(Pipeline().add('vbp', 100., 400.).add('hfilt', 0, 100).add('rgain', 0.1))
+        self.assertTrue(np.all(dat.flags.hfilt == 1))
+        self._compare(Pipeline().add('hfilt', 10, 30))
+
+    def test_reorder(self):
+        self._compare(Pipeline().add('restack', 3).add('rev'), block_traces=10)
+        self._compare(Pipeline().add('hcrop', 20, 'left', 'tnum').add('hcrop', 200, 'right', 'tnum').add('rev'))
+
+    def test_windows(self):
+        self._compare(Pipeline().add('ahfilt'))
+        self._compare(Pipeline().add('winavg', 10), block_traces=30)
+        self._compare(Pipeline().add('denoise', 3, 5), block_traces=30)
+
+    def test_unsupported(self):
+        with self.assertRaises(ValueError):
+            run_out_of_core(Pipeline().add('migrate'), load('h5', [self.fn], memmap=True)[0], self.fn_out)
+        with self.assertRaises(ValueError):
+            run_out_of_core(Pipeline().add('crop', 2, 'top', 'pretrig'), load('h5', [self.fn], memmap=True)[0],
+                            self.fn_out)
+
+    def test_process_and_exit(self):
+        process.process_and_exit([self.fn], filetype='h5', vbp=(100., 400.), hfilt=(0, 100), out_of_core=True,
+                                 o=self.fn_out)
+        direct = load('h5', [self.fn])[0]
+        process.process([direct], vbp=(100., 400.), hfilt=(0, 100))
+        self.assertTrue(np.allclose(load('h5', [self.fn_out])[0].data, direct.data))
+        with self.assertRaises(ValueError):
+            process.process_and_exit([self.fn], filetype='h5', cat=True, rev=True, out_of_core=True)
+
+
 class TestProcess_and_exit(unittest.TestCase):
 
     def test_process_and_exitLOADMAT(self):
@@ -46,6 +238,26 @@ class TestProcess_and_exit(unittest.TestCase):
     def test_process_and_exitPROCESS(self):
         process.process_and_exit([os.path.join(THIS_DIR, 'input_data', 'small_data.mat')], rev=True)
 
+    def test_process_and_exitDRYRUN(self):
+        process.process_and_exit([os.path.join(THIS_DIR, 'input_data', 'small_data.mat')], rev=True, dry_run=True)
+        self.assertFalse(os.path.exists(os.path.join(THIS_DIR, 'input_data', 'small_data_proc.mat')))
+
+    def test_process_and_exitJOBS(self):
+        fns = [os.path.join(THIS_DIR, 'input_data', 'small_data.mat'), os.path.join(THIS_DIR, 'input_data', 'data_raw.mat')]
+        process.process_and_exit(fns, rev=True, n_jobs=2)
+        for fn_in, fn_out in zip(fns, ['small_data_proc.mat', 'data_proc.mat']):
+            dat = RadarData(os.path.join(THIS_DIR, 'input_data', fn_out))
+            self.assertTrue(np.all(dat.data == RadarData(fn_in).data[:, ::-1]))
+
+    def test_process_and_exitFAILURE(self):
+        fns = [os.path.join(THIS_DIR, 'input_data', 'small_data.mat'), os.path.join(THIS_DIR, 'input_data', 'not_a_file.mat')]
+        for n_jobs in [1, 2]:
+            with self.assertRaises(ImpdarError):
+                process.process_and_exit(fns, rev=True, n_jobs=n_jobs)
+            # we still process the good file
+            self.assertTrue(os.path.exists(os.path.join(THIS_DIR, 'input_data', 'small_data_proc.mat')))
+            os.remove(os.path.join(THIS_DIR, 'input_data', 'small_data_proc.mat'))
+
     def test_process_and_exitOUTNAMING(self):
         process.process_and_exit([os.path.join(THIS_DIR, 'input_data', 'data_raw.mat'), os.path.join(THIS_DIR, 'input_data', 'small_data.mat')], cat=True)
         self.assertTrue(os.path.exists(os.path.join(THIS_DIR, 'input_data', 'data_cat.mat')))
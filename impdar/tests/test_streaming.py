@@ -0,0 +1,146 @@
+#! /usr/bin/env python
+# -*- coding: utf-8 -*-
+# vim:fenc=utf-8
+#
+# Copyright © 2019 David Lilien <dlilien90@gmail.com>
+#
+# Distributed under terms of the GNU GPL3.0 license.
+
+"""
+Test reading and processing files as they are written
+"""
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import matplotlib.pyplot as plt
+from impdar.lib.load.load_gssi import load_gssi, stream_gssi, HEADER_BYTES
+from impdar.lib.load.load_olaf import load_olaf, stream_olaf
+from impdar.lib.load.load_h5 import load_h5, H5
+from impdar.lib.plot import LiveRadargram
+from impdar.lib import Streaming
+
+THIS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class TestReaders(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_gssi_growing(self):
+        fn_in = os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT')
+        with open(fn_in, 'rb') as fin:
+            contents = fin.read()
+        fn = os.path.join(self.tmpdir, 'growing.DZT')
+        full = load_gssi(fn_in)
+        trace_bytes = (len(contents) - HEADER_BYTES) // full.tnum
+        # 50 traces and part of another
+        with open(fn, 'wb') as fout:
+            fout.write(contents[:HEADER_BYTES + trace_bytes * 50 + 100])
+        dat, chunks = stream_gssi(fn, block_traces=30, poll=0., timeout=0.)
+        self.assertEqual(dat.tnum, 0)
+        got = [next(chunks)]
+        with open(fn, 'wb') as fout:
+            fout.write(contents)
+        got += list(chunks)
+        self.assertEqual(got[0][0].shape[1], 30)
+        self.assertTrue(np.all(np.hstack([chunk[0] for chunk in got]) == full.data))
+        self.assertTrue(np.all(np.hstack([chunk[1]['trace_num'] for chunk in got]) == full.trace_num))
+
+    def test_olaf(self):
+        fn = os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd')
+        dat, chunks = stream_olaf(fn, block_traces=4, poll=0., timeout=0.)
+        got = list(chunks)
+        full = load_olaf(fn)
+        self.assertTrue(np.all(dat.travel_time == full.travel_time))
+        self.assertTrue(np.all(np.hstack([chunk[0] for chunk in got]) == full.data))
+        self.assertTrue(np.allclose(np.hstack([chunk[1]['lat'] for chunk in got]), full.lat))
+
+        with self.assertRaises(ValueError):
+            stream_olaf(fn, channel=10)
+
+
+class TestProcessStream(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fn = os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_matches_batch(self):
+        dat, chunks = stream_gssi(self.fn, block_traces=25, poll=0., timeout=0.)
+        got = list(Streaming.process_stream(dat, chunks, dc=True, vbp=(100., 400.), restack=3))
+        self.assertTrue(dat.flags.restack)
+        self.assertEqual(dat.flags.bpass[0], 1)
+
+        full = load_gssi(self.fn)
+        full.data = full.data - np.mean(full.data, axis=0)
+        full.vertical_band_pass(100., 400.)
+        full.restack(3)
+        data = np.hstack([chunk[0] for chunk in got])
+        self.assertEqual(data.shape, full.data.shape)
+        self.assertTrue(np.allclose(data, full.data))
+
+        fn = os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd')
+        dat, chunks = stream_olaf(fn, block_traces=4, poll=0., timeout=0.)
+        got = list(Streaming.process_stream(dat, chunks, restack=3, rgain=0.01))
+        self.assertTrue(dat.flags.rgain)
+        full = load_olaf(fn)
+        full.restack(3)
+        full.rangegain(0.01)
+        data = np.hstack([chunk[0] for chunk in got])
+        self.assertEqual(data.shape, full.data.shape)
+        self.assertTrue(np.allclose(data, full.data))
+
+    @unittest.skipIf(not H5, 'No h5py on this version')
+    def test_writer(self):
+        fn_out = os.path.join(self.tmpdir, 'out.h5')
+        dat, chunks = stream_gssi(self.fn, block_traces=100, poll=0., timeout=0.)
+        with Streaming.StreamWriter(fn_out, dat, chunk_traces=16) as writer:
+            for data, attrs in Streaming.process_stream(dat, chunks, restack=3):
+                writer.append(data, attrs)
+        out = load_h5(fn_out)
+        self.assertEqual(out.tnum, 343 // 3)
+        self.assertTrue(np.all(out.trace_num == np.arange(out.tnum) + 1))
+        self.assertTrue(out.flags.restack)
+
+        full = load_gssi(self.fn)
+        full.restack(3)
+        self.assertTrue(np.allclose(out.data, full.data))
+
+    @unittest.skipIf(not H5, 'No h5py on this version')
+    def test_stream_and_save(self):
+        fn_out = os.path.join(self.tmpdir, 'out.h5')
+        Streaming.stream_and_save(os.path.join(THIS_DIR, 'input_data', 'test_gecko.gtd'), filetype='gecko', o=fn_out,
+                                  vbp=(1., 10.), timeout=0.)
+        out = load_h5(fn_out)
+        self.assertEqual(out.flags.bpass[0], 1)
+        self.assertEqual(out.tnum, 21)
+
+        with self.assertRaises(ValueError):
+            Streaming.stream_and_save(fn_out, filetype='mat')
+
+
+class TestLiveRadargram(unittest.TestCase):
+
+    def test_update(self):
+        dat = load_gssi(os.path.join(THIS_DIR, 'input_data', 'test_gssi.DZT'))
+        live = LiveRadargram(dat, max_traces=100)
+        live.update(dat.data[:, :30])
+        self.assertTrue(np.all(np.isnan(live.traces[:, :70])))
+        self.assertTrue(np.all(live.traces[:, 70:] == dat.data[:, :30]))
+        live.update(dat.data[:, 30:200])
+        self.assertTrue(np.all(live.traces == dat.data[:, 100:200]))
+        self.assertEqual(live.tnum, 200)
+        plt.close('all')
+
+
+if __name__ == '__main__':
+    unittest.main()